@@ -0,0 +1,116 @@
+"""
+Local stand-in for the Ollama HTTP API, for latency tests without a model.
+
+Implements streaming and non-streaming /api/chat and /api/generate. The
+reply echoes the last user message word by word, with a configurable
+delay before the first token and between tokens.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self.send_error(404)
+            return
+        self.server.requests.append({"path": self.path, "body": body})
+        is_chat = self.path == "/api/chat"
+        prompt = body["messages"][-1]["content"] if is_chat else body.get("prompt", "")
+        tokens = [f"{word} " for word in f"You said: {prompt}".split()]
+
+        time.sleep(self.server.first_token_delay)
+        if not body.get("stream", True):
+            self._send_json(200, self._chunk(body, is_chat, "".join(tokens), done=True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, token in enumerate(tokens):
+            if index:
+                time.sleep(self.server.token_delay)
+            self._write_chunk(self._chunk(body, is_chat, token, done=False))
+        self._write_chunk(self._chunk(body, is_chat, "", done=True))
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _chunk(self, body, is_chat, content, done):
+        chunk = {
+            "model": body.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": done,
+        }
+        if is_chat:
+            chunk["message"] = {"role": "assistant", "content": content}
+        else:
+            chunk["response"] = content
+        if done:
+            chunk["done_reason"] = "stop"
+        return chunk
+
+    def _write_chunk(self, payload):
+        data = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), first_token_delay=0.05, token_delay=0.01):
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.requests = []
+        self.connections = 0
+        super().__init__(address, FakeOllamaHandler)
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-stream are what the latency and cancellation tests do
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--first-token-delay", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    args = parser.parse_args()
+    server = FakeOllamaServer(("127.0.0.1", args.port), args.first_token_delay, args.token_delay)
+    print(f"Fake Ollama listening on {server.url}")
+    server.serve_forever()
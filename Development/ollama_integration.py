@@ -1,9 +1,10 @@
 import os
 import time
-from ollama import chat, ChatResponse
+from ollama import chat, ChatResponse, Client
 
-# Path to the transcribed text file
-TRANSCRIBED_TEXT_FILE = "transcribed_text.txt"
+from utterance_queue import DEFAULT_ADDRESS, UtteranceQueue, UtteranceServer
+
+MODEL = os.environ.get("OLLAMA_MODEL", "llama3.1")
 
 def process_with_llama(prompt):
     """
@@ -11,38 +12,80 @@ def process_with_llama(prompt):
     """
     try:
         # Query the Llama model
-        response: ChatResponse = chat(model="llama3.1", messages=[
+        response: ChatResponse = chat(model=MODEL, messages=[
             {'role': 'user', 'content': prompt}
         ])
         return response.message.content
     except Exception as e:
         return f"Error querying Llama: {str(e)}"
 
-def process_transcribed_text():
+def build_prompt(batch):
     """
-    Continuously monitors the transcribed text file and processes new queries with Llama.
+    Turns a batch of utterances into one prompt, keeping them in the order they were spoken.
     """
-    last_processed_text = None
+    if len(batch) == 1:
+        return batch[0].text
+    return "\n".join(utterance.text for utterance in batch)
 
-    while True:
-        # Check if the transcribed text file exists and has content
-        if os.path.exists(TRANSCRIBED_TEXT_FILE) and os.path.getsize(TRANSCRIBED_TEXT_FILE) > 0:
-            with open(TRANSCRIBED_TEXT_FILE, "r") as file:
-                transcribed_text = file.read().strip()
-            
-            # Only process if the text is new
-            if transcribed_text != last_processed_text:
-                print(f"New transcribed text detected: {transcribed_text}")
-                last_processed_text = transcribed_text
+def stream_with_llama(prompt, client=None):
+    """
+    Streams the Llama response to the given prompt token by token.
+    """
+    client = client or Client()
+    for chunk in client.chat(model=MODEL, messages=[{'role': 'user', 'content': prompt}], stream=True):
+        if chunk.message.content:
+            yield chunk.message.content
 
-                # Generate Llama response
-                print("Processing with Llama...")
-                llama_response = process_with_llama(transcribed_text)
-                print("Llama Response:")
-                print(llama_response)
-        
-        time.sleep(1)
+def process_transcribed_text(queue, client=None, max_batches=None, echo=True):
+    """
+    Answers utterances from the queue as they arrive.
+
+    Utterances spoken while a response is being generated are answered
+    together in the next batch. Returns per-batch stats including the
+    latency from the end of speech to the first LLM token.
+    """
+    stats = []
+    while max_batches is None or len(stats) < max_batches:
+        batch = queue.get_batch()
+        if not batch:
+            break  # queue closed
+        prompt = build_prompt(batch)
+        if echo:
+            print(f"New transcribed text ({len(batch)} utterance(s)): {prompt}")
+            print("Llama Response:")
+
+        first_token_at = None
+        response = []
+        try:
+            for token in stream_with_llama(prompt, client):
+                if first_token_at is None:
+                    first_token_at = time.time()
+                response.append(token)
+                if echo:
+                    print(token, end="", flush=True)
+        except Exception as e:
+            response.append(f"Error querying Llama: {str(e)}")
+        if echo:
+            print()
+
+        stats.append({
+            'seqs': [utterance.seq for utterance in batch],
+            'response': "".join(response),
+            # Measured from the most recent utterance, the one the user is waiting on
+            'first_token_latency': first_token_at - batch[-1].ended_at if first_token_at else None,
+        })
+        if echo and first_token_at:
+            print(f"[first token {stats[-1]['first_token_latency'] * 1000:.0f} ms after speech ended]")
+    return stats
 
 if __name__ == "__main__":
-    print("Waiting for transcribed text...")
-    process_transcribed_text()
+    queue = UtteranceQueue()
+    server = UtteranceServer(queue, DEFAULT_ADDRESS)
+    server.start()
+    print(f"Waiting for transcribed text on {DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}...")
+    try:
+        process_transcribed_text(queue)
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        server.shutdown()
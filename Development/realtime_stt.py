@@ -1,14 +1,23 @@
 from RealtimeSTT import AudioToTextRecorder
+import time
 import torch
 
-# File to store the transcribed text
-TRANSCRIBED_TEXT_FILE = "transcribed_text.txt"
+from utterance_queue import DEFAULT_ADDRESS, UtteranceClient
+
+# Connection to ollama_integration.py, which must be running first
+client = None
+# When the last utterance stopped, for speech-end to first-token latency
+speech_ended_at = None
+
+def mark_speech_end():
+    global speech_ended_at
+    speech_ended_at = time.time()
 
 def process_text(text):
     print(f"Recognized Text: {text}")
-    # Save the transcribed text to a file
-    with open(TRANSCRIBED_TEXT_FILE, "w") as file:
-        file.write(text)
+    if text.strip():
+        # Blocks while the LLM side is backed up instead of overwriting earlier text
+        client.send(text, ended_at=speech_ended_at)
 
 if __name__ == '__main__':
     try:
@@ -28,7 +37,8 @@ if __name__ == '__main__':
         
         # Initialize the recorder with GPU support if available, else CPU
         device = "cuda" if cuda_available else "cpu"
-        recorder = AudioToTextRecorder(device=device, model="base.en")
+        client = UtteranceClient(DEFAULT_ADDRESS)
+        recorder = AudioToTextRecorder(device=device, model="base.en", on_recording_stop=mark_speech_end)
         print(f"Recorder initialized on {device}. Waiting for input...")
 
         # Start real-time transcription
@@ -47,5 +57,7 @@ if __name__ == '__main__':
             if 'recorder' in locals() and recorder:
                 recorder.stop()
                 print("Recorder stopped.")
+            if client:
+                client.close()
         except Exception as cleanup_error:
             print(f"Error during cleanup: {cleanup_error}")
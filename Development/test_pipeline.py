@@ -0,0 +1,80 @@
+"""
+Tests for the recognizer -> LLM pipeline against a local Ollama stand-in.
+
+Run from this directory with: python -m unittest test_pipeline
+"""
+import statistics
+import threading
+import time
+import unittest
+
+from ollama import Client
+
+from fake_ollama import FakeOllamaServer
+from ollama_integration import process_transcribed_text
+from utterance_queue import QueueFull, UtteranceClient, UtteranceQueue, UtteranceServer
+
+
+class PipelineTests(unittest.TestCase):
+    def setUp(self):
+        self.ollama = FakeOllamaServer(first_token_delay=0.05, token_delay=0.02)
+        self.ollama.start()
+        self.queue = UtteranceQueue(maxsize=4)
+        self.server = UtteranceServer(self.queue, ("127.0.0.1", 0), put_timeout=0.2)
+        self.server.start()
+        self.client = UtteranceClient(self.server.server_address)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.ollama.shutdown()
+        self.ollama.server_close()
+
+    def _consume(self, max_batches):
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(stats=process_transcribed_text(
+            self.queue, Client(host=self.ollama.url), max_batches=max_batches, echo=False
+        )))
+        thread.start()
+        return thread, result
+
+    def test_speech_end_to_first_token_latency(self):
+        thread, result = self._consume(max_batches=5)
+        for index in range(5):
+            self.client.send(f"question number {index}", ended_at=time.time())
+            # Wait for the answer so every utterance gets its own batch
+            while len(self.ollama.requests) <= index:
+                time.sleep(0.005)
+            time.sleep(0.3)
+        thread.join(timeout=10)
+        latencies = [batch['first_token_latency'] for batch in result['stats']]
+        # The stand-in takes 50 ms to the first token; the pipeline should add little
+        self.assertLess(max(latencies), 0.25, msg=(
+            f"speech end -> first token: median {statistics.median(latencies) * 1000:.0f} ms, "
+            f"max {max(latencies) * 1000:.0f} ms"
+        ))
+
+    def test_utterances_during_generation_are_batched_in_order(self):
+        thread, result = self._consume(max_batches=2)
+        self.client.send("first")
+        while not self.ollama.requests:
+            time.sleep(0.005)
+        # Spoken while "first" is still being answered
+        self.client.send("second")
+        self.client.send("third")
+        thread.join(timeout=10)
+        self.assertEqual([batch['seqs'] for batch in result['stats']], [[0], [1, 2]])
+        self.assertEqual(self.ollama.requests[1]['body']['messages'][-1]['content'], "second\nthird")
+
+    def test_full_queue_pushes_back_on_the_recognizer(self):
+        for index in range(4):
+            self.client.send(f"utterance {index}")
+        with self.assertRaises(QueueFull):
+            self.client.send("one too many")
+        # Nothing queued earlier was lost or overwritten
+        self.assertEqual([u.text for u in self.queue.get_batch()], [f"utterance {i}" for i in range(4)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Message queue between the speech recognizer and the LLM consumer.
+
+Replaces the transcribed_text.txt hand-off. Every utterance is kept (no
+overwrites), delivered in arrival order, and the recognizer is slowed down
+instead of utterances being dropped when the consumer falls behind. The
+consumer takes everything that arrived during its last generation as one
+batch.
+
+The recognizer and the consumer can share an UtteranceQueue in one
+process, or run as two processes connected by UtteranceServer and
+UtteranceClient over a local socket.
+"""
+import json
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+DEFAULT_ADDRESS = ("127.0.0.1", 8765)
+
+
+class QueueFull(Exception):
+    """Raised when an utterance could not be queued before the timeout."""
+
+
+@dataclass
+class Utterance:
+    seq: int
+    text: str
+    ended_at: float = field(default_factory=time.time)  # wall clock time the speech ended
+
+
+class UtteranceQueue:
+    """Bounded FIFO of utterances that hands the consumer whole batches."""
+
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._items = deque()
+        self._condition = threading.Condition()
+        self._next_seq = 0
+        self._closed = False
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+    def put(self, text, ended_at=None, timeout=None):
+        """Queue an utterance, blocking while the queue is full.
+
+        Raises QueueFull if there is still no room after ``timeout`` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self._items) < self.maxsize or self._closed, timeout):
+                raise QueueFull(f"Utterance queue is full ({self.maxsize} waiting)")
+            if self._closed:
+                raise QueueFull("Utterance queue is closed")
+            utterance = Utterance(self._next_seq, text, ended_at if ended_at is not None else time.time())
+            self._next_seq += 1
+            self._items.append(utterance)
+            self._condition.notify_all()
+            return utterance
+
+    def get_batch(self, max_items=None, timeout=None):
+        """Wait for at least one utterance and return every pending one, oldest first.
+
+        Returns an empty list on timeout or once the queue is closed and drained.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._items or self._closed, timeout)
+            count = len(self._items) if max_items is None else min(max_items, len(self._items))
+            batch = [self._items.popleft() for _ in range(count)]
+            if batch:
+                # Wake producers waiting for room
+                self._condition.notify_all()
+            return batch
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _UtteranceHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # One JSON object per line; the ack is only sent once the utterance is
+        # queued, so a full queue holds the sender back
+        for line in self.rfile:
+            message = json.loads(line)
+            try:
+                utterance = self.server.queue.put(
+                    message['text'], message.get('ended_at'), timeout=self.server.put_timeout
+                )
+                reply = {'ok': True, 'seq': utterance.seq}
+            except QueueFull as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class UtteranceServer(socketserver.ThreadingTCPServer):
+    """Local socket front end that feeds remote utterances into an UtteranceQueue."""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, queue, address=DEFAULT_ADDRESS, put_timeout=None):
+        self.queue = queue
+        self.put_timeout = put_timeout
+        super().__init__(address, _UtteranceHandler)
+
+    def start(self):
+        """Serve on a daemon thread and return it."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class UtteranceClient:
+    """Recognizer side of the socket: send an utterance and wait until it is queued."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=None):
+        self._socket = socket.create_connection(address, timeout=timeout)
+        self._file = self._socket.makefile('rwb')
+
+    def send(self, text, ended_at=None):
+        """Queue ``text`` on the server and return its sequence number."""
+        message = {'text': text, 'ended_at': ended_at if ended_at is not None else time.time()}
+        self._file.write(json.dumps(message).encode() + b'\n')
+        self._file.flush()
+        reply = json.loads(self._file.readline())
+        if not reply['ok']:
+            raise QueueFull(reply['error'])
+        return reply['seq']
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
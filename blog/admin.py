@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import ImageAnalysis, DetectedObject, UserProfile
+from .models import ImageAnalysis, DetectedObject, UserProfile, ChatTurn
 
 class DetectedObjectInline(admin.TabularInline):
     model = DetectedObject
@@ -13,27 +13,33 @@ class DetectedObjectInline(admin.TabularInline):
     
     position.short_description = "Bounding Box"
 
+class ChatTurnInline(admin.TabularInline):
+    model = ChatTurn
+    extra = 0
+    readonly_fields = ['question', 'answer', 'user', 'created_at', 'latency']
+    fields = ['created_at', 'user', 'question', 'answer', 'latency']
+
 @admin.register(ImageAnalysis)
 class ImageAnalysisAdmin(admin.ModelAdmin):
     list_display = ['id', 'thumbnail', 'short_caption_preview', 'upload_date']
     list_display_links = ['id', 'thumbnail']
     search_fields = ['short_caption', 'query_text', 'query_result']
     list_filter = ['upload_date']
-    readonly_fields = ['image_preview', 'upload_date', 'short_caption', 'query_text', 'query_result']
+    readonly_fields = ['image_preview', 'upload_date', 'content_hash', 'short_caption', 'query_text', 'query_result', 'transcription_time', 'query_time']
     fieldsets = [
         ('Image', {
-            'fields': ['image', 'image_preview', 'upload_date']
+            'fields': ['image', 'image_preview', 'upload_date', 'content_hash']
         }),
         ('Generated Content', {
             'fields': ['short_caption'],
             'classes': ['wide']
         }),
         ('Visual Query', {
-            'fields': ['query_text', 'query_result'],
+            'fields': ['query_text', 'query_result', 'transcription_time', 'query_time'],
             'classes': ['wide']
         })
     ]
-    inlines = [DetectedObjectInline]
+    inlines = [DetectedObjectInline, ChatTurnInline]
     
     def thumbnail(self, obj):
         if obj.image:
@@ -0,0 +1,139 @@
+import base64
+import io
+import json
+import logging
+import os
+import time
+import wave
+
+import av
+import numpy as np
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000  # what Whisper expects
+
+
+def decode_audio(source, sampling_rate=SAMPLE_RATE):
+    """Decode any container PyAV understands into 16 kHz mono float32 samples.
+
+    ``source`` can be raw bytes, a path or a binary file-like object. The
+    result can be passed straight to ``WhisperModel.transcribe`` without a
+    temporary WAV file.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=sampling_rate)
+    chunks = []
+    with av.open(source, mode='r') as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+        # Flush samples still buffered in the resampler
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+    # Convert straight into the final float32 buffer, skipping an int16 concatenate
+    audio = np.empty(sum(len(chunk) for chunk in chunks), dtype=np.float32)
+    position = 0
+    for chunk in chunks:
+        audio[position:position + len(chunk)] = chunk
+        position += len(chunk)
+    audio /= 32768.0
+    return audio
+
+
+def encode_webm(audio, sampling_rate=SAMPLE_RATE):
+    """Encode float32 samples as WebM/Opus, like a browser MediaRecorder upload."""
+    out = io.BytesIO()
+    with av.open(out, 'w', format='webm') as container:
+        stream = container.add_stream('libopus', rate=48000)
+        stream.layout = 'mono'
+        resampler = av.AudioResampler(format='s16', layout='mono', rate=48000)
+        samples = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+        for start in range(0, len(samples), sampling_rate // 10):
+            frame = av.AudioFrame.from_ndarray(samples[start:start + sampling_rate // 10].reshape(1, -1),
+                                               format='s16', layout='mono')
+            frame.sample_rate = sampling_rate
+            for resampled in resampler.resample(frame):
+                for packet in stream.encode(resampled):
+                    container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def save_debug_wav(audio, sampling_rate=SAMPLE_RATE):
+    """Write decoded samples to MEDIA_ROOT/recorded_audio when STT_SAVE_DEBUG_AUDIO is on.
+
+    Returns the path of the written file, or None when debug audio is disabled.
+    """
+    if not getattr(settings, 'STT_SAVE_DEBUG_AUDIO', False):
+        return None
+    recorded_dir = os.path.join(settings.MEDIA_ROOT, "recorded_audio")
+    os.makedirs(recorded_dir, exist_ok=True)
+    path = os.path.join(recorded_dir, f"audio_{time.time_ns()}.wav")
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sampling_rate)
+        wf.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+    logger.info(f"WAV file saved for debugging: {path}")
+    return path
+
+
+class RequestAudioStream:
+    """Read-only, non-seekable view of a raw request body for the decoder.
+
+    PyAV pulls the body through ``read`` in small blocks, so the recording is
+    decoded as it arrives instead of being buffered whole. Bodies larger
+    than ``max_bytes`` are rejected.
+    """
+
+    def __init__(self, request, max_bytes):
+        self._request = request
+        self._max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self._request.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self._max_bytes:
+            raise ValueError(f"Audio upload exceeds {self._max_bytes} bytes")
+        return data
+
+
+def read_request_audio(request):
+    """Decode the audio sent to speech_to_text, whatever the upload style.
+
+    Supports raw ``audio/*`` bodies (streamed to the decoder), multipart
+    uploads with an ``audio`` file field and the original JSON body with an
+    ``audio_base64`` data URL. Returns None when no audio was sent.
+    """
+    content_type = request.content_type or ''
+    if content_type.startswith('audio/'):
+        if not int(request.META.get('CONTENT_LENGTH') or 0) and 'HTTP_TRANSFER_ENCODING' not in request.META:
+            return None
+        logger.info(f"Received raw {content_type} audio body")
+        max_bytes = getattr(settings, 'STT_MAX_UPLOAD_BYTES', settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        return decode_audio(RequestAudioStream(request, max_bytes))
+
+    if content_type == 'multipart/form-data':
+        upload = request.FILES.get('audio')
+        if upload is None:
+            return None
+        logger.info(f"Received multipart audio: {upload.name}, {upload.size} bytes")
+        return decode_audio(upload)
+
+    # Legacy JSON body with a base64 data URL
+    data = json.loads(request.body)
+    audio_b64 = data.get("audio_base64")
+    logger.info(f"Received audio: {type(audio_b64)}, length: {len(audio_b64) if audio_b64 else 'None'}")
+    if not audio_b64:
+        return None
+    header_removed = audio_b64.split(",")[1] if "," in audio_b64 else audio_b64
+    audio_bytes = base64.b64decode(header_removed)
+    del data, audio_b64, header_removed
+    logger.info(f"Decoded audio bytes: {len(audio_bytes)}")
+    return decode_audio(audio_bytes)
@@ -0,0 +1,350 @@
+"""
+Autoscaling of model-resident RQ inference workers.
+
+One ScalingPolicy drives both the live Supervisor, which watches the RQ
+queues and spawns or retires pinned workers (see inference_pool), and
+simulate(), which replays an arrival trace offline so a policy can be
+evaluated without Redis or models.
+"""
+import json
+import logging
+import math
+import random
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .inference_pool import InferencePool, serve_queues
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _autoscale_settings():
+    options = {
+        'QUEUES': ['high', 'default', 'low'],
+        'MIN_WORKERS': 1,
+        'MAX_WORKERS': 4,
+        'MEMORY_BUDGET_MB': 8192,
+        'WORKER_MEMORY_MB': 1500,
+        'TARGET_WAIT_S': 30,
+        'JOBS_PER_WORKER': 2,
+        'SCALE_DOWN_IDLE_S': 300,
+        'COOLDOWN_S': 120,
+        'STARTUP_S': 30,
+        'INTERVAL_S': 5,
+    }
+    options.update(getattr(settings, 'RQ_AUTOSCALER', {}))
+    return options
+
+
+@dataclass
+class QueueState:
+    depth: int = 0
+    oldest_age: float = 0.0  # seconds the oldest waiting job has been queued
+
+
+class ScalingPolicy:
+    """Decides how many workers should be running.
+
+    Scales up as soon as the backlog exceeds ``jobs_per_worker`` per worker
+    or the oldest job has waited longer than ``target_wait``. Workers that
+    are still starting count towards the backlog, and after a scale-up a
+    long wait alone adds no further worker for ``startup`` seconds, the
+    time the new one needs to load its models. Scales down one worker at
+    a time once the queues have been empty for ``scale_down_idle`` seconds
+    and nothing changed for ``cooldown`` seconds. Never exceeds
+    ``max_workers`` or what ``memory_budget`` fits next to draining workers.
+    """
+
+    def __init__(self, min_workers=1, max_workers=4, memory_budget=8192, worker_memory=1500, target_wait=30,
+                 jobs_per_worker=2, scale_down_idle=300, cooldown=120, startup=30):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.worker_memory = worker_memory
+        self.target_wait = target_wait
+        self.jobs_per_worker = jobs_per_worker
+        self.scale_down_idle = scale_down_idle
+        self.cooldown = cooldown
+        self.startup = startup
+        self._last_change = -math.inf
+        self._last_scale_up = -math.inf
+        self._idle_since = None
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        options = _autoscale_settings()
+        kwargs = {
+            'min_workers': options['MIN_WORKERS'],
+            'max_workers': options['MAX_WORKERS'],
+            'memory_budget': options['MEMORY_BUDGET_MB'],
+            'worker_memory': options['WORKER_MEMORY_MB'],
+            'target_wait': options['TARGET_WAIT_S'],
+            'jobs_per_worker': options['JOBS_PER_WORKER'],
+            'scale_down_idle': options['SCALE_DOWN_IDLE_S'],
+            'cooldown': options['COOLDOWN_S'],
+            'startup': options['STARTUP_S'],
+        }
+        kwargs.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**kwargs)
+
+    def capacity(self, worker_memory=None, draining_memory=0):
+        """Most workers allowed, given the measured memory per worker (MB) if known.
+
+        ``draining_memory`` is what retired workers still hold (MB) until
+        they finish their last job and exit.
+        """
+        per_worker = max(worker_memory or 0, self.worker_memory)
+        budget = max(0, self.memory_budget - draining_memory)
+        return max(0, min(self.max_workers, int(budget // per_worker)))
+
+    def desired(self, queues, workers, now, worker_memory=None, draining_memory=0):
+        """Worker count wanted at ``now`` with ``workers`` running or starting."""
+        depth = sum(state.depth for state in queues.values())
+        oldest = max((state.oldest_age for state in queues.values()), default=0.0)
+        capacity = self.capacity(worker_memory)
+        floor = min(self.min_workers, capacity)
+        if depth:
+            self._idle_since = None
+        elif self._idle_since is None:
+            self._idle_since = now
+
+        want = workers
+        backlog = math.ceil(depth / self.jobs_per_worker)
+        if backlog > workers:
+            want = backlog
+        elif oldest > self.target_wait and now - self._last_scale_up >= self.startup:
+            # Jobs wait although the backlog fits: add one and give it time to load
+            want = workers + 1
+        elif (depth == 0 and now - self._idle_since >= self.scale_down_idle
+                and now - self._last_change >= self.cooldown):
+            want = workers - 1
+        want = max(floor, min(capacity, want))
+        if want > workers:
+            # New workers must also fit next to the draining ones, which aren't counted in ``workers``
+            want = max(workers, min(want, self.capacity(worker_memory, draining_memory)))
+        if want != workers:
+            self._last_change = now
+            if want > workers:
+                self._last_scale_up = now
+            if want < workers:
+                # The next worker only goes after another full idle period
+                self._idle_since = now
+        return want
+
+
+def observe_queues(names):
+    """Depth and age of the oldest job of each RQ queue."""
+    import django_rq
+
+    states = {}
+    now = datetime.now(timezone.utc)
+    for name in names:
+        queue = django_rq.get_queue(name)
+        state = QueueState(depth=queue.count)
+        for job_id in queue.get_job_ids(0, 1):
+            job = queue.fetch_job(job_id)
+            if job is not None and job.enqueued_at is not None:
+                enqueued_at = job.enqueued_at
+                if enqueued_at.tzinfo is None:
+                    enqueued_at = enqueued_at.replace(tzinfo=timezone.utc)
+                state.oldest_age = max(0.0, (now - enqueued_at).total_seconds())
+        states[name] = state
+    return states
+
+
+class Supervisor:
+    """Keeps the number of pinned RQ workers where the policy wants it.
+
+    Every worker owns one of ``max_workers`` disjoint core sets. Retired
+    workers get SIGTERM, finish their current job (RQ warm shutdown) and
+    count as draining, not running, until they exit.
+    """
+
+    def __init__(self, policy, queues, cores=None, models=('vlm',)):
+        self.policy = policy
+        self.queues = list(queues)
+        self.pool = InferencePool(policy.max_workers, cores, models)
+        self._slots = {index: None for index in range(len(self.pool.core_sets))}
+        self._draining = set()
+
+    def active(self):
+        return [process for process in self.pool.processes if process.pid not in self._draining]
+
+    def worker_memory(self, memory=None):
+        """Mean PSS in MB of the running workers, or None before any has started."""
+        memory = self.pool.memory() if memory is None else memory
+        measured = [m['pss'] for pid, m in memory.items() if m['pss'] and pid not in self._draining]
+        return statistics.mean(measured) if measured else None
+
+    def draining_memory(self, memory=None):
+        """PSS in MB still held by draining workers, at the estimate where unmeasured."""
+        memory = self.pool.memory() if memory is None else memory
+        return sum(m['pss'] or self.policy.worker_memory for pid, m in memory.items() if pid in self._draining)
+
+    def step(self, now=None):
+        now = time.monotonic() if now is None else now
+        for process in self.pool.reap():
+            self._draining.discard(process.pid)
+            for index, owner in self._slots.items():
+                if owner is process:
+                    self._slots[index] = None
+            if process.exitcode:
+                logger.warning(f"Worker {process.pid} exited with code {process.exitcode}")
+
+        states = observe_queues(self.queues)
+        active = self.active()
+        memory = self.pool.memory()
+        want = self.policy.desired(states, len(active), now, self.worker_memory(memory), self.draining_memory(memory))
+        while len(active) < want:
+            index = next((index for index, owner in self._slots.items() if owner is None), None)
+            if index is None:
+                break  # every core set is taken, some by draining workers
+            process = self.pool.spawn(self.pool.core_sets[index], serve_queues, (self.queues,))
+            self._slots[index] = process
+            active.append(process)
+        if len(active) > want:
+            for process in self._retirement_order(active)[:len(active) - want]:
+                logger.info(f"Draining worker {process.pid}")
+                self.pool.retire(process)
+                self._draining.add(process.pid)
+        return states, want
+
+    def _retirement_order(self, active):
+        # Idle workers first so nothing waits on a drain, newest first otherwise
+        idle = set()
+        try:
+            import django_rq
+            from rq import Worker
+            connection = django_rq.get_connection(self.queues[0])
+            idle = {worker.pid for worker in Worker.all(connection=connection) if worker.get_state() == 'idle'}
+        except Exception as e:
+            logger.debug(f"Could not read RQ worker states: {str(e)}")
+        return sorted(active, key=lambda process: (process.pid not in idle, -active.index(process)))
+
+    def shutdown(self):
+        self.pool.stop()
+
+
+def synthetic_trace(duration, base_rate, peak_rate, period=3600, queue_mix=None, seed=0):
+    """Poisson arrivals whose rate swings between ``base_rate`` and ``peak_rate`` jobs/s.
+
+    Returns sorted ``(time, queue)`` pairs; the rate peaks mid-period.
+    """
+    queue_mix = queue_mix or {'high': 0.1, 'default': 0.7, 'low': 0.2}
+    rng = random.Random(seed)
+    names, weights = zip(*queue_mix.items())
+    arrivals = []
+    t = 0.0
+    # Thinning: draw at the peak rate, keep each arrival with rate(t) / peak
+    while True:
+        t += rng.expovariate(peak_rate)
+        if t >= duration:
+            return arrivals
+        rate = base_rate + (peak_rate - base_rate) * (1 - math.cos(2 * math.pi * t / period)) / 2
+        if rng.random() < rate / peak_rate:
+            arrivals.append((t, rng.choices(names, weights)[0]))
+
+
+def load_trace(path):
+    """Arrivals from a JSON list of {"t": seconds, "queue": name} or "t,queue" CSV lines."""
+    with open(path) as f:
+        if path.endswith('.json'):
+            return sorted((float(item['t']), item.get('queue', 'default')) for item in json.load(f))
+        arrivals = []
+        for line in f:
+            fields = line.strip().split(',')
+            if fields[0] and fields[0][0].isdigit():
+                arrivals.append((float(fields[0]), fields[1] if len(fields) > 1 else 'default'))
+        return sorted(arrivals)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def simulate(trace, policy=None, workers=None, queues=('high', 'default', 'low'), service_time=4.0,
+             startup_time=30.0, interval=5.0, tick=0.5, seed=0):
+    """Replay ``trace`` against the policy, or a fixed number of ``workers``.
+
+    ``service_time`` is the mean seconds per job (a number or a dict per
+    queue), drawn from an exponential distribution. New workers take
+    ``startup_time`` to load their models before taking jobs and retired
+    workers finish their current job first, as in the live supervisor.
+    """
+    rng = random.Random(seed)
+    mean_service = service_time if isinstance(service_time, dict) else {name: service_time for name in queues}
+    waiting = {name: deque() for name in queues}
+    pool = []  # dicts: ready_at, busy_until, draining
+    if workers is not None:
+        pool = [{'ready_at': 0.0, 'busy_until': 0.0, 'draining': False} for _ in range(workers)]
+    waits = {name: [] for name in queues}
+    worker_seconds = 0.0
+    peak = len(pool)
+    scale_events = 0
+    timeline = []
+    duration = (trace[-1][0] if trace else 0.0) + startup_time
+    arrivals = deque(trace)
+    next_decision = 0.0
+    t = 0.0
+    while t < duration or any(waiting.values()) or any(w['busy_until'] > t for w in pool):
+        while arrivals and arrivals[0][0] <= t:
+            arrived_at, name = arrivals.popleft()
+            waiting[name if name in waiting else queues[-1]].append(arrived_at)
+
+        for worker in pool:
+            if worker['draining'] or worker['ready_at'] > t or worker['busy_until'] > t:
+                continue
+            # RQ workers take the first non-empty queue in priority order
+            name = next((name for name in queues if waiting[name]), None)
+            if name is None:
+                continue
+            arrived_at = waiting[name].popleft()
+            start = max(t, arrived_at)
+            waits[name].append(start - arrived_at)
+            worker['busy_until'] = start + rng.expovariate(1 / mean_service[name])
+
+        if policy is not None and t >= next_decision:
+            states = {
+                name: QueueState(len(jobs), t - jobs[0] if jobs else 0.0) for name, jobs in waiting.items()
+            }
+            active = [w for w in pool if not w['draining']]
+            want = policy.desired(states, len(active), t,
+                                  draining_memory=(len(pool) - len(active)) * policy.worker_memory)
+            if want > len(active):
+                pool.extend({'ready_at': t + startup_time, 'busy_until': 0.0, 'draining': False}
+                            for _ in range(want - len(active)))
+                scale_events += 1
+            elif want < len(active):
+                # Idle workers first, like the supervisor
+                for worker in sorted(active, key=lambda w: w['busy_until'] > t)[:len(active) - want]:
+                    worker['draining'] = True
+                scale_events += 1
+            timeline.append((t, sum(len(jobs) for jobs in waiting.values()), want))
+            next_decision = t + interval
+
+        pool = [w for w in pool if not (w['draining'] and w['busy_until'] <= t)]
+        peak = max(peak, len(pool))
+        worker_seconds += len(pool) * tick
+        t += tick
+
+    all_waits = [wait for values in waits.values() for wait in values]
+    return {
+        'jobs': len(all_waits),
+        'wait_p50': _percentile(all_waits, 0.5),
+        'wait_p95': _percentile(all_waits, 0.95),
+        'wait_max': max(all_waits, default=0.0),
+        'wait_p95_by_queue': {name: _percentile(values, 0.95) for name, values in waits.items()},
+        'worker_hours': worker_seconds / 3600,
+        'peak_workers': peak,
+        'scale_events': scale_events,
+        'timeline': timeline,
+    }
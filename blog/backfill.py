@@ -0,0 +1,171 @@
+"""
+Re-captioning of analyses produced by an older model, prompt or generation config.
+
+Every analysis records a ``config_hash`` (see ModelHandler.result_provenance).
+The backfill walks the stale rows in primary key windows, sorts each window
+by image size so one batch holds images of similar cost, and enqueues the
+batches on the low-priority queue. Enqueueing is rate-limited and never
+gets more than a few batches ahead of the workers. The cursor and the
+window's unsent batches are checkpointed after every batch, so a stopped
+run resumes where it left off.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from .embedding_index import add_embeddings
+from .model_handler import ModelHandler
+from .models import ImageAnalysis
+from .resumable import load_state, save_state
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _backfill_settings():
+    options = {
+        'QUEUE': 'low',
+        'WINDOW': 1000,
+        'BATCH_SIZE': 16,
+        'RATE': 2.0,
+        'MAX_PENDING': 4,
+        'STATE_FILE': None,
+    }
+    options.update(getattr(settings, 'RECAPTION_BACKFILL', {}))
+    return options
+
+
+def target_model_id():
+    """The checkpoint the workers serve: the hot-swap target, else the default."""
+    from .model_swap import default_model_id, fleet_target
+
+    try:
+        target = fleet_target()
+    except Exception as e:
+        logger.warning(f"Could not read the fleet model target, assuming the default: {str(e)}")
+        target = None
+    return target['model_id'] if target else default_model_id()
+
+
+def stale_analyses(config_hash):
+    return ImageAnalysis.objects.exclude(config_hash=config_hash)
+
+
+def _image_size(analysis):
+    try:
+        return analysis.image.size
+    except (OSError, ValueError):
+        return 0  # missing file; the job logs and skips it
+
+
+def plan_window(config_hash, after, window, batch_size):
+    """Batches of similarly sized stale analyses among the next ``window`` after pk ``after``.
+
+    Returns the batches (lists of pks) and the last pk covered, or ``([], None)``
+    once no stale rows are left.
+    """
+    rows = list(
+        stale_analyses(config_hash).filter(pk__gt=after).order_by('pk').only('pk', 'image')[:window]
+    )
+    if not rows:
+        return [], None
+    by_size = [analysis.pk for analysis in sorted(rows, key=_image_size)]
+    batches = [by_size[start:start + batch_size] for start in range(0, len(by_size), batch_size)]
+    return batches, rows[-1].pk
+
+
+def recaption_batch(analysis_ids, config_hash):
+    """RQ job: re-run the captions and answer of a batch of analyses.
+
+    Rows already produced by this worker's configuration are skipped, so
+    duplicated or retried batches cost nothing.
+    """
+    handler = ModelHandler.get_instance()
+    provenance = handler.provenance()
+    if provenance['config_hash'] != config_hash:
+        logger.warning(f"Backfill planned for config {config_hash} but this worker runs "
+                       f"{provenance['config_hash']} ({provenance['model_version']}); recording what it ran")
+    updated = 0
+    for analysis in ImageAnalysis.objects.filter(pk__in=analysis_ids).exclude(config_hash=provenance['config_hash']):
+        try:
+            with analysis.image.open('rb') as f:
+                image = handler.prepare_image(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping analysis {analysis.pk}, image unreadable: {str(e)}")
+            continue
+        with handler.capture_embeddings() as embeddings:
+            analysis.short_caption = handler.generate_short_caption(image)
+        fields = ['short_caption']
+        if analysis.normal_caption:
+            analysis.normal_caption = handler.generate_normal_caption(image)
+            fields.append('normal_caption')
+        if analysis.query_text:
+            analysis.query_result = handler.process_query(image, analysis.query_text)
+            fields.append('query_result')
+        for name, value in provenance.items():
+            setattr(analysis, name, value)
+        # save() rather than update() so the fragment cache signals fire
+        analysis.save(update_fields=fields + list(provenance))
+        # The new model's embeddings live in its own store
+        add_embeddings([analysis.pk], embeddings, provenance['model_version'])
+        updated += 1
+    logger.info(f"Re-captioned {updated}/{len(analysis_ids)} analyses")
+    return updated
+
+
+class RecaptionBackfill:
+    """Enqueues stale analyses in checkpointed, rate-limited, size-sorted batches."""
+
+    def __init__(self, config_hash, state_file, queue, window=1000, batch_size=16, rate=2.0, max_pending=4,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.config_hash = config_hash
+        self.state_file = state_file
+        self.queue = queue
+        self.window = window
+        self.batch_size = batch_size
+        self.rate = rate
+        self.max_pending = max_pending
+        self._clock = clock
+        self._sleep = sleep
+        self.state = load_state(state_file)
+        if self.state.get('config_hash') != config_hash:
+            # A new configuration starts a new pass over the table
+            self.state = {'config_hash': config_hash, 'cursor': 0, 'batches': [], 'enqueued': 0}
+        self._next_at = clock()
+
+    def reset(self):
+        self.state = {'config_hash': self.config_hash, 'cursor': 0, 'batches': [], 'enqueued': 0}
+        save_state(self.state_file, self.state)
+
+    def _throttle(self, rows):
+        # Rows per second over the run, and never far ahead of the workers
+        now = self._clock()
+        if self._next_at > now:
+            self._sleep(self._next_at - now)
+        while self.max_pending and self.queue.count >= self.max_pending:
+            self._sleep(1)
+        self._next_at = max(self._next_at, self._clock()) + rows / self.rate
+
+    def run(self, limit=None, progress=None):
+        """Enqueue batches until nothing is stale or ``limit`` rows were sent; returns rows sent."""
+        sent = 0
+        while limit is None or sent < limit:
+            if not self.state['batches']:
+                batches, last = plan_window(self.config_hash, self.state['cursor'], self.window, self.batch_size)
+                if last is None:
+                    self.state['finished'] = True
+                    save_state(self.state_file, self.state)
+                    break
+                self.state.update(batches=batches, cursor=last, finished=False)
+                save_state(self.state_file, self.state)
+            batch = self.state['batches'][0]
+            self._throttle(len(batch))
+            self.queue.enqueue(recaption_batch, batch, self.config_hash)
+            self.state['batches'].pop(0)
+            self.state['enqueued'] += len(batch)
+            save_state(self.state_file, self.state)
+            sent += len(batch)
+            if progress:
+                progress(self.state)
+        return sent
@@ -0,0 +1,237 @@
+"""
+Captioning a whole directory or archive of images (`manage.py caption_dir`).
+
+A thread pool reads and decodes the next images while the model captions
+the current batch; JPEGs are decoded straight at reduced scale when they
+are much larger than the processor's input. Captions are generated in
+batches (ModelHandler.caption_batch) and the rows written with one
+bulk_create per chunk. After every chunk the position in the source is
+checkpointed, so a crashed run resumes after the last committed image.
+The vision embeddings of the captioned images go to the similarity index.
+"""
+import hashlib
+import io
+import logging
+import os
+import tarfile
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+from .embedding_index import add_embeddings
+from .model_handler import ModelHandler
+from .models import ImageAnalysis
+from .persistence import bulk_save_analyses
+from .resumable import iter_files, load_state, save_state
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff'}
+
+
+def _caption_dir_settings():
+    options = {
+        'BATCH_SIZE': 8,
+        'CHUNK_SIZE': 64,
+        'DECODE_WORKERS': 4,
+        'PREFETCH': 32,
+        'STATE_FILE': None,
+    }
+    options.update(getattr(settings, 'CAPTION_DIR', {}))
+    return options
+
+
+def is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _is_archive(path):
+    return os.path.isfile(path) and (zipfile.is_zipfile(path) or tarfile.is_tarfile(path))
+
+
+def iter_source(path, after=''):
+    """Yield ``(key, read)`` for every image in a directory, zip or tar after ``after``.
+
+    Keys are relative paths or member names, in a stable order: sorted for
+    directories and zips, archive order for tars (which are read as a
+    stream). ``read()`` returns the file's bytes.
+    """
+    if os.path.isdir(path):
+        for rel_path, entry in iter_files(path, after or ''):
+            if is_image(rel_path):
+                yield rel_path, lambda entry=entry: _read_file(entry.path)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in _zip_images(archive, after):
+                # Read before yielding: the archive is closed once the caller is done iterating
+                data = archive.read(name)
+                yield name, lambda data=data: data
+    elif tarfile.is_tarfile(path):
+        passed = not after
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if not passed:
+                    passed = member.name == after
+                    continue
+                if member.isfile() and is_image(member.name):
+                    data = archive.extractfile(member).read()  # a stream: must be read in order, here
+                    yield member.name, lambda data=data: data
+    else:
+        raise ValueError(f"{path} is not a directory, zip or tar archive")
+
+
+def _zip_images(archive, after=''):
+    names = (info.filename for info in archive.infolist() if not info.is_dir())
+    return sorted(name for name in names if is_image(name) and name > (after or ''))
+
+
+def count_source(path, after=''):
+    """Images left in ``path`` after ``after``, or None when counting needs a full read (tars)."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return len(_zip_images(archive, after))
+    if _is_archive(path):
+        return None
+    return sum(1 for _ in iter_source(path, after))
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def decode(key, read, max_edge=None):
+    """Read and decode one image off the main thread: ``(key, bytes, RGB image)``."""
+    data = read()
+    image = Image.open(io.BytesIO(data))
+    if max_edge:
+        # JPEG only: decode at 1/2, 1/4 or 1/8 scale, never below max_edge
+        image.draft('RGB', (max_edge, max_edge))
+    image = image.convert('RGB')
+    image.load()
+    return key, data, image
+
+
+class BatchCaptioner:
+    """Captions every image of a directory or archive into ImageAnalysis rows."""
+
+    def __init__(self, path, handler=None, batch_size=8, chunk_size=64, decode_workers=4, prefetch=32,
+                 state_file=None, user=None, query=None, skip_existing=True):
+        self.path = os.path.abspath(path)
+        self.handler = handler or ModelHandler.get_instance()
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.decode_workers = decode_workers
+        self.prefetch = max(prefetch, batch_size)
+        self.state_file = state_file
+        self.user = user
+        self.query = query
+        self.skip_existing = skip_existing
+        self.state = load_state(state_file) if state_file else {}
+        self.provenance = self.handler.provenance()
+        self.stats = {'captioned': 0, 'skipped': 0, 'failed': 0, 'started': time.perf_counter()}
+        self._rows = []
+        self._embeddings = []  # one per row; None where its batch's pooling failed
+        self._last_key = None
+        self._uncommitted = 0  # source items handled since the last checkpoint
+
+    @property
+    def cursor(self):
+        return self.state.get(self.path, {}).get('cursor', '')
+
+    def reset(self):
+        self.state.pop(self.path, None)
+        if self.state_file:
+            save_state(self.state_file, self.state)
+
+    def run(self, progress=None, progress_interval=10):
+        """Caption everything after the checkpoint; ``progress(stats)`` is called periodically."""
+        items = iter_source(self.path, self.cursor)
+        max_edge = self.handler.max_image_edge
+        next_report = time.perf_counter() + progress_interval
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix='decode') as pool:
+            pending = deque()
+
+            def fill():
+                while len(pending) < self.prefetch:
+                    item = next(items, None)
+                    if item is None:
+                        return
+                    pending.append((item[0], pool.submit(decode, *item, max_edge)))
+
+            fill()
+            batch = []
+            while pending:
+                key, future = pending.popleft()
+                fill()
+                try:
+                    batch.append(future.result())
+                except Exception as e:
+                    logger.warning(f"Skipping {key}, not a readable image: {str(e)}")
+                    self.stats['failed'] += 1
+                    batch.append((key, None, None))
+                if len(batch) == self.batch_size or not pending:
+                    self._caption(batch)
+                    batch = []
+                if progress and time.perf_counter() >= next_report:
+                    progress(self.stats)
+                    next_report += progress_interval
+        self._flush()
+        return self.stats
+
+    def _caption(self, batch):
+        decoded = [(key, data, image) for key, data, image in batch if image is not None]
+        hashes = {key: hashlib.sha256(data).hexdigest() for key, data, _ in decoded}
+        if self.skip_existing and decoded:
+            # Already captioned by this configuration, e.g. before a crash between commit and checkpoint
+            existing = set(ImageAnalysis.objects.filter(
+                content_hash__in=hashes.values(), config_hash=self.provenance['config_hash'],
+            ).values_list('content_hash', flat=True))
+            self.stats['skipped'] += sum(1 for key, _, _ in decoded if hashes[key] in existing)
+            decoded = [item for item in decoded if hashes[item[0]] not in existing]
+
+        if decoded:
+            images = [image for _, _, image in decoded]
+            with self.handler.capture_embeddings() as embeddings:
+                captions = self.handler.caption_batch(images, 'short_caption')
+            if len(embeddings) != len(images):
+                embeddings = [None] * len(images)
+            self._embeddings.extend(embeddings)
+            answers = self.handler.caption_batch(images, 'query', self.query) if self.query else [None] * len(images)
+            for (key, data, _), caption, answer in zip(decoded, captions, answers):
+                self._rows.append({
+                    'image': ContentFile(data, name=os.path.basename(key)),
+                    'short_caption': caption,
+                    'query_text': self.query,
+                    'query_result': answer,
+                    'user': self.user,
+                    **self.provenance,
+                })
+            self.stats['captioned'] += len(decoded)
+        self._last_key = batch[-1][0]
+        self._uncommitted += len(batch)
+        if len(self._rows) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            analyses = bulk_save_analyses(self._rows)
+            embedded = [(analysis.pk, vector) for analysis, vector in zip(analyses, self._embeddings)
+                        if vector is not None]
+            if embedded:
+                ids, vectors = zip(*embedded)
+                add_embeddings(ids, vectors, self.provenance['model_version'])
+            self._rows = []
+            self._embeddings = []
+        if self._last_key is not None and self.state_file:
+            entry = self.state.setdefault(self.path, {'cursor': '', 'done': 0})
+            entry['cursor'] = self._last_key
+            entry['done'] += self._uncommitted
+            self._uncommitted = 0
+            save_state(self.state_file, self.state)
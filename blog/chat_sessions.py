@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .model_handler import ModelHandler
+from .models import ChatTurn
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _chat_settings():
+    options = {
+        'MEMORY_BUDGET_MB': 512,
+        'MAX_NEW_TOKENS': 100,
+    }
+    options.update(getattr(settings, 'CHAT_SESSIONS', {}))
+    return options
+
+
+def cache_nbytes(cache):
+    """Bytes held by the key and value tensors of a DynamicCache."""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for tensor in list(cache.key_cache) + list(cache.value_cache)
+    )
+
+
+class ChatSession:
+    """KV cache of one image conversation, covering ``turns`` answered turns."""
+
+    def __init__(self, token_ids, cache, turns, model_version=None):
+        self.token_ids = token_ids
+        self.cache = cache
+        self.turns = turns
+        self.model_version = model_version
+        self.nbytes = cache_nbytes(cache)
+
+
+class ChatSessionStore:
+    """Per-process LRU of image conversations kept warm between turns.
+
+    A follow-up question on a cached conversation only prefills its own
+    tokens; the image and earlier turns stay in the KV cache. Sessions are
+    evicted least recently used first once their caches exceed
+    ``MEMORY_BUDGET_MB``. An evicted or stale conversation is rebuilt from
+    the stored turns on its next question, so eviction only costs latency.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                options = _chat_settings()
+                cls._instance = cls(
+                    memory_budget=int(options['MEMORY_BUDGET_MB'] * 1024 * 1024),
+                    max_new_tokens=options['MAX_NEW_TOKENS'],
+                )
+            return cls._instance
+
+    def __init__(self, memory_budget=512 * 1024 * 1024, max_new_tokens=100, model_handler=None):
+        self.memory_budget = memory_budget
+        self.max_new_tokens = max_new_tokens
+        self._model_handler = model_handler
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'rebuilds': 0, 'evictions': 0}
+
+    @property
+    def model_handler(self):
+        # Looked up every time: a hot swap (see model_swap) replaces the instance
+        return self._model_handler or ModelHandler.get_instance()
+
+    def _take(self, key):
+        # A session is removed while a turn runs on it: generate extends its
+        # cache in place, so two requests must never share one
+        with self._lock:
+            return self._sessions.pop(key, None)
+
+    def _put(self, key, session):
+        with self._lock:
+            if session.nbytes > self.memory_budget:
+                logger.info(f"Chat session {key} ({session.nbytes} bytes) exceeds the memory budget, not kept")
+                self._stats['evictions'] += 1
+                return
+            self._sessions[key] = session
+            while self.memory_used() > self.memory_budget:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._stats['evictions'] += 1
+                logger.info(f"Evicted chat session {evicted}")
+
+    def memory_used(self):
+        return sum(session.nbytes for session in self._sessions.values())
+
+    def discard(self, key):
+        self._take(key)
+
+    def ask(self, key, image, turns, question):
+        """Answer ``question`` about ``image`` after the earlier ``turns``.
+
+        ``turns`` is the full list of earlier (question, answer) pairs, which
+        is used to rebuild the conversation when it isn't cached. Returns the
+        answer and a dict with ``reused``, ``prefill_tokens`` and ``latency``.
+        """
+        started = time.perf_counter()
+        handler = self.model_handler
+        session = self._take(key)
+        result = None
+        # A cache built by another checkpoint (before a hot swap) is useless
+        if session is not None and session.turns == len(turns) and session.model_version == handler.model_version:
+            try:
+                result = handler.continue_conversation(
+                    session.token_ids, session.cache, turns, question, self.max_new_tokens
+                )
+            except ValueError as e:
+                logger.warning(f"Rebuilding chat session {key}: {str(e)}")
+        reused = result is not None
+        if not reused:
+            result = handler.start_conversation(image, turns, question, self.max_new_tokens)
+
+        self._put(key, ChatSession(result.token_ids, result.cache, len(turns) + 1, handler.model_version))
+        with self._lock:
+            self._stats['hits' if reused else 'rebuilds'] += 1
+        return result.answer, {
+            'reused': reused,
+            'prefill_tokens': result.prefill_tokens,
+            'latency': time.perf_counter() - started,
+        }
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions), memory_used=self.memory_used(),
+                        memory_budget=self.memory_budget)
+
+
+def ask_about_analysis(analysis, question, user=None):
+    """Answer a chat question about a stored analysis and record the turn."""
+    turns = [(turn.question, turn.answer) for turn in analysis.chat_turns.order_by('created_at', 'id')]
+    with analysis.image.open('rb') as image:
+        answer, info = ChatSessionStore.get_instance().ask(analysis.pk, image, turns, question)
+    ChatTurn.objects.create(
+        analysis=analysis, user=user, question=question, answer=answer, latency=info['latency'],
+    )
+    return answer, info
@@ -0,0 +1,387 @@
+"""
+Nearest-neighbour search over the vision embeddings of analysed images.
+
+Workers append one pooled vision-tower vector per analysis (see
+ModelHandler.capture_embeddings) to the store of the model that produced
+it: an append-only float16 matrix on disk, memory-mapped for reads, with
+the analysis id of every row alongside. Vectors are unit length, so cosine
+similarity is a dot product; a query is a chunked matrix-vector product
+and a partial sort.
+
+Past IVF_THRESHOLD rows a query can go through an IVF-PQ index instead
+(`manage.py embedding_index build`): rows are bucketed into k-means cells
+and the residuals product-quantised to one byte per sub-vector, so a query
+only scores the NPROBE nearest cells from small lookup tables. The best
+candidates are then re-scored exactly against the matrix, and rows
+appended since the build are scanned exactly until the next one.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import torch
+from django.conf import settings
+
+from .resumable import save_state
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = 'vectors.f16'
+IDS_FILE = 'ids.i64'
+META_FILE = 'meta.json'
+INDEX_FILE = 'ivfpq.npz'
+
+
+def _embedding_settings():
+    options = {
+        'ENABLED': True,
+        'DIR': os.path.join(settings.BASE_DIR, 'embeddings'),
+        'IVF_THRESHOLD': 200000,
+        'NLIST': 0,
+        'NPROBE': 16,
+        'PQ_M': 48,
+        'RERANK': 50,
+        'TRAIN_SAMPLE': 65536,
+        'CHUNK_ROWS': 65536,
+    }
+    options.update(getattr(settings, 'EMBEDDING_INDEX', {}))
+    return options
+
+
+def store_path(model_version):
+    """Directory of the embedding store for a model; vectors of different models don't compare."""
+    name = re.sub(r'[^\w.-]+', '--', model_version.strip('/'))
+    return os.path.join(_embedding_settings()['DIR'], name)
+
+
+def _normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _top_k(scores, k):
+    """Indices of the ``k`` highest scores, best first."""
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def exact_search(matrix, query, k, start=0, chunk_rows=65536):
+    """Rows of ``matrix`` from ``start`` on with the highest dot product with ``query``.
+
+    Returns ``(rows, scores)``, best first. Chunks of the float16 matrix are
+    scored in float16 by torch, several times faster than converting them
+    for numpy, and only the best rows are re-scored in float32.
+    """
+    half_query = torch.from_numpy(query).half()
+    # Twice the candidates, so float16 rounding doesn't push a close k-th row out
+    rows = [np.empty(0, np.int64)]
+    for begin in range(start, len(matrix), chunk_rows):
+        block_scores = (torch.from_numpy(matrix[begin:begin + chunk_rows]) @ half_query).float().numpy()
+        rows.append(_top_k(block_scores, 2 * k) + begin)
+    rows = np.concatenate(rows)
+    scores = np.asarray(matrix[rows], dtype=np.float32) @ query
+    best = _top_k(scores, k)
+    return rows[best], scores[best]
+
+
+def _nearest(data, centroids, chunk_rows=16384):
+    """Index of the nearest (L2) centroid of every row of ``data``."""
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    labels = np.empty(len(data), np.int64)
+    for begin in range(0, len(data), chunk_rows):
+        block = np.asarray(data[begin:begin + chunk_rows], dtype=np.float32)
+        labels[begin:begin + len(block)] = np.argmax(block @ centroids.T - half_norms, axis=1)
+    return labels
+
+
+def kmeans(data, k, iterations=10, seed=0):
+    """Lloyd's k-means over the rows of ``data``; returns the float32 centroids."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(data, centroids)
+        order = np.argsort(labels, kind='stable')
+        present, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+        centroids[present] = np.add.reduceat(data[order], starts, axis=0) / counts[:, None]
+        empty = np.setdiff1d(np.arange(k), present)
+        # Re-seed cells that lost every point
+        centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+    """Inverted lists over k-means cells holding product-quantised residuals.
+
+    Covers the first ``indexed`` rows of the matrix it was built from;
+    ``rows`` lists them cell by cell, ``offsets`` delimits the cells and
+    ``codes`` holds one byte per sub-vector of each row's residual.
+    """
+
+    def __init__(self, centroids, codebooks, offsets, rows, codes):
+        self.centroids = centroids
+        self.codebooks = codebooks
+        self.offsets = offsets
+        self.rows = rows
+        self.codes = codes
+
+    @property
+    def indexed(self):
+        return len(self.rows)
+
+    @classmethod
+    def build(cls, matrix, nlist, m, sample=65536, chunk_rows=65536, seed=0):
+        """Train on a sample of ``matrix`` and encode all of it."""
+        count, dim = matrix.shape
+        if dim % m:
+            raise ValueError(f"PQ_M={m} does not divide the embedding dimension {dim}")
+        rng = np.random.default_rng(seed)
+        picked = np.sort(rng.choice(count, min(count, max(sample, nlist, 256)), replace=False))
+        training = np.asarray(matrix[picked], dtype=np.float32)
+
+        centroids = kmeans(training, nlist, seed=seed)
+        residuals = training - centroids[_nearest(training, centroids)]
+        sub = dim // m
+        codebooks = np.stack([
+            kmeans(residuals[:, part * sub:(part + 1) * sub], min(256, len(training)), seed=seed + part)
+            for part in range(m)
+        ])
+
+        labels = np.empty(count, np.int64)
+        codes = np.empty((count, m), np.uint8)
+        for begin in range(0, count, chunk_rows):
+            block = np.asarray(matrix[begin:begin + chunk_rows], dtype=np.float32)
+            block_labels = _nearest(block, centroids)
+            block_residuals = block - centroids[block_labels]
+            labels[begin:begin + len(block)] = block_labels
+            for part in range(m):
+                codes[begin:begin + len(block), part] = _nearest(
+                    block_residuals[:, part * sub:(part + 1) * sub], codebooks[part]
+                )
+        rows = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))])
+        return cls(centroids, codebooks, offsets, rows, codes[rows])
+
+    def search(self, query, k, nprobe):
+        """Matrix rows of the ``k`` best approximate matches, best first."""
+        # The cells nearest the query, as rows were assigned to their nearest cell
+        closeness = self.centroids @ query - 0.5 * (self.centroids ** 2).sum(axis=1)
+        cells = _top_k(closeness, min(nprobe, len(self.centroids)))
+        spans = [(self.offsets[cell], self.offsets[cell + 1]) for cell in cells]
+        positions = np.concatenate([np.arange(start, end) for start, end in spans])
+        if not len(positions):
+            return positions
+        m, _, sub = self.codebooks.shape
+        # q . (centroid + residual) = q . centroid + sum over sub-vectors of q_i . codeword_i
+        tables = np.einsum('md,mkd->mk', query.reshape(m, sub), self.codebooks)
+        cell_scores = np.repeat((self.centroids[cells] @ query), [end - start for start, end in spans])
+        scores = cell_scores + tables[np.arange(m), self.codes[positions]].sum(axis=1)
+        return self.rows[positions[_top_k(scores, k)]]
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, codebooks=self.codebooks, offsets=self.offsets,
+                     rows=self.rows, codes=self.codes)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['centroids'], data['codebooks'], data['offsets'], data['rows'], data['codes'])
+
+
+class EmbeddingStore:
+    """Append-only unit-length float16 embeddings of one model, with their analysis ids."""
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._index_mtime = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def meta(self):
+        """``{'dim', 'count'}`` of the committed rows; bytes past ``count`` are an unfinished append."""
+        try:
+            with open(self._file(META_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'dim': None, 'count': 0}
+
+    def __len__(self):
+        return self.meta()['count']
+
+    def append(self, analysis_ids, vectors):
+        """Add one row per analysis. Safe against concurrent workers and crashed appends."""
+        ids = np.asarray(analysis_ids, dtype=np.int64)
+        vectors = _normalize(vectors).astype(np.float16)
+        if len(ids) != len(vectors):
+            raise ValueError(f"{len(ids)} analysis ids for {len(vectors)} vectors")
+        if not len(ids):
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file('lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            meta = self.meta()
+            dim = meta['dim'] or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"{vectors.shape[1]}-d vectors for a store of {dim}-d ones")
+            for name, data in ((VECTORS_FILE, vectors), (IDS_FILE, ids)):
+                with open(self._file(name), 'ab') as f:
+                    # Drop whatever an append that crashed before its commit wrote
+                    f.truncate(meta['count'] * (data.nbytes // len(data)))
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            save_state(self._file(META_FILE), {'dim': dim, 'count': meta['count'] + len(ids)})
+
+    def arrays(self):
+        """Memory-mapped ``(vectors, ids)`` of the committed rows, or None while empty.
+
+        Mapped copy-on-write so torch can wrap them without a warning about
+        read-only memory; nothing writes to them.
+        """
+        meta = self.meta()
+        if not meta['count']:
+            return None
+        vectors = np.memmap(
+            self._file(VECTORS_FILE), dtype=np.float16, mode='c', shape=(meta['count'], meta['dim']),
+        )
+        ids = np.memmap(self._file(IDS_FILE), dtype=np.int64, mode='c', shape=(meta['count'],))
+        return vectors, ids
+
+    def vector_of(self, analysis_id):
+        """The latest float32 embedding stored for an analysis, or None."""
+        arrays = self.arrays()
+        if arrays is None:
+            return None
+        vectors, ids = arrays
+        rows = np.flatnonzero(ids == analysis_id)
+        return np.asarray(vectors[rows[-1]], dtype=np.float32) if len(rows) else None
+
+    def index(self):
+        """The IVF-PQ index built for this store, reloaded when a rebuild replaces it."""
+        try:
+            mtime = os.stat(self._file(INDEX_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            self._index = self._index_mtime = None
+            return None
+        if mtime != self._index_mtime:
+            self._index, self._index_mtime = IVFPQIndex.load(self._file(INDEX_FILE)), mtime
+        return self._index
+
+    def build_index(self, nlist=None, m=None):
+        """Build (or rebuild) the IVF-PQ index over every committed row."""
+        options = _embedding_settings()
+        arrays = self.arrays()
+        if arrays is None:
+            raise ValueError(f"No embeddings in {self.path}")
+        vectors, _ = arrays
+        nlist = nlist or options['NLIST'] or max(1, int(np.sqrt(len(vectors))))
+        index = IVFPQIndex.build(
+            vectors, min(nlist, len(vectors)), m or options['PQ_M'],
+            sample=options['TRAIN_SAMPLE'], chunk_rows=options['CHUNK_ROWS'],
+        )
+        index.save(self._file(INDEX_FILE))
+        return index
+
+    def search(self, query, k=10, among=None, exact=False, nprobe=None):
+        """Up to ``k`` ``(analysis_id, cosine similarity)`` pairs nearest to ``query``, best first.
+
+        ``among`` restricts the search to those analysis ids (scanned
+        exactly). Otherwise the IVF-PQ index is used when the store is past
+        IVF_THRESHOLD rows and one was built, unless ``exact``. An analysis
+        stored more than once is returned once.
+        """
+        options = _embedding_settings()
+        arrays = self.arrays()
+        if arrays is None:
+            return []
+        vectors, ids = arrays
+        query = _normalize(query)[0]
+        if among is not None:
+            candidates = np.flatnonzero(np.isin(ids, np.fromiter(among, dtype=np.int64)))
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+            best = _top_k(scores, k)
+            rows, scores = candidates[best], scores[best]
+        else:
+            index = None if exact or len(vectors) < options['IVF_THRESHOLD'] else self.index()
+            if index is None:
+                rows, scores = exact_search(vectors, query, k, chunk_rows=options['CHUNK_ROWS'])
+            else:
+                candidates = np.sort(index.search(query, k * options['RERANK'], nprobe or options['NPROBE']))
+                candidate_scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+                tail_rows, tail_scores = exact_search(
+                    vectors, query, k, start=index.indexed, chunk_rows=options['CHUNK_ROWS'],
+                )
+                rows = np.concatenate([candidates, tail_rows])
+                scores = np.concatenate([candidate_scores, tail_scores])
+                best = _top_k(scores, k)
+                rows, scores = rows[best], scores[best]
+
+        results, seen = [], set()
+        for analysis_id, score in zip(ids[rows].tolist(), scores.tolist()):
+            if analysis_id not in seen:
+                seen.add(analysis_id)
+                results.append((analysis_id, score))
+        return results
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(model_version):
+    """The process-wide store of a model, so its loaded index is reused across requests."""
+    path = store_path(model_version)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = EmbeddingStore(path)
+        return _stores[path]
+
+
+def add_embeddings(analysis_ids, vectors, model_version):
+    """Record embeddings captured by a worker.
+
+    Failures are logged, not raised: a missing embedding only keeps an
+    analysis out of similarity search, which is no reason to lose it.
+    """
+    if not _embedding_settings()['ENABLED'] or not len(analysis_ids):
+        return
+    try:
+        get_store(model_version).append(analysis_ids, vectors)
+    except Exception as e:
+        logger.error(f"Could not store embeddings of analyses {list(analysis_ids)}: {str(e)}")
+
+
+def similar_analyses(analysis, analyses, k=10, restrict=False):
+    """The ``k`` analyses of the ``analyses`` queryset most similar to ``analysis``.
+
+    Returns ``(analysis, score)`` pairs, best first, or None when no
+    embedding was recorded for ``analysis``. Deleted analyses and those
+    outside ``analyses`` are left out. ``restrict`` searches only the rows
+    of ``analyses``, exactly: for small querysets such as one user's.
+    """
+    if not analysis.model_version:
+        return None
+    store = get_store(analysis.model_version)
+    query = store.vector_of(analysis.pk)
+    if query is None:
+        return None
+    among = analyses.values_list('pk', flat=True) if restrict else None
+    # Extra candidates make up for the analysis itself and deleted rows
+    found = store.search(query, 2 * k + 1, among=among)
+    by_pk = analyses.in_bulk([analysis_id for analysis_id, _ in found])
+    neighbours = [(by_pk[analysis_id], score) for analysis_id, score in found
+                  if analysis_id != analysis.pk and analysis_id in by_pk]
+    return neighbours[:k]
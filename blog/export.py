@@ -0,0 +1,184 @@
+import csv
+import json
+import logging
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ImageAnalysis, DetectedObject
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2000
+
+TABLES = {
+    'analyses': {
+        'model': ImageAnalysis,
+        'prefix': '',
+        'fields': [
+            'id', 'image', 'upload_date', 'user_id', 'user__username', 'model_version', 'prompt_hash',
+            'result_tier', 'config_hash', 'content_hash', 'short_caption', 'normal_caption', 'query_text',
+            'query_result',
+        ],
+    },
+    'objects': {
+        'model': DetectedObject,
+        'prefix': 'image_analysis__',
+        'fields': ['id', 'image_analysis_id', 'label', 'confidence', 'x_min', 'y_min', 'x_max', 'y_max'],
+    },
+}
+
+
+def parse_bound(value, end=False):
+    """Parse an ISO date or datetime filter value into an aware datetime.
+
+    A bare date used as an upper bound covers that whole day.
+    """
+    if not value:
+        return None
+    # Dates first: parse_datetime also accepts a bare date, as midnight
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        if end:
+            day += timedelta(days=1)
+        parsed = datetime.combine(day, time.min)
+    else:
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ValueError(f"Invalid date: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(table='analyses', user_id=None, start=None, end=None, model_version=None):
+    """Build the filtered, pk-ordered values queryset for an export."""
+    spec = TABLES[table]
+    prefix = spec['prefix']
+    filters = {}
+    if user_id is not None:
+        filters[f'{prefix}user_id'] = user_id
+    if start is not None:
+        filters[f'{prefix}upload_date__gte'] = start
+    if end is not None:
+        filters[f'{prefix}upload_date__lt'] = end
+    if model_version:
+        filters[f'{prefix}model_version'] = model_version
+    # Order by primary key so the chunked cursor walks the index, not a sort
+    return spec['model'].objects.filter(**filters).order_by('pk').values(*spec['fields'])
+
+
+def _batched(lines, size):
+    """Join lines into blocks so the response isn't flushed one row at a time."""
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+class Echo:
+    """File-like object that hands back whatever is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def stream_jsonl(rows, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+    yield from _batched(lines, chunk_size)
+
+
+def stream_csv(rows, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.DictWriter(Echo(), fieldnames=fields)
+    yield writer.writeheader()
+    yield from _batched((writer.writerow(row) for row in rows), chunk_size)
+
+
+class _Drain:
+    """Write-only sink for pyarrow that lets the caller collect pending bytes."""
+
+    def __init__(self):
+        self.closed = False
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_schema(fields):
+    import pyarrow as pa
+
+    types = {
+        'id': pa.int64(), 'user_id': pa.int64(), 'image_analysis_id': pa.int64(),
+        'upload_date': pa.timestamp('us', tz='UTC'),
+        'confidence': pa.float64(), 'x_min': pa.float64(), 'y_min': pa.float64(),
+        'x_max': pa.float64(), 'y_max': pa.float64(),
+    }
+    return pa.schema([(field, types.get(field, pa.string())) for field in fields])
+
+
+def stream_parquet(rows, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write one Parquet row group per chunk and yield the bytes as they are produced."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow: pip install pyarrow")
+
+    schema = _parquet_schema(fields)
+    sink = _Drain()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    batch = []
+
+    def flush_batch():
+        columns = {field: [row[field] for row in batch] for field in fields}
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+        batch.clear()
+        return sink.take()
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= chunk_size:
+            yield flush_batch()
+    if batch:
+        yield flush_batch()
+    writer.close()
+    yield sink.take()
+
+
+FORMATS = {
+    'jsonl': {'stream': stream_jsonl, 'content_type': 'application/x-ndjson', 'extension': 'jsonl'},
+    'csv': {'stream': stream_csv, 'content_type': 'text/csv', 'extension': 'csv'},
+    'parquet': {'stream': stream_parquet, 'content_type': 'application/vnd.apache.parquet', 'extension': 'parquet'},
+}
+
+
+def stream_export(fmt, table='analyses', chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """Return a generator of str/bytes chunks for an export in the given format."""
+    rows = export_queryset(table, **filters).iterator(chunk_size=chunk_size)
+    return FORMATS[fmt]['stream'](rows, TABLES[table]['fields'], chunk_size=chunk_size)
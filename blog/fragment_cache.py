@@ -0,0 +1,109 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = "fragment:generation:{user_id}"
+FRAGMENT_KEY = "fragment:{name}:{user_id}:{generation}"
+STATS_KEY = "fragment:stats:{name}:{outcome}"
+
+
+def _get_cache():
+    return caches[getattr(settings, 'FRAGMENT_CACHE_ALIAS', 'default')]
+
+
+def _fragment_timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 600)
+
+
+def get_generation(user_id):
+    """Return the current fragment generation for a user.
+
+    A missing counter (never set, or evicted) is seeded from the clock so a
+    fresh generation can never collide with fragments cached under an older one.
+    """
+    cache = _get_cache()
+    key = GENERATION_KEY.format(user_id=user_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(user_id):
+    """Invalidate every cached fragment of a user by moving to a new generation.
+
+    Runs from model signals after the row is written, so a cache outage is
+    logged rather than raised: the fragments expire on their own timeout.
+    """
+    if user_id is None:
+        return
+    key = GENERATION_KEY.format(user_id=user_id)
+    try:
+        cache = _get_cache()
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+    except Exception as e:
+        logger.error(f"Could not bump fragment generation for user {user_id}: {str(e)}")
+        return
+    logger.debug(f"Bumped fragment generation for user {user_id}")
+
+
+def _record(name, outcome):
+    cache = _get_cache()
+    key = STATS_KEY.format(name=name, outcome=outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def render_fragment(name, user_id, template_name, get_context):
+    """Render a per-user template fragment, serving it from the cache when possible.
+
+    ``get_context`` is only called on a miss, so callers can keep their
+    queries lazy and pay for them only when the fragment is actually rebuilt.
+    """
+    try:
+        cache = _get_cache()
+        key = FRAGMENT_KEY.format(name=name, user_id=user_id, generation=get_generation(user_id))
+        html = cache.get(key)
+        if html is not None:
+            _record(name, 'hits')
+            return mark_safe(html)
+        _record(name, 'misses')
+        html = render_to_string(template_name, get_context())
+        cache.set(key, str(html), timeout=_fragment_timeout())
+        return html
+    except Exception as e:
+        # Never let a cache outage break the page, just render uncached
+        logger.error(f"Fragment cache error for {name}: {str(e)}")
+        return render_to_string(template_name, get_context())
+
+
+def fragment_stats(names=('home', 'profile', 'recent_analyses')):
+    """Return hit/miss counters and the hit rate for each cached fragment."""
+    cache = _get_cache()
+    stats = {}
+    for name in names:
+        hits = cache.get(STATS_KEY.format(name=name, outcome='hits'), 0)
+        misses = cache.get(STATS_KEY.format(name=name, outcome='misses'), 0)
+        stats[name] = {'hits': hits, 'misses': misses}
+    stats['all'] = {
+        'hits': sum(s['hits'] for s in stats.values()),
+        'misses': sum(s['misses'] for s in stats.values()),
+    }
+    for entry in stats.values():
+        total = entry['hits'] + entry['misses']
+        entry['hit_rate'] = round(entry['hits'] / total * 100, 1) if total else 0
+    return stats
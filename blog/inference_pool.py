@@ -0,0 +1,193 @@
+"""
+Model-resident CPU inference processes pinned to disjoint cores.
+
+Each process gets its own core set and exactly that many intra-op threads,
+so processes don't compete for cores. SmolVLM weights come from the local
+artifact store (see model_artifacts), already in their final dtype, so
+from_pretrained keeps them memory-mapped: every process maps the same
+page-cache pages and an extra process costs its activations and KV cache,
+not another copy of the weights.
+"""
+import logging
+import multiprocessing as mp
+import os
+import signal
+import time
+
+import django
+import torch
+from django.conf import settings
+
+from .procmem import process_memory
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def core_sets(processes, cores=None):
+    """Split the usable cores into ``processes`` disjoint, contiguous sets.
+
+    With more processes than cores the sets can't be disjoint; cores are
+    then shared round-robin, which is only useful for testing.
+    """
+    cores = sorted(cores if cores is not None else os.sched_getaffinity(0))
+    if processes > len(cores):
+        logger.warning(f"{processes} processes on {len(cores)} cores, cores will be shared")
+        return [[cores[index % len(cores)]] for index in range(processes)]
+    size, extra = divmod(len(cores), processes)
+    sets = []
+    start = 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        sets.append(cores[start:end])
+        start = end
+    return sets
+
+
+def configure_process(cores):
+    """Pin this process to ``cores`` and size every thread pool to match.
+
+    Must run before torch or the models do any parallel work.
+    """
+    threads = str(len(cores))
+    os.sched_setaffinity(0, cores)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = threads
+    settings.VLM_COMPILE = dict(getattr(settings, 'VLM_COMPILE', {}), THREADS=len(cores))
+    whisper = dict(getattr(settings, 'WHISPER', {}))
+    whisper['CPU_THREADS'] = max(1, len(cores) // whisper.get('NUM_WORKERS', 1))
+    settings.WHISPER = whisper
+    torch.set_num_threads(len(cores))
+
+
+def preload(models):
+    """Load the models a worker serves so its first job doesn't pay for them."""
+    # Imported here so the supervising process never loads the model stacks
+    if 'vlm' in models:
+        # Whatever the fleet was last switched to, not the configured default
+        from .model_swap import load_fleet_model
+        load_fleet_model()
+    if 'whisper' in models:
+        from .transcription import TranscriptionService
+        TranscriptionService.get_instance()
+
+
+def _process_main(cores, models, target, args, writer=None):
+    django.setup()
+    if writer is not None:
+        from .persistence import RemoteWriter, use_writer
+        use_writer(RemoteWriter(*writer))
+    configure_process(cores)
+    preload(models)
+    target(*args)
+
+
+def serve_queues(queues):
+    """Work RQ jobs in this process with the preloaded models.
+
+    A ModelSwapper thread follows `manage.py model_swap` when the VLM is loaded.
+    """
+    import django_rq
+    from .model_handler import ModelHandler
+    from .model_swap import HotSwapWorker, ModelSwapper
+
+    # Jobs run in this process (a SimpleWorker): the default worker forks a
+    # child per job, which would throw the loaded models away every time
+    worker = django_rq.get_worker(*queues, worker_class=HotSwapWorker)
+    swapper = None
+    if ModelHandler._instance is not None:
+        swapper = ModelSwapper(worker.connection, worker.name)
+        swapper.start()
+    try:
+        worker.work(with_scheduler=False)
+    finally:
+        if swapper is not None:
+            swapper.stop()
+
+
+def benchmark_loop(image_path, duration, barrier, results):
+    """Caption ``image_path`` back to back for ``duration`` seconds and report the count."""
+    from .model_handler import ModelHandler
+
+    handler = ModelHandler.get_instance()
+    image = handler.prepare_image(image_path)
+    handler.generate_short_caption(image)  # warm-up
+    barrier.wait()  # start together once every process is loaded
+    completed = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        handler.generate_short_caption(image)
+        completed += 1
+    results.put((os.getpid(), completed, time.perf_counter() - started))
+    barrier.wait()  # stay alive until the parent has read our memory
+
+
+class InferencePool:
+    """Starts and supervises pinned, model-resident processes."""
+
+    def __init__(self, processes, cores=None, models=('vlm',)):
+        self.core_sets = core_sets(processes, cores)
+        self.models = tuple(models)
+        self._context = mp.get_context('spawn')
+        self.processes = []
+        # With write coalescing on, the workers' analyses are committed here in batches
+        self._writes = None
+        self._endpoints = {}
+        from .persistence import WriterService, _coalescing_settings
+        if _coalescing_settings()['ENABLED']:
+            self._writes = WriterService(self._context)
+
+    def start(self, target, args=()):
+        for cores in self.core_sets:
+            self.spawn(cores, target, args)
+        return self.processes
+
+    def spawn(self, cores, target, args=()):
+        """Start one pinned process running ``target(*args)`` after loading the models."""
+        endpoint = self._writes.connect() if self._writes is not None else None
+        process = self._context.Process(
+            target=_process_main, args=(cores, self.models, target, args, endpoint), daemon=False,
+        )
+        process.start()
+        self.processes.append(process)
+        self._endpoints[process.pid] = endpoint
+        logger.info(f"Started inference process {process.pid} on cores {cores}")
+        return process
+
+    def retire(self, process):
+        """Ask one process to stop after its current job (RQ warm shutdown)."""
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+
+    def reap(self):
+        """Forget processes that have exited and return them."""
+        exited = [process for process in self.processes if not process.is_alive()]
+        for process in exited:
+            process.join()
+            self.processes.remove(process)
+            endpoint = self._endpoints.pop(process.pid, None)
+            if endpoint is not None:
+                self._writes.disconnect(endpoint)
+        return exited
+
+    def memory(self):
+        """RSS, private and proportional (PSS) memory in MB per live process."""
+        return {process.pid: process_memory(process.pid) for process in self.processes if process.is_alive()}
+
+    def stop(self, timeout=30):
+        # SIGTERM lets an RQ worker finish its current job first (warm shutdown)
+        for process in self.processes:
+            self.retire(process)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Inference process {process.pid} did not stop, killing it")
+                process.kill()
+                process.join()
+        if self._writes is not None:
+            self._writes.stop()
+
+    def wait(self):
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+
+import httpx
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class LLMBusy(Exception):
+    """Raised when no generation slot frees up before the request's deadline."""
+
+
+class LLMTimeout(Exception):
+    """Raised when a generation does not finish before its deadline."""
+
+
+class LLMError(Exception):
+    """Raised when the Ollama server reports an error or can't be reached."""
+
+
+def _ollama_settings():
+    options = {
+        'HOST': 'http://localhost:11434',
+        'MODEL': 'llama3.1',
+        'MAX_CONCURRENCY': 2,
+        'POOL_SIZE': 4,
+        'TIMEOUT': 60,
+        'CONNECT_TIMEOUT': 5,
+        'KEEP_ALIVE': '10m',
+    }
+    options.update(getattr(settings, 'OLLAMA', {}))
+    return options
+
+
+def _parse_line(line):
+    """Token text of one NDJSON chunk from /api/chat."""
+    chunk = json.loads(line)
+    if 'error' in chunk:
+        raise LLMError(chunk['error'])
+    return chunk.get('message', {}).get('content', '')
+
+
+class TokenStream:
+    """Iterator over the tokens of one streamed chat response.
+
+    Holds a concurrency slot and a pooled connection until it is exhausted
+    or closed, so always close it (StreamingHttpResponse does).
+    """
+
+    def __init__(self, response, release, deadline):
+        self._response = response
+        self._release = release
+        self._deadline = deadline
+
+    def __iter__(self):
+        try:
+            # Read past the final "done" chunk so the connection returns to the pool
+            for line in self._response.iter_lines():
+                if time.monotonic() > self._deadline:
+                    raise LLMTimeout("LLM response did not finish before its deadline")
+                if not line:
+                    continue
+                token = _parse_line(line)
+                if token:
+                    yield token
+        except httpx.TimeoutException:
+            raise LLMTimeout("LLM response did not finish before its deadline")
+        finally:
+            self.close()
+
+    def close(self):
+        self._response.close()
+        self._release()
+
+
+class AsyncTokenStream:
+    """Async counterpart of TokenStream."""
+
+    def __init__(self, response, release, deadline):
+        self._response = response
+        self._release = release
+        self._deadline = deadline
+        self._loop = asyncio.get_running_loop()
+
+    async def __aiter__(self):
+        try:
+            # Read past the final "done" chunk so the connection returns to the pool
+            async for line in self._response.aiter_lines():
+                if time.monotonic() > self._deadline:
+                    raise LLMTimeout("LLM response did not finish before its deadline")
+                if not line:
+                    continue
+                token = _parse_line(line)
+                if token:
+                    yield token
+        except httpx.TimeoutException:
+            raise LLMTimeout("LLM response did not finish before its deadline")
+        finally:
+            await self.aclose()
+
+    async def aclose(self):
+        await self._response.aclose()
+        self._release()
+
+    def close(self):
+        """Close from synchronous code, as Django does with a response that was never sent."""
+        self._release()
+        if self._response.is_closed or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._loop.create_task(self._response.aclose())
+        else:
+            asyncio.run_coroutine_threadsafe(self._response.aclose(), self._loop)
+
+
+class LLMClient:
+    """Streaming Ollama chat client shared by the whole process.
+
+    Connections to the server are pooled and kept alive between requests.
+    At most ``MAX_CONCURRENCY`` generations run at once across the sync and
+    asyncio interfaces; callers wait for a slot until their deadline and then
+    get LLMBusy. Each request has an overall deadline of ``TIMEOUT`` seconds
+    (or its own ``timeout``) covering the wait, the first token and the rest
+    of the stream.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(**{k.lower(): v for k, v in _ollama_settings().items()})
+            return cls._instance
+
+    def __init__(self, host='http://localhost:11434', model='llama3.1', max_concurrency=2, pool_size=4,
+                 timeout=60, connect_timeout=5, keep_alive='10m'):
+        self.host = host
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.keep_alive = keep_alive
+        self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._http = httpx.Client(base_url=host, limits=self._limits)
+        # httpx async clients belong to one event loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _payload(self, messages, options):
+        payload = {'model': self.model, 'messages': messages, 'stream': True, 'keep_alive': self.keep_alive}
+        if options:
+            payload['options'] = options
+        return payload
+
+    def _deadline(self, timeout):
+        return time.monotonic() + (timeout or self.timeout)
+
+    def _http_timeout(self, deadline):
+        return httpx.Timeout(max(0.001, deadline - time.monotonic()), connect=self.connect_timeout)
+
+    def _releaser(self):
+        released = threading.Event()
+
+        def release():
+            if not released.is_set():
+                released.set()
+                self._slots.release()
+        return release
+
+    def _check(self, response):
+        if response.status_code != 200:
+            try:
+                message = json.loads(response.read()).get('error', response.text)
+            except ValueError:
+                message = response.text
+            response.close()
+            raise LLMError(f"Ollama returned {response.status_code}: {message}")
+
+    def stream_chat(self, messages, timeout=None, options=None):
+        """Start a chat completion and return a TokenStream of its tokens.
+
+        Waiting for a slot, connecting and the response headers happen here,
+        so LLMBusy, LLMTimeout and LLMError surface before any token is sent.
+        """
+        deadline = self._deadline(timeout)
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            raise LLMBusy("All LLM generation slots are busy, try again shortly")
+        release = self._releaser()
+        try:
+            request = self._http.build_request(
+                'POST', '/api/chat', json=self._payload(messages, options), timeout=self._http_timeout(deadline)
+            )
+            response = self._http.send(request, stream=True)
+            self._check(response)
+        except httpx.TimeoutException:
+            release()
+            raise LLMTimeout("LLM did not respond before its deadline")
+        except httpx.HTTPError as e:
+            release()
+            raise LLMError(f"Could not reach Ollama at {self.host}: {str(e)}")
+        except Exception:
+            release()
+            raise
+        return TokenStream(response, release, deadline)
+
+    def chat(self, messages, timeout=None, options=None):
+        """Blocking chat completion returning the whole response text."""
+        return "".join(self.stream_chat(messages, timeout, options))
+
+    def _async_http(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(base_url=self.host, limits=self._limits)
+            self._async_clients[loop] = client
+        return client
+
+    async def astream_chat(self, messages, timeout=None, options=None):
+        """Async version of stream_chat returning an AsyncTokenStream."""
+        deadline = self._deadline(timeout)
+        # The slots are shared with sync callers, so wait for one in a thread
+        waiting = asyncio.ensure_future(
+            asyncio.to_thread(self._slots.acquire, timeout=max(0.0, deadline - time.monotonic()))
+        )
+        try:
+            acquired = await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            # The thread can't be interrupted: give back the slot it may still get
+            waiting.add_done_callback(self._release_unused)
+            raise
+        if not acquired:
+            raise LLMBusy("All LLM generation slots are busy, try again shortly")
+        release = self._releaser()
+        try:
+            http = self._async_http()
+            request = http.build_request(
+                'POST', '/api/chat', json=self._payload(messages, options), timeout=self._http_timeout(deadline)
+            )
+            response = await http.send(request, stream=True)
+            if response.status_code != 200:
+                await response.aread()
+                self._check(response)
+        except httpx.TimeoutException:
+            release()
+            raise LLMTimeout("LLM did not respond before its deadline")
+        except httpx.HTTPError as e:
+            release()
+            raise LLMError(f"Could not reach Ollama at {self.host}: {str(e)}")
+        except Exception:
+            release()
+            raise
+        return AsyncTokenStream(response, release, deadline)
+
+    def _release_unused(self, waiting):
+        if not waiting.cancelled() and waiting.exception() is None and waiting.result():
+            self._slots.release()
+
+    async def achat(self, messages, timeout=None, options=None):
+        stream = await self.astream_chat(messages, timeout, options)
+        return "".join([token async for token in stream])
+
+
+def follow_up_messages(question, analysis=None, transcript=None):
+    """Chat messages for a follow-up question about an analysis and/or a transcript."""
+    context = []
+    if analysis is not None:
+        if analysis.short_caption:
+            context.append(f"Image description: {analysis.short_caption}")
+        if analysis.query_text and analysis.query_result:
+            context.append(f"Earlier question: {analysis.query_text}")
+            context.append(f"Earlier answer: {analysis.query_result}")
+    if transcript:
+        context.append(f"The user said: {transcript}")
+    messages = []
+    if context:
+        messages.append({
+            'role': 'system',
+            'content': "Answer the user's follow-up question using this context.\n" + "\n".join(context),
+        })
+    messages.append({'role': 'user', 'content': question})
+    return messages
@@ -0,0 +1,195 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import django_rq
+import numpy as np
+from django.conf import settings
+from rq.job import Job
+
+from .audio import SAMPLE_RATE
+from .transcript_cache import store as store_transcript
+from .transcription import TranscriptionService, get_profile, transcribe
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+JOB_KIND = 'transcription'
+SMOOTHING_FRAMES = 10  # prefer pauses of ~300 ms over a single quiet frame
+
+
+def _long_audio_settings():
+    options = {
+        'THRESHOLD_S': 30,
+        'CHUNK_S': 30,
+        'SEARCH_S': 5,
+        'PROFILE': 'dictation',
+        'QUEUE': 'default',
+        'JOB_TIMEOUT': 600,
+    }
+    options.update(getattr(settings, 'STT_LONG_AUDIO', {}))
+    return options
+
+
+def is_long_audio(audio):
+    return len(audio) > _long_audio_settings()['THRESHOLD_S'] * SAMPLE_RATE
+
+
+def split_on_silence(audio, chunk_s=30, search_s=5, sampling_rate=SAMPLE_RATE):
+    """Return ``(start, end)`` sample ranges covering ``audio`` in order.
+
+    Every range is at most ``chunk_s`` seconds long and, except for the last,
+    ends at the quietest point of its final ``search_s`` seconds, so words
+    are not cut in half at chunk boundaries.
+    """
+    if search_s >= chunk_s:
+        raise ValueError("search_s must be shorter than chunk_s")
+    frame = sampling_rate * 30 // 1000  # 30 ms energy frames
+    frames = len(audio) // frame
+    energy = np.sqrt(np.mean(np.square(audio[:frames * frame].reshape(frames, frame)), axis=1))
+    energy = np.convolve(energy, np.ones(SMOOTHING_FRAMES) / SMOOTHING_FRAMES, mode='same')
+
+    chunk = int(chunk_s * sampling_rate)
+    search = int(search_s * sampling_rate)
+    bounds = []
+    start = 0
+    while len(audio) - start > chunk:
+        low = (start + chunk - search) // frame
+        high = (start + chunk) // frame
+        quietest = low + int(np.argmin(energy[low:high]))
+        end = max(start + 1, min(start + chunk, quietest * frame + frame // 2))
+        bounds.append((start, end))
+        start = end
+    bounds.append((start, len(audio)))
+    return bounds
+
+
+def to_pcm(audio):
+    """Pack float32 samples as int16 bytes, half the size in the job payload."""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def transcribe_chunk_task(pcm, offset, profile=None):
+    """Background task: transcribe one chunk and shift its segments by ``offset`` seconds."""
+    audio = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+    result = transcribe(audio, profile)
+    info = result['info']
+    return {
+        'offset': offset,
+        'duration': info.duration,
+        'language': info.language,
+        'language_probability': info.language_probability,
+        'segments': [
+            {
+                'start': round(offset + segment.start, 3),
+                'end': round(offset + segment.end, 3),
+                'text': segment.text.strip(),
+            }
+            for segment in result['segments']
+        ],
+    }
+
+
+def stitch_chunks(chunks):
+    """Merge chunk results into one transcript, ordered by chunk offset."""
+    chunks = sorted(chunks, key=lambda chunk: chunk['offset'])
+    segments = [segment for chunk in chunks for segment in chunk['segments']]
+    # The language spoken for most of the recording wins
+    durations = {}
+    for chunk in chunks:
+        durations[chunk['language']] = durations.get(chunk['language'], 0.0) + chunk['duration']
+    language = max(durations, key=durations.get) if durations else None
+    return {
+        'text': " ".join(segment['text'] for segment in segments if segment['text']),
+        'language': language,
+        'duration': round(sum(chunk['duration'] for chunk in chunks), 3),
+        'chunks': len(chunks),
+        'segments': segments,
+    }
+
+
+def stitch_transcription_task(chunk_ids, fingerprint=None):
+    """Background task run once every chunk job has finished."""
+    queue = django_rq.get_queue(_long_audio_settings()['QUEUE'])
+    jobs = Job.fetch_many(chunk_ids, connection=queue.connection)
+    transcript = stitch_chunks([job.return_value() for job in jobs])
+    if fingerprint:
+        store_transcript(fingerprint, transcript)
+    return transcript
+
+
+def long_audio_profile(profile=None):
+    """Decoding profile long recordings use: ``profile``, else STT_LONG_AUDIO['PROFILE']."""
+    return profile or _long_audio_settings()['PROFILE']
+
+
+def enqueue_transcription(audio, user_id=None, profile=None, fingerprint=None):
+    """Fan ``audio`` out as one RQ job per chunk plus a stitch job that depends on them.
+
+    Returns the stitch job; its id is what the client polls on check-job.
+    The stitched transcript is cached under ``fingerprint`` when given.
+    """
+    options = _long_audio_settings()
+    queue = django_rq.get_queue(options['QUEUE'])
+    bounds = split_on_silence(audio, options['CHUNK_S'], options['SEARCH_S'])
+    chunk_jobs = [
+        queue.enqueue(
+            'blog.long_audio.transcribe_chunk_task',
+            args=(to_pcm(audio[start:end]), start / SAMPLE_RATE),
+            kwargs={'profile': long_audio_profile(profile)},
+            job_timeout=options['JOB_TIMEOUT'],
+            result_ttl=86400,
+        )
+        for start, end in bounds
+    ]
+    chunk_ids = [job.id for job in chunk_jobs]
+    job = queue.enqueue(
+        'blog.long_audio.stitch_transcription_task',
+        args=(chunk_ids,),
+        kwargs={'fingerprint': fingerprint},
+        depends_on=chunk_jobs,
+        job_timeout=options['JOB_TIMEOUT'],
+        result_ttl=86400,
+        meta={'kind': JOB_KIND, 'chunk_ids': chunk_ids, 'user_id': user_id},
+    )
+    logger.info(f"Enqueued transcription job {job.id}: {len(audio) / SAMPLE_RATE:.1f}s in {len(bounds)} chunks")
+    return job
+
+
+def transcribe_locally(audio, profile=None):
+    """Transcribe chunks in parallel on this process's pool (used when Redis is down)."""
+    options = _long_audio_settings()
+    profile = get_profile(long_audio_profile(profile))
+    service = TranscriptionService.get_instance(profile['MODEL_SIZE'], profile['COMPUTE_TYPE'])
+    bounds = split_on_silence(audio, options['CHUNK_S'], options['SEARCH_S'])
+    # No more chunks in flight than the pool has workers, so none are rejected
+    with ThreadPoolExecutor(max_workers=service.num_workers) as executor:
+        chunks = list(executor.map(
+            lambda bound: transcribe_chunk_task(
+                to_pcm(audio[bound[0]:bound[1]]), bound[0] / SAMPLE_RATE, profile['NAME']
+            ),
+            bounds,
+        ))
+    return stitch_chunks(chunks)
+
+
+def transcription_job_status(job):
+    """check-job payload for a transcription job, with per-chunk progress."""
+    if job.is_finished:
+        return dict(job.return_value(), status='completed')
+    if job.is_failed:
+        return {'status': 'failed', 'error': str(job.exc_info)}
+
+    chunk_ids = job.meta.get('chunk_ids', [])
+    chunk_jobs = Job.fetch_many(chunk_ids, connection=job.connection)
+    completed = 0
+    for chunk_job in chunk_jobs:
+        if chunk_job is None:
+            return {'status': 'failed', 'error': 'Transcription chunk expired'}
+        if chunk_job.is_failed:
+            return {'status': 'failed', 'error': str(chunk_job.exc_info)}
+        completed += chunk_job.is_finished
+    return {
+        'status': 'processing',
+        'message': 'Audio is still being transcribed',
+        'progress': {'completed': completed, 'total': len(chunk_ids)},
+    }
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.resumable import load_state, save_state
+from blog.retention import run_policy
+
+
+class Command(BaseCommand):
+    help = 'Apply media retention policies to one bounded batch of files per policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', action='append', dest='policies',
+                            help='Only run the named policy (can be repeated)')
+        parser.add_argument('--batch-size', type=int, default=settings.RETENTION_BATCH_SIZE,
+                            help='Maximum files examined per policy in this run')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would be reclaimed without changing anything')
+        parser.add_argument('--reset', action='store_true',
+                            help='Forget saved cursors and start a fresh pass')
+
+    def handle(self, *args, **options):
+        policies = settings.RETENTION_POLICIES
+        names = options['policies'] or list(policies)
+        unknown = set(names) - set(policies)
+        if unknown:
+            raise CommandError(f"Unknown retention policies: {', '.join(sorted(unknown))}")
+
+        state_file = settings.RETENTION_STATE_FILE
+        state = {} if options['reset'] else load_state(state_file)
+        total_reclaimed = 0
+        for name in names:
+            stats = run_policy(name, policies[name], state, options['batch_size'], dry_run=options['dry_run'])
+            # Checkpoint after every policy so an interrupted run resumes here
+            if not options['dry_run']:
+                save_state(state_file, state)
+            total_reclaimed += stats['reclaimed_bytes']
+            if stats['finished_pass']:
+                progress = 'pass complete'
+            elif options['dry_run']:
+                progress = 'more files remain'
+            else:
+                progress = f"resumes after {state[name]['cursor']}"
+            self.stdout.write(
+                f"{name}: scanned {stats['scanned']}, acted on {stats['acted']}, "
+                f"reclaimed {stats['reclaimed_bytes']:,} bytes ({progress})"
+            )
+
+        prefix = 'Would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(f"{prefix} {total_reclaimed:,} bytes in total"))
@@ -0,0 +1,115 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import autoscaler
+
+
+class Command(BaseCommand):
+    help = ('Scale model-resident RQ workers with the queue backlog, '
+            'or evaluate the scaling policy offline against an arrival trace (--simulate)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queues', nargs='+', help='Queues in priority order (default: RQ_AUTOSCALER["QUEUES"])')
+        parser.add_argument('--min-workers', type=int)
+        parser.add_argument('--max-workers', type=int)
+        parser.add_argument('--memory-budget', type=int, help='MB of PSS all workers together may use')
+        parser.add_argument('--target-wait', type=float)
+        parser.add_argument('--scale-down-idle', type=float)
+        parser.add_argument('--interval', type=float, help='Seconds between scaling decisions')
+        parser.add_argument('--models', nargs='+', choices=['vlm', 'whisper'], default=['vlm'],
+                            help='Models each worker loads before taking jobs')
+        parser.add_argument('--cores', type=int, nargs='+', help='Cores to use (default: all this process may use)')
+
+        simulation = parser.add_argument_group('simulation')
+        simulation.add_argument('--simulate', action='store_true', help='Replay a trace instead of running workers')
+        simulation.add_argument('--trace', help='Arrival trace, JSON [{"t": s, "queue": name}] or "t,queue" CSV')
+        simulation.add_argument('--duration', type=float, default=4 * 3600, help='Synthetic trace length (s)')
+        simulation.add_argument('--base-rate', type=float, default=0.02, help='Synthetic trough rate (jobs/s)')
+        simulation.add_argument('--peak-rate', type=float, default=0.6, help='Synthetic peak rate (jobs/s)')
+        simulation.add_argument('--period', type=float, default=3600, help='Synthetic trough-to-trough period (s)')
+        simulation.add_argument('--service-time', type=float, default=4.0, help='Mean seconds per job')
+        simulation.add_argument('--startup-time', type=float, default=30.0,
+                                help='Seconds a new worker takes to load its models')
+        simulation.add_argument('--fixed', type=int, nargs='*', default=[1, 2, 4],
+                                help='Fixed worker counts to compare the policy against')
+        simulation.add_argument('--seed', type=int, default=0)
+        simulation.add_argument('--timeline', help='Write the policy run as "t,depth,workers" CSV to this file')
+
+    def handle(self, *args, **options):
+        defaults = autoscaler._autoscale_settings()
+        queues = options['queues'] or defaults['QUEUES']
+        interval = options['interval'] or defaults['INTERVAL_S']
+        policy = autoscaler.ScalingPolicy.from_settings(
+            min_workers=options['min_workers'], max_workers=options['max_workers'],
+            memory_budget=options['memory_budget'], target_wait=options['target_wait'],
+            scale_down_idle=options['scale_down_idle'],
+        )
+        if policy.min_workers > policy.max_workers:
+            raise CommandError('--min-workers is larger than --max-workers')
+        if options['simulate']:
+            self._simulate(policy, queues, interval, options)
+        else:
+            self._run(policy, queues, interval, options)
+
+    def _run(self, policy, queues, interval, options):
+        supervisor = autoscaler.Supervisor(policy, queues, options['cores'], options['models'])
+        stopping = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        self.stdout.write(f"autoscaling {policy.min_workers}-{policy.max_workers} workers on "
+                          f"{' '.join(queues)}, memory budget {policy.memory_budget} MB")
+        workers = None
+        while not stopping:
+            try:
+                states, want = supervisor.step()
+            except Exception as e:
+                # Redis hiccups shouldn't take the workers down with the supervisor
+                self.stderr.write(f"scaling step failed: {str(e)}")
+            else:
+                if want != workers:
+                    depth = sum(state.depth for state in states.values())
+                    oldest = max((state.oldest_age for state in states.values()), default=0)
+                    self.stdout.write(f"{time.strftime('%H:%M:%S')} backlog {depth}, oldest {oldest:.0f}s "
+                                      f"-> {want} workers")
+                    workers = want
+            time.sleep(interval)
+        self.stdout.write('Draining workers...')
+        supervisor.shutdown()
+
+    def _simulate(self, policy, queues, interval, options):
+        if options['trace']:
+            trace = autoscaler.load_trace(options['trace'])
+            source = options['trace']
+        else:
+            trace = autoscaler.synthetic_trace(
+                options['duration'], options['base_rate'], options['peak_rate'], options['period'],
+                seed=options['seed'],
+            )
+            source = (f"synthetic, {options['duration'] / 3600:.1f} h, {options['base_rate']}-"
+                      f"{options['peak_rate']} jobs/s over {options['period']:.0f} s")
+        self.stdout.write(f"{len(trace)} jobs ({source}), mean service {options['service_time']} s, "
+                          f"worker start-up {options['startup_time']} s")
+
+        common = dict(queues=tuple(queues), service_time=options['service_time'],
+                      startup_time=options['startup_time'], interval=interval, seed=options['seed'])
+        runs = [(f"autoscale {policy.min_workers}-{policy.capacity()}", autoscaler.simulate(trace, policy=policy,
+                                                                                        **common))]
+        runs += [(f"fixed {n}", autoscaler.simulate(trace, workers=n, **common)) for n in options['fixed']]
+
+        self.stdout.write(f"{'policy':16} {'p50 wait':>9} {'p95 wait':>9} {'max wait':>9} {'p95 high':>9} "
+                          f"{'worker-h':>9} {'peak':>5} {'changes':>8}")
+        for name, result in runs:
+            self.stdout.write(
+                f"{name:16} {result['wait_p50']:8.1f}s {result['wait_p95']:8.1f}s {result['wait_max']:8.1f}s "
+                f"{result['wait_p95_by_queue'].get(queues[0], 0):8.1f}s {result['worker_hours']:9.2f} "
+                f"{result['peak_workers']:5} {result['scale_events']:8}"
+            )
+        if options['timeline']:
+            with open(options['timeline'], 'w') as f:
+                f.write('t,depth,workers\n')
+                for t, depth, workers in runs[0][1]['timeline']:
+                    f.write(f"{t:.1f},{depth},{workers}\n")
+            self.stdout.write(f"timeline written to {options['timeline']}")
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from blog.backfill import RecaptionBackfill, _backfill_settings, stale_analyses, target_model_id
+from blog.model_handler import ModelHandler
+
+
+class Command(BaseCommand):
+    help = ('Re-caption analyses produced by an older model, prompt or generation config '
+            'on the low-priority queue; resumable')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', help='Model id the results should come from (default: what the workers serve)')
+        parser.add_argument('--rate', type=float, help='Analyses enqueued per second')
+        parser.add_argument('--batch-size', type=int, help='Analyses per job')
+        parser.add_argument('--window', type=int, help='Stale rows sorted by image size at a time')
+        parser.add_argument('--max-pending', type=int, help='Wait while this many jobs are queued (0: no limit)')
+        parser.add_argument('--limit', type=int, help='Stop after enqueueing this many analyses')
+        parser.add_argument('--dry-run', action='store_true', help='Only count stale analyses per configuration')
+        parser.add_argument('--reset', action='store_true', help='Forget the checkpoint and start a fresh pass')
+
+    def handle(self, *args, **options):
+        import django_rq
+
+        defaults = _backfill_settings()
+        model_id = options['model'] or target_model_id()
+        config_hash = ModelHandler.result_provenance(model_id)['config_hash']
+        stale = stale_analyses(config_hash)
+        self.stdout.write(f"target {model_id} (config {config_hash}): {stale.count()} stale analyses")
+        if options['dry_run']:
+            groups = stale.values('model_version', 'config_hash').annotate(rows=Count('id')).order_by('-rows')
+            for group in groups:
+                self.stdout.write(f"  {group['rows']:8} from {group['model_version'] or '(unknown model)'} "
+                                  f"config {group['config_hash'] or '(none)'}")
+            return
+
+        queue = django_rq.get_queue(defaults['QUEUE'])
+        backfill = RecaptionBackfill(
+            config_hash, defaults['STATE_FILE'], queue,
+            window=options['window'] or defaults['WINDOW'],
+            batch_size=options['batch_size'] or defaults['BATCH_SIZE'],
+            rate=options['rate'] or defaults['RATE'],
+            max_pending=defaults['MAX_PENDING'] if options['max_pending'] is None else options['max_pending'],
+        )
+        if options['reset']:
+            backfill.reset()
+        elif backfill.state['enqueued']:
+            self.stdout.write(f"resuming after analysis {backfill.state['cursor']}, "
+                              f"{backfill.state['enqueued']} already enqueued")
+
+        def progress(state):
+            self.stdout.write(f"  enqueued {state['enqueued']} (window up to analysis {state['cursor']}, "
+                              f"{len(state['batches'])} batches left in it)")
+
+        try:
+            sent = backfill.run(limit=options['limit'], progress=progress)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopped; run again to resume from the checkpoint'))
+            return
+        done = 'pass complete' if backfill.state.get('finished') else 'more remain, run again to continue'
+        self.stdout.write(self.style.SUCCESS(f"Enqueued {sent} analyses on '{defaults['QUEUE']}' ({done})"))
@@ -0,0 +1,82 @@
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.chat_sessions import ChatSessionStore
+from blog.model_handler import ModelHandler
+
+DEFAULT_QUESTIONS = [
+    "What is in this image?",
+    "What colours stand out?",
+    "Where might this photo have been taken?",
+    "Is anyone doing something unusual?",
+    "Summarise the scene in one sentence.",
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare follow-up latency with cached chat sessions against re-running the model each turn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', default=os.path.join(settings.BASE_DIR, 'TestingImages', 'ronal (1).jpg'))
+        parser.add_argument('--questions', nargs='+', default=DEFAULT_QUESTIONS,
+                            help='Conversation to replay, one question per turn')
+        parser.add_argument('--repeat', type=int, default=2)
+
+    def handle(self, *args, **options):
+        handler = ModelHandler.get_instance()
+        image = handler.prepare_image(options['image'])
+        questions = options['questions']
+        # Warm-up so the first measured turn doesn't pay for lazy initialisation
+        handler.process_query(image, questions[0])
+
+        rows = {name: [[] for _ in questions] for name in ('single', 'rebuild', 'session')}
+        prefill = {name: [0] * len(questions) for name in ('rebuild', 'session')}
+        for _ in range(options['repeat']):
+            # Today's behaviour: every question is a fresh single-turn query
+            for turn, question in enumerate(questions):
+                start = time.perf_counter()
+                handler.process_query(image, question)
+                rows['single'][turn].append(time.perf_counter() - start)
+
+            # Multi-turn without a cache: the whole conversation is prefilled each turn
+            turns = []
+            for turn, question in enumerate(questions):
+                start = time.perf_counter()
+                result = handler.start_conversation(image, turns, question)
+                rows['rebuild'][turn].append(time.perf_counter() - start)
+                prefill['rebuild'][turn] = result.prefill_tokens
+                turns.append((question, result.answer))
+
+            # Multi-turn with the KV cache kept between turns
+            store = ChatSessionStore(model_handler=handler)
+            turns = []
+            for turn, question in enumerate(questions):
+                answer, info = store.ask('bench', image, turns, question)
+                rows['session'][turn].append(info['latency'])
+                prefill['session'][turn] = info['prefill_tokens']
+                turns.append((question, answer))
+        stats = store.stats()
+
+        self.stdout.write(f"{'turn':>4} {'single':>9} {'rebuild':>9} {'session':>9} "
+                          f"{'prefill rebuild':>16} {'prefill session':>16}")
+        for turn in range(len(questions)):
+            self.stdout.write(
+                f"{turn + 1:>4} "
+                + " ".join(f"{statistics.median(rows[name][turn]) * 1000:7.0f}ms"
+                           for name in ('single', 'rebuild', 'session'))
+                + f" {prefill['rebuild'][turn]:>16} {prefill['session'][turn]:>16}"
+            )
+        if len(questions) > 1:
+            follow_ups = {name: statistics.median([t for times in rows[name][1:] for t in times])
+                          for name in rows}
+            self.stdout.write(
+                f"turns 2-{len(questions)} median: single {follow_ups['single'] * 1000:.0f}ms, "
+                f"rebuild {follow_ups['rebuild'] * 1000:.0f}ms, session {follow_ups['session'] * 1000:.0f}ms "
+                f"({follow_ups['single'] / follow_ups['session']:.1f}x faster than today)"
+            )
+        self.stdout.write(f"session cache: {stats['memory_used'] / 1024 / 1024:.1f} MB for "
+                          f"{len(questions)} turns, {stats['hits']} hits, {stats['rebuilds']} rebuilds")
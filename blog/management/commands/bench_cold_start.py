@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.model_handler import ModelHandler
+from blog.procmem import process_memory
+
+
+class Command(BaseCommand):
+    help = 'Measure SmolVLM worker cold start and RSS loading from the hub cache vs the local artifact store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='Fresh processes per source')
+        parser.add_argument('--sources', nargs='+', choices=['hub', 'artifacts'], default=['hub', 'artifacts'])
+        parser.add_argument('--child', choices=['hub', 'artifacts'], help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self._child(options['child'])
+            return
+
+        self.stdout.write(f"{'source':10} {'start':>8} {'load':>8} {'RSS':>9} {'warm RSS':>9} {'private':>9} "
+                          f"{'shared':>9}")
+        for source in options['sources']:
+            runs = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                result = subprocess.run(
+                    [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'bench_cold_start',
+                     '--child', source],
+                    capture_output=True, text=True, env=os.environ.copy(),
+                )
+                if result.returncode != 0:
+                    raise CommandError(f"{source} worker failed:\n{result.stderr[-2000:]}")
+                run = json.loads(result.stdout.strip().splitlines()[-1])
+                run['start'] = time.perf_counter() - started
+                runs.append(run)
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            self.stdout.write(
+                f"{source:10} {median['start']:7.1f}s {median['load']:7.1f}s {median['rss']:7.0f}MB "
+                f"{median['rss_warm']:7.0f}MB {median['rss_anon']:7.0f}MB {median['rss_file']:7.0f}MB"
+            )
+        self.stdout.write("start = process launch to model ready, load = ModelHandler construction only; "
+                          "warm RSS after reading every weight, split into private (anonymous) and shared "
+                          "(file-backed) pages")
+
+    def _child(self, source):
+        # Only the source differs: same settings, dtype and device otherwise
+        options = dict(getattr(settings, 'MODEL_ARTIFACTS', {}))
+        if source == 'hub':
+            options.update(DIR=tempfile.mkdtemp(prefix='no-artifacts-'), OFFLINE=False)
+        else:
+            options.update(OFFLINE=True)
+        settings.MODEL_ARTIFACTS = options
+
+        started = time.perf_counter()
+        handler = ModelHandler()
+        load = time.perf_counter() - started
+        loaded = process_memory()
+        # Read every weight once, as the first request would: memory-mapped
+        # weights only become resident (as shared file pages) when touched
+        with torch.no_grad():
+            for parameter in handler._model.parameters():
+                parameter.sum()
+        touched = process_memory()
+        self.stdout.write(json.dumps({
+            'load': load, 'rss': loaded['rss'],
+            'rss_warm': touched['rss'], 'rss_anon': touched['rss_anon'], 'rss_file': touched['rss_file'],
+        }))
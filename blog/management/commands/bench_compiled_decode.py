@@ -0,0 +1,67 @@
+import os
+import statistics
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.model_handler import ModelHandler
+
+PROMPTS = [
+    ('short_caption', "Describe the image in detail.", 50),
+    ('normal_caption', "Describe this image in detail.", 100),
+    ('query', "What is in this image?", 100),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare the eager and compiled static-cache SmolVLM decode paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', default=os.path.join(settings.BASE_DIR, 'TestingImages', 'ronal (1).jpg'))
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per prompt for single-request latency')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds of back-to-back requests per path')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        handler = ModelHandler(compiled=True)
+        self.stdout.write(f"load + compile warm-up: {time.perf_counter() - start:.1f}s, "
+                          f"{torch.get_num_threads()} intra-op threads")
+        image = handler.prepare_image(options['image'])
+        requests = [(name, handler._prepare_inputs(image, question), max_new_tokens)
+                    for name, question, max_new_tokens in PROMPTS]
+        paths = {
+            'eager': lambda inputs, max_new_tokens: handler._model.generate(**inputs, max_new_tokens=max_new_tokens),
+            'compiled': lambda inputs, max_new_tokens: handler._generate_compiled(inputs, max_new_tokens),
+        }
+
+        self.stdout.write(f"{'prompt':15} {'eager':>9} {'compiled':>9} {'speedup':>8} {'same output':>12}")
+        for name, inputs, max_new_tokens in requests:
+            latencies = {}
+            outputs = {}
+            for path, generate in paths.items():
+                generate(inputs, max_new_tokens)  # warm-up
+                samples = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    outputs[path] = generate(inputs, max_new_tokens)
+                    samples.append(time.perf_counter() - start)
+                latencies[path] = statistics.median(samples)
+            same = torch.equal(outputs['eager'], outputs['compiled'])
+            self.stdout.write(
+                f"{name:15} {latencies['eager'] * 1000:7.0f}ms {latencies['compiled'] * 1000:7.0f}ms "
+                f"{latencies['eager'] / latencies['compiled']:7.2f}x {'yes' if same else 'NO':>12}"
+            )
+
+        self.stdout.write(f"sustained, {options['duration']:.0f}s per path, prompts in rotation:")
+        for path, generate in paths.items():
+            completed = tokens = 0
+            start = time.perf_counter()
+            while time.perf_counter() - start < options['duration']:
+                name, inputs, max_new_tokens = requests[completed % len(requests)]
+                generated_ids = generate(inputs, max_new_tokens)
+                tokens += generated_ids.shape[1] - inputs['input_ids'].shape[1]
+                completed += 1
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"  {path:9} {completed / elapsed:6.2f} requests/s {tokens / elapsed:8.1f} tokens/s")
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+def _worker(worker_id, database, writes, batch_size, endpoint, result_queue):
+    """Simulate one RQ worker writing completed analyses as fast as it can."""
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = database
+    from django.db import OperationalError, connection
+    from blog.persistence import RemoteWriter, bulk_save_analyses
+
+    # Coalesced: one row per job, batched by the parent's WriterService
+    writer = RemoteWriter(*endpoint) if endpoint is not None else None
+    latencies = []
+    locked_errors = 0
+    written = 0
+    while written < writes:
+        size = 1 if writer is not None else min(batch_size, writes - written)
+        rows = [{'image': f'bench/{worker_id}_{written + i}.jpg'} for i in range(size)]
+        start = time.perf_counter()
+        try:
+            if writer is not None:
+                writer.submit(rows[0])
+            else:
+                bulk_save_analyses(rows)
+            written += size
+            latencies.append((time.perf_counter() - start) / size)
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked_errors += 1
+    connection.close()
+    result_queue.put({'written': written, 'locked_errors': locked_errors, 'latencies': latencies})
+
+
+class Command(BaseCommand):
+    help = 'Benchmark concurrent ImageAnalysis writes from N simulated workers against a temporary database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of simulated worker processes')
+        parser.add_argument('--writes', type=int, default=200, help='Analyses written by each worker')
+        parser.add_argument('--batch-size', type=int, default=1,
+                            help='Analyses per transaction written by each worker itself')
+        parser.add_argument('--coalesce', action='store_true',
+                            help='Workers write one row at a time through a shared WriterService, as an '
+                                 'InferencePool does with WRITE_COALESCING enabled')
+
+    def handle(self, *args, **options):
+        from django.db import connection
+        from blog.persistence import CoalescingWriter, WriterService, _coalescing_settings
+
+        workers = options['workers']
+        db = settings.DATABASES['default']
+        mode = 'coalesced by the parent' if options['coalesce'] else f"batch size {options['batch_size']}"
+        self.stdout.write(
+            f"Profile: {settings.PERSISTENCE_PROFILE} ({db['ENGINE']}), "
+            f"{workers} workers x {options['writes']} writes, {mode}"
+        )
+
+        # A throwaway database with the real engine and options, never the live one
+        old_name = db['NAME']
+        scratch = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            db['TEST'] = dict(db.get('TEST') or {}, NAME=os.path.join(scratch, 'bench.sqlite3'))
+        database = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        ctx = multiprocessing.get_context('spawn')
+        service = writer = None
+        try:
+            if options['coalesce']:
+                coalescing = _coalescing_settings()
+                writer = CoalescingWriter(max_batch=coalescing['MAX_BATCH'], max_delay=coalescing['MAX_DELAY'])
+                service = WriterService(ctx, writer)
+            # Child processes open their own connections
+            connection.close()
+            result_queue = ctx.Queue()
+            processes = [
+                ctx.Process(target=_worker, args=(
+                    i, database, options['writes'], options['batch_size'],
+                    service.connect() if service is not None else None, result_queue,
+                ))
+                for i in range(workers)
+            ]
+            start = time.perf_counter()
+            for process in processes:
+                process.start()
+            results = [result_queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            if service is not None:
+                service.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        written = sum(r['written'] for r in results)
+        locked_errors = sum(r['locked_errors'] for r in results)
+        latencies = sorted(l for r in results for l in r['latencies'])
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+
+        self.stdout.write(f"Rows written:        {written}")
+        self.stdout.write(f"Elapsed:             {elapsed:.2f}s")
+        self.stdout.write(f"Throughput:          {written / elapsed:.1f} rows/s")
+        self.stdout.write(f"Per-row latency p50: {p50:.2f}ms, p99: {p99:.2f}ms")
+        self.stdout.write(f"'database is locked' errors: {locked_errors}")
+        if writer is not None:
+            self.stdout.write(f"Transactions:        {writer.transactions} "
+                              f"({writer.rows / max(writer.transactions, 1):.1f} rows each)")
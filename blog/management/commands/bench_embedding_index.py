@@ -0,0 +1,87 @@
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from blog.embedding_index import EmbeddingStore, _embedding_settings
+
+
+class Command(BaseCommand):
+    help = 'Benchmark similarity-search latency and recall over synthetic embedding stores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000],
+                            help='Store sizes to benchmark')
+        parser.add_argument('--dim', type=int, default=768, help='Embedding size (the SmolVLM vision tower: 768)')
+        parser.add_argument('--clusters', type=int, default=2000,
+                            help='Synthetic embeddings are noisy copies of this many centres')
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--k', type=int, default=10)
+        parser.add_argument('--nprobe', type=int, nargs='+', help='IVF cells scanned per query (default NPROBE)')
+        parser.add_argument('--rerank', type=int, nargs='+', help='Candidates re-scored per result (default RERANK)')
+        parser.add_argument('--dir', help='Where to write the stores (a temporary directory by default)')
+
+    def handle(self, *args, **options):
+        options['nprobe'] = options['nprobe'] or [_embedding_settings()['NPROBE']]
+        options['rerank'] = options['rerank'] or [_embedding_settings()['RERANK']]
+        root = tempfile.mkdtemp(dir=options['dir'])
+        try:
+            for rows in options['rows']:
+                self._bench(EmbeddingStore(f"{root}/{rows}"), rows, options)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def _fill(self, store, rows, dim, clusters):
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+        start = time.perf_counter()
+        for offset in range(0, rows, 65536):
+            count = min(65536, rows - offset)
+            vectors = centres[rng.integers(clusters, size=count)] + rng.standard_normal((count, dim), dtype=np.float32)
+            store.append(np.arange(offset, offset + count), vectors)
+        self.stdout.write(f"{rows:,} x {dim} float16 vectors appended in {time.perf_counter() - start:.1f}s")
+
+    def _latency(self, label, searches):
+        timings = []
+        for search in searches:
+            start = time.perf_counter()
+            results = search()
+            timings.append(time.perf_counter() - start)
+            yield results
+        timings = np.array(timings) * 1000
+        self.stdout.write(f"  {label:28} p50 {np.percentile(timings, 50):8.1f} ms  p95 {np.percentile(timings, 95):8.1f} ms")
+
+    def _bench(self, store, rows, options):
+        self._fill(store, rows, options['dim'], options['clusters'])
+        vectors, _ = store.arrays()
+        k = options['k']
+        # Queries are stored rows, as when looking for analyses similar to one
+        picked = np.random.default_rng(1).choice(rows, options['queries'], replace=False)
+        queries = np.asarray(vectors[picked], dtype=np.float32)
+
+        exact = list(self._latency('exact', [
+            lambda query=query: store.search(query, k, exact=True) for query in queries
+        ]))
+        start = time.perf_counter()
+        index = store.build_index()
+        self.stdout.write(f"  IVF-PQ build: {len(index.centroids)} cells, {index.codebooks.shape[0]} sub-quantizers "
+                          f"in {time.perf_counter() - start:.1f}s")
+        threshold = _embedding_settings()['IVF_THRESHOLD']
+        for rerank in options['rerank']:
+            # Search through the index whatever the store's size
+            with override_settings(EMBEDDING_INDEX=dict(_embedding_settings(), IVF_THRESHOLD=0, RERANK=rerank)):
+                for nprobe in options['nprobe']:
+                    approximate = list(self._latency(f'IVF-PQ nprobe={nprobe} rerank={rerank}', [
+                        lambda query=query: store.search(query, k, nprobe=nprobe) for query in queries
+                    ]))
+                    recall = np.mean([
+                        len({i for i, _ in found} & {i for i, _ in truth}) / len(truth)
+                        for found, truth in zip(approximate, exact)
+                    ])
+                    self.stdout.write(f"  {'':28} recall@{k} {recall:.3f}")
+        if rows < threshold:
+            self.stdout.write(f"  (below IVF_THRESHOLD={threshold:,}: live searches of this size stay exact)")
+
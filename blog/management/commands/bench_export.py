@@ -0,0 +1,66 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from blog.export import DEFAULT_CHUNK_SIZE, FORMATS, stream_export
+from blog.models import ImageAnalysis
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark streaming exports over a synthetic table (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Synthetic analyses to export')
+        parser.add_argument('--formats', nargs='+', choices=sorted(FORMATS), default=sorted(FORMATS))
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._insert(options['rows'])
+                for fmt in options['formats']:
+                    self._export(fmt, options['chunk_size'])
+                # Never keep the synthetic rows
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Synthetic rows rolled back'))
+
+    def _insert(self, rows):
+        start = time.perf_counter()
+        now = timezone.now()
+        batch_size = 10_000
+        for offset in range(0, rows, batch_size):
+            ImageAnalysis.objects.bulk_create([
+                ImageAnalysis(
+                    image=f'bench/{i}.jpg',
+                    upload_date=now,
+                    short_caption=f'A synthetic caption for benchmark row number {i}.',
+                    query_text='What is in this image?',
+                    query_result='A synthetic answer describing the synthetic image.',
+                    model_version='bench',
+                )
+                for i in range(offset, min(offset + batch_size, rows))
+            ])
+        self.stdout.write(f"Inserted {rows:,} rows in {time.perf_counter() - start:.1f}s")
+
+    def _export(self, fmt, chunk_size):
+        exported_bytes = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        for chunk in stream_export(fmt, 'analyses', chunk_size=chunk_size, model_version='bench'):
+            exported_bytes += len(chunk)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rows = ImageAnalysis.objects.filter(model_version='bench').count()
+        self.stdout.write(
+            f"{fmt:8} {elapsed:7.1f}s  {rows / elapsed:10,.0f} rows/s  "
+            f"{exported_bytes / 1024 / 1024:8.1f} MB out  peak Python heap {peak / 1024 / 1024:6.1f} MB"
+        )
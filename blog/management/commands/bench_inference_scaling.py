@@ -0,0 +1,41 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.inference_pool import InferencePool, benchmark_loop
+
+
+class Command(BaseCommand):
+    help = 'Report per-process RSS/PSS and aggregate caption throughput as pinned inference processes scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+        parser.add_argument('--cores', type=int, nargs='+', help='Cores to use (default: all this process may use)')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds of captioning per run')
+        parser.add_argument('--image', default=os.path.join(settings.BASE_DIR, 'TestingImages', 'ronal (1).jpg'))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'N':>3} {'cores/proc':>10} {'captions/s':>11} {'RSS/proc':>9} {'private/proc':>13} "
+                          f"{'PSS/proc':>9} {'total PSS':>10}")
+        for processes in options['processes']:
+            pool = InferencePool(processes, options['cores'])
+            context = pool._context
+            barrier = context.Barrier(processes + 1)
+            results = context.Queue()
+            pool.start(benchmark_loop, (options['image'], options['duration'], barrier, results))
+            barrier.wait()  # every process loaded and warmed up
+            time.sleep(options['duration'] / 2)
+            memory = pool.memory()
+            runs = [results.get() for _ in range(processes)]
+            barrier.wait()
+            pool.wait()
+
+            throughput = sum(completed / elapsed for _, completed, elapsed in runs)
+            count = len(memory) or 1
+            mean = {key: sum(m[key] or 0 for m in memory.values()) / count for key in ('rss', 'rss_anon', 'pss')}
+            self.stdout.write(
+                f"{processes:>3} {len(pool.core_sets[0]):>10} {throughput:11.2f} {mean['rss']:7.0f}MB "
+                f"{mean['rss_anon']:11.0f}MB {mean['pss']:7.0f}MB {mean['pss'] * count:8.0f}MB"
+            )
@@ -0,0 +1,60 @@
+import os
+import statistics
+import time
+
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.model_handler import ModelHandler
+
+PROMPTS = {
+    'short_caption': ("Describe the image in detail.", 50),
+    'normal_caption': ("Describe this image in detail.", 100),
+    'query': ("What is in this image?", 100),
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare tokens/sec of plain and speculative SmolVLM decoding for the caption and query prompts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', default=os.path.join(settings.BASE_DIR, 'TestingImages', 'ronal (1).jpg'))
+        parser.add_argument('--prompts', nargs='+', choices=list(PROMPTS), default=list(PROMPTS))
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Loads the target and draft models from VLM_SPECULATIVE whether or not it is enabled
+        handler = ModelHandler(speculative=True)
+        image = handler.prepare_image(options['image'])
+        self.stdout.write(f"target {handler.model_version}, draft {handler._speculative['DRAFT_MODEL']}")
+        self.stdout.write(f"{'prompt':15} {'plain tok/s':>12} {'spec tok/s':>11} {'speedup':>8} "
+                          f"{'accepted':>9} {'same output':>12}")
+        for prompt_type in options['prompts']:
+            question, max_new_tokens = PROMPTS[prompt_type]
+            inputs = handler._prepare_inputs(image, question)
+            # Warm-up both paths
+            handler._generate(inputs, prompt_type, max_new_tokens, speculative=False)
+            handler._generate(inputs, prompt_type, max_new_tokens, speculative=True)
+            before = handler.speculative_stats().get(prompt_type, {'proposed': 0, 'accepted': 0})
+
+            rates = {}
+            outputs = {}
+            for speculative in (False, True):
+                samples = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    generated_ids = handler._generate(inputs, prompt_type, max_new_tokens, speculative=speculative)
+                    elapsed = time.perf_counter() - start
+                    samples.append((generated_ids.shape[1] - inputs['input_ids'].shape[1]) / elapsed)
+                rates[speculative] = statistics.median(samples)
+                outputs[speculative] = generated_ids
+
+            after = handler.speculative_stats()[prompt_type]
+            proposed = after['proposed'] - before['proposed']
+            accepted = (after['accepted'] - before['accepted']) / proposed if proposed else 0.0
+            same = torch.equal(outputs[False], outputs[True])
+            self.stdout.write(
+                f"{prompt_type:15} {rates[False]:12.1f} {rates[True]:11.1f} {rates[True] / rates[False]:7.2f}x "
+                f"{accepted:9.0%} {'yes' if same else 'NO':>12}"
+            )
@@ -0,0 +1,74 @@
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.audio import decode_audio
+
+
+class Command(BaseCommand):
+    help = 'Compare the legacy temp-WAV speech-to-text path with in-memory decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio', default=os.path.join(settings.BASE_DIR, 'audio.mp3'))
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--model', default='small', help='Whisper model size')
+        parser.add_argument('--no-transcribe', action='store_true',
+                            help='Only measure decoding, skip Whisper')
+
+    def handle(self, *args, **options):
+        with open(options['audio'], 'rb') as f:
+            audio_bytes = f.read()
+        fmt = os.path.splitext(options['audio'])[1].lstrip('.') or 'webm'
+
+        whisper_model = None
+        if not options['no_transcribe']:
+            from faster_whisper import WhisperModel
+            whisper_model = WhisperModel(options['model'], device="cpu", compute_type="int8")
+
+        paths = {
+            'temp WAV (legacy)': lambda: self._legacy(audio_bytes, fmt, whisper_model),
+            'in-memory': lambda: self._in_memory(audio_bytes, whisper_model),
+        }
+        for name, run in paths.items():
+            run()  # warm-up
+            latencies, peaks = [], []
+            for _ in range(options['repeat']):
+                tracemalloc.start()
+                start = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - start)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            self.stdout.write(
+                f"{name:18} median {statistics.median(latencies) * 1000:8.1f} ms  "
+                f"min {min(latencies) * 1000:8.1f} ms  peak Python allocations {max(peaks) / 1024 / 1024:6.1f} MB"
+            )
+
+    def _legacy(self, audio_bytes, fmt, whisper_model):
+        """What speech_to_text used to do: pydub -> WAV on disk -> Whisper decodes it again."""
+        import io
+        try:
+            from pydub import AudioSegment
+        except ImportError:
+            raise CommandError("The legacy path needs pydub: pip install pydub")
+        segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format=fmt)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'audio.wav')
+            segment.export(path, format='wav')
+            if whisper_model:
+                segments, _ = whisper_model.transcribe(path, beam_size=5)
+                return " ".join(s.text for s in segments)
+            from faster_whisper import decode_audio as whisper_decode
+            return whisper_decode(path)
+
+    def _in_memory(self, audio_bytes, whisper_model):
+        audio = decode_audio(audio_bytes)
+        if whisper_model:
+            segments, _ = whisper_model.transcribe(audio, beam_size=5)
+            return " ".join(s.text for s in segments)
+        return audio
@@ -0,0 +1,94 @@
+import json
+import os
+import re
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.audio import SAMPLE_RATE, decode_audio
+from blog.transcription import TranscriptionService, get_profile, transcribe
+
+
+def normalize_words(text):
+    """Lower-case words without punctuation, the usual WER normalisation."""
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_edits(reference, hypothesis):
+    """Word-level Levenshtein distance (substitutions + deletions + insertions)."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            ))
+        previous = current
+    return previous[-1]
+
+
+class Command(BaseCommand):
+    help = 'Report latency and word error rate for each Whisper decoding profile on a reference set'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reference', default=os.path.join(settings.BASE_DIR, 'stt_reference.json'),
+                            help='JSON list of {"audio": path, "text": reference transcript}')
+        parser.add_argument('--profiles', nargs='+', help='Profiles to compare (default: all)')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        with open(options['reference']) as f:
+            reference_set = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(options['reference']))
+        clips = []
+        for entry in reference_set:
+            audio = decode_audio(os.path.join(base_dir, entry['audio']))
+            clips.append((entry, audio))
+
+        # References are written by someone listening to the clip; a model's own output would score itself
+        missing = [entry['audio'] for entry in reference_set if not entry.get('text')]
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f"No human reference transcript for {', '.join(missing)}: latency only, left out of the WER"
+            ))
+        names = options['profiles'] or list(getattr(settings, 'WHISPER_PROFILES', {})) or ['default']
+        self.stdout.write(
+            f"{'profile':18} {'model':16} {'load':>7} {'median':>9} {'p95':>9} {'RTF':>6} {'WER':>7}"
+        )
+        for name in names:
+            self._bench_profile(name, clips, options['repeat'])
+
+    def _bench_profile(self, name, clips, repeat):
+        profile = get_profile(name)
+        start = time.perf_counter()
+        TranscriptionService.get_instance(profile['MODEL_SIZE'], profile['COMPUTE_TYPE'])
+        load_time = time.perf_counter() - start
+
+        latencies = []
+        audio_seconds = 0.0
+        edits = reference_words = 0
+        for entry, audio in clips:
+            transcribe(audio, name)  # warm-up
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = transcribe(audio, name)
+                latencies.append(time.perf_counter() - start)
+                audio_seconds += len(audio) / SAMPLE_RATE
+            if entry.get('text'):
+                reference = normalize_words(entry['text'])
+                hypothesis = normalize_words(" ".join(segment.text for segment in result['segments']))
+                edits += word_edits(reference, hypothesis)
+                reference_words += len(reference)
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        wer = f"{edits / reference_words:7.1%}" if reference_words else f"{'n/a':>7}"
+        model = f"{profile['MODEL_SIZE']}/{profile['COMPUTE_TYPE']}"
+        self.stdout.write(
+            f"{name:18} {model:16} {load_time:6.1f}s {statistics.median(latencies) * 1000:7.0f}ms "
+            f"{p95 * 1000:7.0f}ms {sum(latencies) / audio_seconds:6.3f} {wer}"
+        )
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from blog.audio import decode_audio
+from blog.streaming import FRAME_BYTES, FRAME_MS, speech_socket
+
+
+class Command(BaseCommand):
+    help = 'Replay an audio file through the speech WebSocket in real time and report utterance latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio', default=os.path.join(settings.BASE_DIR, 'audio.mp3'))
+        parser.add_argument('--speed', type=float, default=1.0,
+                            help='Playback speed, 1.0 = real time')
+
+    def handle(self, *args, **options):
+        audio = decode_audio(options['audio'])
+        pcm = (audio * 32767).astype('<i2').tobytes()
+        self.stdout.write(f"Replaying {len(audio) / 16000:.1f}s of audio in {FRAME_MS} ms frames")
+        messages, frame_sent = asyncio.run(self._replay(pcm, options['speed']))
+
+        latencies = []
+        for received_at, message in messages:
+            if message['type'] == 'partial':
+                self.stdout.write(f"  partial          {message['text']}")
+            elif message['type'] == 'final':
+                # Latency from the moment the utterance's last frame was sent
+                last_frame = min(len(frame_sent) - 1, max(0, round(message['end'] * 1000 / FRAME_MS) - 1))
+                latency = received_at - frame_sent[last_frame]
+                latencies.append(latency)
+                self.stdout.write(
+                    f"  final {message['start']:6.2f}-{message['end']:6.2f}s  {latency * 1000:6.0f} ms  {message['text']}"
+                )
+            elif message['type'] == 'error':
+                self.stdout.write(self.style.WARNING(f"  error  {message['message']}"))
+
+        if not latencies:
+            self.stdout.write(self.style.WARNING('No utterances detected'))
+            return
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        summary = (
+            f"{len(latencies)} utterances: median {statistics.median(latencies) * 1000:.0f} ms, "
+            f"p95 {p95 * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms end-of-utterance to final"
+        )
+        style = self.style.SUCCESS if p95 < 1.0 else self.style.WARNING
+        self.stdout.write(style(summary))
+
+    async def _replay(self, pcm, speed):
+        incoming = asyncio.Queue()
+        messages = []
+        frame_sent = []
+
+        async def receive():
+            return await incoming.get()
+
+        async def send(message):
+            if message['type'] == 'websocket.send':
+                messages.append((time.monotonic(), json.loads(message['text'])))
+
+        # The router normally resolves the user from the session cookie
+        scope = {'type': 'websocket', 'path': '/ws/speech/', 'headers': [], 'user_id': 'bench'}
+        consumer = asyncio.create_task(speech_socket(scope, receive, send))
+        await incoming.put({'type': 'websocket.connect'})
+
+        interval = FRAME_MS / 1000 / speed
+        started = time.monotonic()
+        for index, offset in enumerate(range(0, len(pcm), FRAME_BYTES)):
+            # Pace against the start time so sleep drift doesn't accumulate
+            delay = started + index * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await incoming.put({'type': 'websocket.receive', 'bytes': pcm[offset:offset + FRAME_BYTES]})
+            frame_sent.append(time.monotonic())
+            # Let the consumer process the frame before timing the next one
+            await asyncio.sleep(0)
+        await incoming.put({'type': 'websocket.receive', 'text': json.dumps({'type': 'end'})})
+        await consumer
+        return messages, frame_sent
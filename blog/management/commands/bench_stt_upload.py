@@ -0,0 +1,58 @@
+import base64
+import io
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from blog.audio import SAMPLE_RATE, decode_audio, encode_webm, read_request_audio
+
+
+class Command(BaseCommand):
+    help = 'Measure peak memory of the JSON/base64, raw and multipart speech-to-text uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio', default=os.path.join(settings.BASE_DIR, 'audio.mp3'),
+                            help='Source clip, looped to the requested duration')
+        parser.add_argument('--seconds', type=int, default=60)
+
+    def handle(self, *args, **options):
+        clip = decode_audio(options['audio'])
+        repeats = int(np.ceil(options['seconds'] * SAMPLE_RATE / len(clip)))
+        audio = np.tile(clip, repeats)[:options['seconds'] * SAMPLE_RATE]
+        webm = encode_webm(audio)
+        self.stdout.write(f"{options['seconds']}s WebM/Opus recording: {len(webm):,} bytes")
+
+        factory = RequestFactory()
+        b64 = f"data:audio/webm;base64,{base64.b64encode(webm).decode()}"
+        requests = {
+            'json/base64': lambda: factory.post('/blog/speech-to-text/', data=json.dumps({'audio_base64': b64}),
+                                                content_type='application/json'),
+            'raw audio/webm': lambda: factory.post('/blog/speech-to-text/', data=webm, content_type='audio/webm'),
+            'multipart': lambda: factory.post('/blog/speech-to-text/',
+                                              data={'audio': _named_file(webm, 'recording.webm')}),
+        }
+        for name, build in requests.items():
+            request = build()
+            payload = int(request.META['CONTENT_LENGTH'])
+            tracemalloc.start()
+            start = time.perf_counter()
+            samples = read_request_audio(request)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(
+                f"{name:15} payload {payload:>10,} bytes  decode {elapsed * 1000:7.1f} ms  "
+                f"peak Python memory {peak / 1024 / 1024:6.2f} MB  ({len(samples) / SAMPLE_RATE:.1f}s decoded)"
+            )
+
+
+def _named_file(data, name):
+    f = io.BytesIO(data)
+    f.name = name
+    return f
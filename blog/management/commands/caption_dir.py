@@ -0,0 +1,68 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.batch_caption import BatchCaptioner, _caption_dir_settings, count_source
+
+
+class Command(BaseCommand):
+    help = 'Caption every image in a directory, zip or tar archive into analyses; resumes after a crash'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory, .zip or .tar(.gz/.bz2/.xz) of images')
+        parser.add_argument('--user', help='Username the analyses belong to')
+        parser.add_argument('--query', help='Also ask this question about every image')
+        parser.add_argument('--batch-size', type=int, help='Images per batched generate')
+        parser.add_argument('--chunk-size', type=int, help='Rows per bulk insert and checkpoint')
+        parser.add_argument('--workers', type=int, help='Decode threads')
+        parser.add_argument('--prefetch', type=int, help='Decoded images kept ahead of the model')
+        parser.add_argument('--reset', action='store_true', help='Ignore the checkpoint and start over')
+        parser.add_argument('--allow-duplicates', action='store_true',
+                            help='Caption images even if this configuration already captioned the same bytes')
+        parser.add_argument('--progress-interval', type=float, default=10, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        defaults = _caption_dir_settings()
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"No user {options['user']}")
+
+        try:
+            captioner = BatchCaptioner(
+                options['path'],
+                batch_size=options['batch_size'] or defaults['BATCH_SIZE'],
+                chunk_size=options['chunk_size'] or defaults['CHUNK_SIZE'],
+                decode_workers=options['workers'] or defaults['DECODE_WORKERS'],
+                prefetch=options['prefetch'] or defaults['PREFETCH'],
+                state_file=defaults['STATE_FILE'], user=user, query=options['query'],
+                skip_existing=not options['allow_duplicates'],
+            )
+            if options['reset']:
+                captioner.reset()
+            elif captioner.cursor:
+                self.stdout.write(f"resuming after {captioner.cursor}")
+            total = count_source(captioner.path, captioner.cursor)
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{total if total is not None else 'unknown number of'} images to caption "
+                          f"with {captioner.provenance['model_version']}")
+
+        def progress(stats):
+            done = stats['captioned'] + stats['skipped'] + stats['failed']
+            elapsed = time.perf_counter() - stats['started']
+            rate = done / elapsed if elapsed else 0.0
+            line = f"  {done}" + (f"/{total}" if total is not None else "") + f" images, {rate:.2f} images/s"
+            if total is not None and rate:
+                line += f", ETA {time.strftime('%H:%M:%S', time.gmtime((total - done) / rate))}"
+            self.stdout.write(line)
+
+        stats = captioner.run(progress=progress, progress_interval=options['progress_interval'])
+        progress(stats)
+        self.stdout.write(self.style.SUCCESS(
+            f"Captioned {stats['captioned']}, skipped {stats['skipped']} already captioned, "
+            f"{stats['failed']} unreadable"
+        ))
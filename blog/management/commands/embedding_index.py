@@ -0,0 +1,52 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.backfill import target_model_id
+from blog.embedding_index import EmbeddingStore, _embedding_settings, get_store
+
+
+class Command(BaseCommand):
+    help = 'Show the image embedding stores, or build the IVF-PQ index of one'
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+        subcommands.add_parser('status', help='Rows and index coverage of every store')
+        build = subcommands.add_parser('build', help='Build or rebuild the IVF-PQ index of a store')
+        build.add_argument('--model', help='Model whose store to index (default: the one the workers serve)')
+        build.add_argument('--nlist', type=int, help='k-means cells (default NLIST, or sqrt(rows))')
+        build.add_argument('--pq-m', type=int, help='Sub-quantizers per vector (default PQ_M)')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'status':
+            self._status()
+            return
+        model_version = options['model'] or target_model_id()
+        store = get_store(model_version)
+        self.stdout.write(f"indexing {len(store):,} embeddings of {model_version}")
+        start = time.perf_counter()
+        try:
+            index = store.build_index(nlist=options['nlist'], m=options['pq_m'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"indexed {index.indexed:,} rows into {len(index.centroids)} cells in {time.perf_counter() - start:.1f}s"
+        ))
+
+    def _status(self):
+        options = _embedding_settings()
+        root = options['DIR']
+        names = sorted(os.listdir(root)) if os.path.isdir(root) else []
+        if not names:
+            self.stdout.write(f"no embeddings in {root}")
+        for name in names:
+            store = EmbeddingStore(os.path.join(root, name))
+            meta = store.meta()
+            index = store.index()
+            line = f"  {name:48} {meta['count']:>10,} x {meta['dim']}"
+            if index is not None:
+                line += f", IVF-PQ over {index.indexed:,} ({meta['count'] - index.indexed:,} appended since)"
+            elif meta['count'] >= options['IVF_THRESHOLD']:
+                line += ", past IVF_THRESHOLD with no index: searches scan every row"
+            self.stdout.write(line)
@@ -0,0 +1,44 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog.export import DEFAULT_CHUNK_SIZE, FORMATS, TABLES, parse_bound, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Stream analyses or detected objects to JSONL, CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+        parser.add_argument('--table', choices=sorted(TABLES), default='analyses')
+        parser.add_argument('--output', '-o', help='Output file (defaults to stdout)')
+        parser.add_argument('--user', type=int, help='Only export analyses of this user id')
+        parser.add_argument('--start', help='Only export analyses uploaded on/after this ISO date or datetime')
+        parser.add_argument('--end', help='Only export analyses uploaded before the end of this ISO date/datetime')
+        parser.add_argument('--model-version', help='Only export analyses produced by this model version')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Rows fetched from the database per round trip')
+
+    def handle(self, *args, **options):
+        try:
+            filters = {
+                'user_id': options['user'],
+                'start': parse_bound(options['start']),
+                'end': parse_bound(options['end'], end=True),
+                'model_version': options['model_version'],
+            }
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = stream_export(options['format'], options['table'], chunk_size=options['chunk_size'], **filters)
+        binary = options['format'] == 'parquet'
+        if options['output']:
+            out = open(options['output'], 'wb' if binary else 'w', newline='' if not binary else None)
+        else:
+            out = sys.stdout.buffer if binary else sys.stdout
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options['output']:
+                out.close()
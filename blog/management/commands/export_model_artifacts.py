@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import model_artifacts
+from blog.model_handler import ModelHandler, _speculative_settings
+
+
+class Command(BaseCommand):
+    help = 'Download and convert the SmolVLM processor and models once into the local artifact store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', default=[],
+                            help='Model hub id to export (default: the models ModelHandler loads)')
+        parser.add_argument('--processor', help='Processor hub id (default: ModelHandler.PROCESSOR_ID)')
+        parser.add_argument('--dtype', choices=sorted(model_artifacts.DTYPES),
+                            help='dtype the weights are stored in (default: MODEL_ARTIFACTS["DTYPE"])')
+        parser.add_argument('--revision', help='Hub revision to export')
+        parser.add_argument('--force', action='store_true', help='Re-export artifacts that already exist')
+        parser.add_argument('--verify', action='store_true',
+                            help='Only check existing artifacts against their manifests')
+
+    def handle(self, *args, **options):
+        dtype = options['dtype'] or model_artifacts.default_dtype()
+        models = options['model'] or self._default_models()
+        artifacts = [('processor', options['processor'] or ModelHandler.PROCESSOR_ID, None)]
+        artifacts += [('model', model_id, dtype) for model_id in models]
+
+        failed = False
+        for kind, model_id, artifact_dtype in artifacts:
+            if options['verify']:
+                path = model_artifacts.artifact_path(kind, model_id, artifact_dtype)
+                try:
+                    manifest = model_artifacts.verify(path)
+                except FileNotFoundError:
+                    self.stdout.write(self.style.ERROR(f"missing  {kind} {model_id} ({path})"))
+                    failed = True
+                    continue
+                except model_artifacts.ArtifactError as e:
+                    self.stdout.write(self.style.ERROR(f"corrupt  {str(e)}"))
+                    failed = True
+                    continue
+            else:
+                self.stdout.write(f"exporting {kind} {model_id}" + (f" as {artifact_dtype}" if artifact_dtype else ""))
+                path, manifest = model_artifacts.export(
+                    kind, model_id, artifact_dtype, revision=options['revision'], force=options['force']
+                )
+            size = sum(entry['size'] for entry in manifest['files'].values())
+            self.stdout.write(self.style.SUCCESS(
+                f"ok       {kind} {model_id} -> {path} ({len(manifest['files'])} files, {size / 1024 / 1024:.0f} MB)"
+            ))
+        if failed:
+            raise CommandError('Some artifacts are missing or corrupt')
+
+    def _default_models(self):
+        speculative = _speculative_settings()
+        models = [ModelHandler.MODEL_ID]
+        if speculative['ENABLED']:
+            models = [speculative['TARGET_MODEL'], speculative['DRAFT_MODEL']]
+        return models
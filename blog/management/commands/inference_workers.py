@@ -0,0 +1,45 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.inference_pool import InferencePool, serve_queues
+
+
+class Command(BaseCommand):
+    help = 'Run N model-resident RQ workers pinned to disjoint cores, sharing memory-mapped weights'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--queues', nargs='+', default=['high', 'default', 'low'])
+        parser.add_argument('--models', nargs='+', choices=['vlm', 'whisper'], default=['vlm'],
+                            help='Models each worker loads before taking jobs')
+        parser.add_argument('--cores', type=int, nargs='+', help='Cores to use (default: all this process may use)')
+        parser.add_argument('--report-interval', type=float, default=60,
+                            help='Seconds between per-process memory reports')
+
+    def handle(self, *args, **options):
+        pool = InferencePool(options['processes'], options['cores'], options['models'])
+        stopping = []
+        # Warm shutdown: workers finish their current job, then exit
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        pool.start(serve_queues, (options['queues'],))
+        for process, cores in zip(pool.processes, pool.core_sets):
+            self.stdout.write(f"worker {process.pid}: cores {cores}, queues {' '.join(options['queues'])}")
+        next_report = time.monotonic() + options['report_interval']
+        while not stopping and any(process.is_alive() for process in pool.processes):
+            time.sleep(1)
+            if time.monotonic() >= next_report:
+                self._report(pool.memory())
+                next_report += options['report_interval']
+        self.stdout.write('Stopping workers...')
+        pool.stop()
+
+    def _report(self, memory):
+        total_pss = sum(m['pss'] or 0 for m in memory.values())
+        for pid, m in memory.items():
+            self.stdout.write(f"  {pid}: RSS {m['rss'] or 0:.0f} MB, private {m['rss_anon'] or 0:.0f} MB, "
+                              f"PSS {m['pss'] or 0:.0f} MB")
+        self.stdout.write(f"  total PSS {total_pss:.0f} MB across {len(memory)} workers")
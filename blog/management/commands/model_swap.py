@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from blog import model_swap
+
+
+class Command(BaseCommand):
+    help = 'Switch every running worker to another VLM checkpoint without downtime, or roll back'
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest='action', required=True)
+        subcommands.add_parser('status', help='Show the fleet target and what each worker serves')
+        switch = subcommands.add_parser('set', help='Point the fleet at a checkpoint')
+        switch.add_argument('model_id', help='Hub id of the checkpoint (exported with export_model_artifacts)')
+        back = subcommands.add_parser('rollback', help='Point the fleet back at the previous checkpoint')
+        for subparser in (switch, back):
+            subparser.add_argument('--wait', type=float, default=600,
+                                   help='Seconds to wait for every worker to switch (0: do not wait)')
+        switch.add_argument('--no-rollback', action='store_true',
+                            help='Leave the target in place if a worker fails its self-check or times out')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'status':
+            self._status()
+            return
+        if options['action'] == 'set':
+            target = model_swap.set_target(options['model_id'])
+        else:
+            target = model_swap.rollback()
+            if target is None:
+                raise CommandError('Nothing to roll back to')
+        self.stdout.write(f"fleet target is now {target['model_id']} (generation {target['generation']})")
+        if not options['wait']:
+            return
+
+        if self._wait(target, options['wait']):
+            self.stdout.write(self.style.SUCCESS(f"every worker serves {target['model_id']}"))
+            return
+        if options['action'] == 'set' and not options['no_rollback']:
+            previous = model_swap.rollback()
+            self.stdout.write(self.style.WARNING(
+                f"rolling back to {previous['model_id']} (generation {previous['generation']})"
+            ))
+            self._wait(previous, options['wait'])
+        raise CommandError(f"Switching to {target['model_id']} failed")
+
+    def _wait(self, target, timeout):
+        """Wait until every live worker serves ``target``; False on a failed self-check or timeout."""
+        stale = 3 * model_swap._swap_settings()['POLL_S'] + 30
+        deadline = time.monotonic() + timeout
+        last = None
+        while time.monotonic() < deadline:
+            workers = {
+                name: status for name, status in model_swap.worker_statuses().items()
+                # A worker busy loading doesn't heartbeat, so it only goes stale when idle
+                if status['state'] == 'loading' or time.time() - status['updated'] < stale
+            }
+            done = [name for name, status in workers.items()
+                    if status['generation'] == target['generation'] and status['state'] == 'serving'
+                    and status['model_version'] == target['model_id']]
+            failed = {name: status.get('error', '') for name, status in workers.items()
+                      if status['generation'] == target['generation'] and status['state'] == 'failed'}
+            progress = (len(done), len(workers))
+            if progress != last:
+                self.stdout.write(f"  {len(done)}/{len(workers)} workers switched")
+                last = progress
+            if failed:
+                for name, error in failed.items():
+                    self.stdout.write(self.style.ERROR(f"  {name} failed: {error}"))
+                return False
+            if workers and len(done) == len(workers):
+                return True
+            time.sleep(2)
+        self.stdout.write(self.style.ERROR(f"  timed out after {timeout:.0f}s"))
+        return False
+
+    def _status(self):
+        target = model_swap.fleet_target()
+        if target is None:
+            self.stdout.write(f"no fleet target, workers serve the default {model_swap.default_model_id()}")
+        else:
+            self.stdout.write(f"fleet target {target['model_id']} (generation {target['generation']}, "
+                              f"set {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(target['set_at']))})")
+        for name, status in sorted(model_swap.worker_statuses().items()):
+            line = (f"  {name:32} {status['state']:8} {status['model_version']} "
+                    f"(generation {status['generation']}, {time.time() - status['updated']:.0f}s ago")
+            if status.get('pss'):
+                line += f", PSS {status['pss']:.0f} MB"
+            line += ')'
+            if status.get('error'):
+                line += f" error: {status['error']}"
+            self.stdout.write(line)
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:02
+
+import blog.storage
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    ImageAnalysis = apps.get_model("blog", "ImageAnalysis")
+    storage = blog.storage.ContentAddressedStorage()
+    for analysis in ImageAnalysis.objects.filter(content_hash="").exclude(image=""):
+        if not storage.exists(analysis.image.name):
+            continue
+        with storage.open(analysis.image.name) as f:
+            analysis.content_hash = blog.storage.hash_content(f)
+        analysis.save(update_fields=["content_hash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0003_alter_detectedobject_options_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="content_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="imageanalysis",
+            name="image",
+            field=blog.storage.ContentAddressedImageField(
+                hash_field="content_hash",
+                storage=blog.storage.ContentAddressedStorage(),
+                upload_to="uploads/",
+            ),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
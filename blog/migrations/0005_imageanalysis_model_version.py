@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0004_imageanalysis_content_hash"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="model_version",
+            field=models.CharField(blank=True, db_index=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0005_imageanalysis_model_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="query_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="transcription_time",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("blog", "0007_chatturn"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="config_hash",
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="generation_params",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="prompt_hash",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name="imageanalysis",
+            name="result_tier",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
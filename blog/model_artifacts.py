@@ -0,0 +1,157 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+import torch
+from django.conf import settings
+from django.utils import timezone
+from transformers import AutoModelForVision2Seq, AutoProcessor
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+DTYPES = {'float32': torch.float32, 'bfloat16': torch.bfloat16, 'float16': torch.float16}
+
+
+class ArtifactError(Exception):
+    """Raised when a required artifact is missing or doesn't match its manifest."""
+
+
+def _artifact_settings():
+    options = {
+        'DIR': os.path.join(settings.BASE_DIR, 'model_artifacts'),
+        'DTYPE': 'float32',
+        'OFFLINE': False,
+        'VERIFY_ON_LOAD': False,
+    }
+    options.update(getattr(settings, 'MODEL_ARTIFACTS', {}))
+    return options
+
+
+def default_dtype():
+    """dtype CPU workers load and the export command converts to by default."""
+    return _artifact_settings()['DTYPE']
+
+
+def artifact_path(kind, model_id, dtype=None):
+    """Directory of the ``kind`` ('model' or 'processor') artifact for a hub id."""
+    name = re.sub(r'[^\w.-]+', '--', model_id.strip('/'))
+    if dtype:
+        name = f"{name}__{dtype}"
+    return os.path.join(_artifact_settings()['DIR'], kind, name)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_entries(root):
+    entries = {}
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, root)
+            if relative != MANIFEST:
+                entries[relative] = {'sha256': _sha256(path), 'size': os.path.getsize(path)}
+    return entries
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def verify(path):
+    """Check every file of an artifact against its manifest; raises ArtifactError."""
+    manifest = read_manifest(path)
+    actual = _file_entries(path)
+    if actual != manifest['files']:
+        changed = sorted(name for name in set(actual) | set(manifest['files'])
+                         if actual.get(name) != manifest['files'].get(name))
+        raise ArtifactError(f"Artifact {path} doesn't match its manifest: {', '.join(changed)}")
+    return manifest
+
+
+def export(kind, model_id, dtype=None, revision=None, force=False):
+    """Download ``model_id`` once and save it as a local safetensors artifact.
+
+    Models are converted to ``dtype`` before saving so workers load them
+    without a conversion. The artifact is written to a temporary directory
+    and renamed into place with its manifest, so a crash never leaves a
+    half-written artifact behind.
+    """
+    dtype = dtype if kind == 'model' else None
+    destination = artifact_path(kind, model_id, dtype)
+    if os.path.exists(os.path.join(destination, MANIFEST)) and not force:
+        logger.info(f"Artifact {destination} already exists")
+        return destination, read_manifest(destination)
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=os.path.dirname(destination))
+    try:
+        if kind == 'model':
+            model = AutoModelForVision2Seq.from_pretrained(model_id, revision=revision, torch_dtype=DTYPES[dtype])
+            model.save_pretrained(staging, safe_serialization=True)
+            resolved_revision = getattr(model.config, '_commit_hash', None)
+        else:
+            processor = AutoProcessor.from_pretrained(model_id, revision=revision)
+            processor.save_pretrained(staging)
+            resolved_revision = revision
+        manifest = {
+            'kind': kind,
+            'model_id': model_id,
+            'revision': resolved_revision,
+            'dtype': dtype,
+            'created_at': timezone.now().isoformat(),
+            'files': _file_entries(staging),
+        }
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+        os.rename(staging, destination)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return destination, manifest
+
+
+def resolve(kind, model_id, dtype=None):
+    """Local artifact path for ``model_id``, or None to load from the hub.
+
+    With MODEL_ARTIFACTS['OFFLINE'] a missing artifact is an error instead,
+    so workers never reach for the network.
+    """
+    options = _artifact_settings()
+    path = artifact_path(kind, model_id, dtype if kind == 'model' else None)
+    if not os.path.exists(os.path.join(path, MANIFEST)):
+        if options['OFFLINE']:
+            raise ArtifactError(
+                f"No {kind} artifact for {model_id} in {options['DIR']}; run `manage.py export_model_artifacts`"
+            )
+        logger.warning(f"No {kind} artifact for {model_id}, loading it from the Hugging Face hub")
+        return None
+    if options['VERIFY_ON_LOAD']:
+        verify(path)
+    return path
+
+
+def load_kwargs(kind, model_id, dtype=None):
+    """Source and from_pretrained kwargs for a model or processor, preferring its artifact."""
+    path = resolve(kind, model_id, dtype)
+    if path is None:
+        return model_id, {}
+    # Everything is on disk: never contact the hub. The weights are already in
+    # the target dtype, so from_pretrained keeps them memory-mapped from the
+    # safetensors file instead of converting them into private memory.
+    return path, {'local_files_only': True}
+
@@ -1,8 +1,16 @@
 import torch
-from transformers import AutoProcessor, AutoModelForVision2Seq
+from transformers import AutoProcessor, AutoModelForVision2Seq, DynamicCache, StaticCache
 from PIL import Image
 import logging
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
+from . import model_artifacts
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -10,38 +18,434 @@ logger = logging.getLogger(__name__)
 # Set PyTorch memory allocation settings to reduce fragmentation
 os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
 
+# One answered chat turn: the answer, every token id so far, the KV cache
+# covering them and how many prompt tokens had to be prefilled for it
+ConversationTurn = namedtuple("ConversationTurn", "answer token_ids cache prefill_tokens")
+
+
+def _speculative_settings():
+    options = {
+        'ENABLED': False,
+        'TARGET_MODEL': "HuggingFaceTB/SmolVLM-500M-Instruct",
+        'DRAFT_MODEL': "HuggingFaceTB/SmolVLM-256M-Instruct",
+        'NUM_ASSISTANT_TOKENS': 5,
+        'PROMPTS': {'short_caption': False, 'normal_caption': True, 'query': True},
+    }
+    options.update(getattr(settings, 'VLM_SPECULATIVE', {}))
+    return options
+
+
+def _compile_settings():
+    options = {
+        'ENABLED': False,
+        'BUCKETS': [512, 1280, 2048],
+        'THREADS': 0,
+    }
+    options.update(getattr(settings, 'VLM_COMPILE', {}))
+    return options
+
+
+class _SpeculationCounter:
+    """Counts draft tokens proposed and accepted in a model's assisted generation, per calling thread.
+
+    Wraps the candidate generator that generate builds for each call: every
+    round it proposes ``get_candidates`` tokens and is told through
+    ``update_candidate_strategy`` how many of them the target accepted.
+    """
+
+    def __init__(self, model):
+        self._local = threading.local()
+        build = model._get_candidate_generator
+
+        def counted_generator(*args, **kwargs):
+            return _CountedCandidates(build(*args, **kwargs), self)
+
+        model._get_candidate_generator = counted_generator
+
+    @contextmanager
+    def counting(self):
+        counts = self._local.counts = {'rounds': 0, 'proposed': 0, 'accepted': 0}
+        try:
+            yield counts
+        finally:
+            self._local.counts = None
+
+    def add(self, **deltas):
+        counts = getattr(self._local, "counts", None)
+        if counts is not None:
+            for key, delta in deltas.items():
+                counts[key] += delta
+
+
+class _CountedCandidates:
+    """A candidate generator reporting each round to a _SpeculationCounter."""
+
+    def __init__(self, generator, counter):
+        self._generator = generator
+        self._counter = counter
+
+    def get_candidates(self, input_ids):
+        candidate_ids, candidate_logits = self._generator.get_candidates(input_ids)
+        self._counter.add(rounds=1, proposed=candidate_ids.shape[1] - input_ids.shape[1])
+        return candidate_ids, candidate_logits
+
+    def update_candidate_strategy(self, input_ids, scores, num_matches):
+        self._counter.add(accepted=int(num_matches))
+        return self._generator.update_candidate_strategy(input_ids, scores, num_matches)
+
+    def __getattr__(self, name):
+        return getattr(self._generator, name)
+
+
+class _VisionPooler:
+    """Mean-pools the vision tower's output into one vector per image.
+
+    Only for threads inside ModelHandler.capture_embeddings; everyone else
+    pays for nothing but the hook call.
+    """
+
+    def __init__(self, vision_model):
+        self._local = threading.local()
+        vision_model.register_forward_hook(self._hook)
+
+    def _hook(self, module, args, output):
+        frames = getattr(self._local, "frames", None)
+        if frames is not None:
+            hidden = getattr(output, "last_hidden_state", output)
+            frames.append(hidden.detach().float().mean(dim=1).cpu())
+
+    def start(self):
+        self._local.vectors = []
+        return self._local.vectors
+
+    def stop(self):
+        self._local.vectors = None
+
+    @contextmanager
+    def pooling(self, pixel_values):
+        """Pool the tiles the tower encodes in this block into one vector per image of ``pixel_values``."""
+        vectors = getattr(self._local, "vectors", None)
+        if vectors is None:
+            yield
+            return
+        self._local.frames = []
+        try:
+            yield
+            frames = self._local.frames
+        finally:
+            self._local.frames = None
+        # Padding tiles are all zeros and never reach the tower (same test as Idefics3)
+        tiles = (pixel_values != 0).flatten(2).any(-1).sum(1).tolist()
+        if not frames or sum(tiles) > sum(len(f) for f in frames):
+            logger.warning("Vision tower output doesn't match the input tiles, no embeddings recorded")
+            return
+        # Only the prefill encodes the image; a drafting target may run the tower again after it
+        encoded = torch.cat(frames)[: sum(tiles)]
+        for image_tiles in torch.split(encoded, tiles):
+            vector = image_tiles.mean(dim=0)
+            vectors.append((vector / vector.norm().clamp(min=1e-12)).numpy())
+
+
+def _digest(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
 class ModelHandler:
+    PROCESSOR_ID = "HuggingFaceTB/SmolVLM-500M-Instruct"
+    MODEL_ID = "HuggingFaceTB/SmolVLM-256M-Instruct"
+
+    # Prompt and generation settings per result field. They are part of every
+    # result's provenance, so editing them marks existing results stale.
+    PROMPTS = {
+        "short_caption": {"prompt": "Describe the image in detail.", "max_new_tokens": 50},
+        "normal_caption": {"prompt": "Describe this image in detail.", "max_new_tokens": 100},
+        "query": {"prompt": None, "max_new_tokens": 100},  # the user's question
+    }
+
     _instance = None
+    _instance_lock = threading.Lock()
     _model = None
+    _draft_model = None
     _processor = None
     _use_cuda = False
 
     @classmethod
     def get_instance(cls):
-        if cls._instance is None:
-            cls._instance = cls()
-        return cls._instance
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def swap_instance(cls, handler):
+        """Make ``handler`` the shared instance and return the previous one.
 
-    def __init__(self):
+        Callers that already hold the old instance finish with it; it is
+        freed once the last of them lets go.
+        """
+        with cls._instance_lock:
+            previous, cls._instance = cls._instance, handler
+        return previous
+
+    def __init__(self, speculative=None, compiled=None, model_id=None):
+        """``speculative`` and ``compiled`` override VLM_SPECULATIVE['ENABLED'] and
+        VLM_COMPILE['ENABLED'] for this instance, ``model_id`` the checkpoint
+        that answers (see model_version)."""
+        self._model_id = model_id
+        self._speculative = _speculative_settings()
+        if speculative is not None:
+            self._speculative['ENABLED'] = speculative
+        self._compile = _compile_settings()
+        if compiled is not None:
+            self._compile['ENABLED'] = compiled
+        self._static_caches = {}
+        self._static_lock = threading.Lock()
+        self._speculative_stats = {}
+        self._stats_lock = threading.Lock()
         self.initialize_model()
 
+    @property
+    def dtype_name(self):
+        return "bfloat16" if self._use_cuda else model_artifacts.default_dtype()
+
+    def _load_model(self, model_id, device):
+        # A preconverted local artifact if there is one (see export_model_artifacts)
+        source, kwargs = model_artifacts.load_kwargs("model", model_id, self.dtype_name)
+        return AutoModelForVision2Seq.from_pretrained(
+            source,
+            torch_dtype=model_artifacts.DTYPES[self.dtype_name],
+            _attn_implementation="flash_attention_2" if self._use_cuda else "eager",
+            **kwargs,
+        ).to(device)
+
     def initialize_model(self):
         try:
             DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
             self._use_cuda = DEVICE == "cuda"
+            if self._compile['THREADS']:
+                # Explicit per worker, so several workers on one box don't oversubscribe the cores
+                torch.set_num_threads(self._compile['THREADS'])
             if self._processor is None:
-                self._processor = AutoProcessor.from_pretrained("HuggingFaceTB/SmolVLM-500M-Instruct")
+                source, kwargs = model_artifacts.load_kwargs("processor", self.PROCESSOR_ID)
+                self._processor = AutoProcessor.from_pretrained(source, **kwargs)
             if self._model is None:
-                self._model = AutoModelForVision2Seq.from_pretrained(
-                    "HuggingFaceTB/SmolVLM-256M-Instruct",
-                    torch_dtype=torch.bfloat16 if self._use_cuda else torch.float32,
-                    _attn_implementation="flash_attention_2" if self._use_cuda else "eager",
-                ).to(DEVICE)
+                self._model = self._load_model(self.model_version, DEVICE)
+                self._speculation = _SpeculationCounter(self._model)
+                self._vision_pool = _VisionPooler(self._model.model.vision_model)
+            if self._speculative['ENABLED'] and self._draft_model is None:
+                self._draft_model = self._load_model(self._speculative['DRAFT_MODEL'], DEVICE)
+                # Starting draft length; the heuristic schedule adapts it to the acceptance rate
+                self._draft_model.generation_config.num_assistant_tokens = self._speculative['NUM_ASSISTANT_TOKENS']
+                logger.info(f"Speculative decoding enabled with draft model {self._speculative['DRAFT_MODEL']}")
+            if self._compile['ENABLED'] and not self._static_caches:
+                try:
+                    self._warm_up_compiled(DEVICE)
+                except Exception as e:
+                    # No compiler toolchain or an unsupported platform: serve eagerly rather than not at all
+                    logger.warning(f"Compiled decode unavailable, decoding eagerly: {e}")
+                    self._compile['ENABLED'] = False
+                    self._static_caches = {}
             logger.info(f"Successfully loaded SmolVLM model on {DEVICE}")
         except Exception as e:
             logger.error(f"Error loading SmolVLM model: {e}")
             raise
 
+    @property
+    def model_version(self):
+        """Identifier of the checkpoint that produces captions and answers."""
+        if self._model_id:
+            return self._model_id
+        if self._speculative['ENABLED']:
+            # The draft only proposes tokens; the answers are the target's
+            return self._speculative['TARGET_MODEL']
+        return self.MODEL_ID
+
+    @property
+    def tier(self):
+        """How results are computed: device, weights dtype and decode path."""
+        if self._speculative['ENABLED']:
+            path = "speculative"
+        elif self._compile['ENABLED']:
+            path = "compiled"
+        else:
+            path = "eager"
+        return f"{'cuda' if self._use_cuda else 'cpu'}-{self.dtype_name}-{path}"
+
+    @classmethod
+    def result_provenance(cls, model_id, tier=""):
+        """Provenance fields of results from ``model_id`` with the current prompts.
+
+        ``config_hash`` covers the model, prompts and generation parameters
+        but not the tier: greedy decoding gives the same answers on every
+        decode path, so a tier change alone doesn't make a result stale.
+        """
+        prompt_hash = _digest({
+            "processor": cls.PROCESSOR_ID,
+            "prompts": {name: prompt["prompt"] for name, prompt in cls.PROMPTS.items()},
+        })
+        generation_params = {
+            name: {"max_new_tokens": prompt["max_new_tokens"], "do_sample": False}
+            for name, prompt in cls.PROMPTS.items()
+        }
+        return {
+            "model_version": model_id,
+            "prompt_hash": prompt_hash,
+            "result_tier": tier,
+            "generation_params": generation_params,
+            "config_hash": _digest([model_id, prompt_hash, generation_params]),
+        }
+
+    def provenance(self):
+        """Provenance fields for results this handler produces."""
+        return self.result_provenance(self.model_version, self.tier)
+
+    @property
+    def embedding_dim(self):
+        return self._model.config.vision_config.hidden_size
+
+    @property
+    def max_image_edge(self):
+        """Longest edge the processor resizes images to, or None if it doesn't say."""
+        size = getattr(self._processor.image_processor, 'size', None) or {}
+        return size.get('longest_edge')
+
+    @contextmanager
+    def capture_embeddings(self):
+        """Collect an image embedding from every caption or query this thread runs in the block.
+
+        Yields a list that receives one unit-length float32 vector per image:
+        the vision tower's output mean-pooled over patches and tiles. The
+        tower runs for the caption anyway, so this costs no extra forward pass.
+        """
+        vectors = self._vision_pool.start()
+        try:
+            yield vectors
+        finally:
+            self._vision_pool.stop()
+
+    def _generate(self, inputs, prompt_type, max_new_tokens, speculative=None):
+        """Run generate, drafting with the small model if enabled for ``prompt_type``.
+
+        ``speculative`` forces drafting on or off (it needs the draft model
+        loaded). Greedy outputs are the same either way, only faster.
+        """
+        with self._vision_pool.pooling(inputs["pixel_values"]):
+            return self._generate_ids(inputs, prompt_type, max_new_tokens, speculative)
+
+    def _generate_ids(self, inputs, prompt_type, max_new_tokens, speculative):
+        if speculative is None:
+            speculative = self._speculative['ENABLED'] and self._speculative['PROMPTS'].get(prompt_type, False)
+        if not speculative:
+            if self._compile['ENABLED']:
+                return self._generate_compiled(inputs, max_new_tokens)
+            return self._model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+        with self._speculation.counting() as counts:
+            generated_ids = self._model.generate(
+                **inputs, max_new_tokens=max_new_tokens, do_sample=False, assistant_model=self._draft_model,
+            )
+        new_tokens = generated_ids.shape[1] - inputs["input_ids"].shape[1]
+        self._record_speculation(prompt_type, new_tokens, **counts)
+        return generated_ids
+
+    def _release_cuda_cache(self):
+        # Not with static caches: they are allocated once and must stay put
+        if self._use_cuda and not self._compile['ENABLED']:
+            torch.cuda.empty_cache()
+
+    def _warm_up_compiled(self, device):
+        """Preallocate a static KV cache per bucket and compile the decode step for each."""
+        text_config = self._model.config.text_config
+        self._compiled_decode = torch.compile(self._decode_step, dynamic=False, fullgraph=True)
+        for bucket in sorted(self._compile['BUCKETS']):
+            cache = StaticCache(
+                config=text_config, max_batch_size=1, max_cache_len=bucket, device=device, dtype=self._model.dtype
+            )
+            token = torch.zeros((1, 1), dtype=torch.long, device=device)
+            with torch.no_grad():
+                for position in range(2):  # the first call compiles, the second checks it is reused
+                    self._compiled_decode(token, torch.tensor([position], device=device), cache)
+            cache.reset()
+            self._static_caches[bucket] = cache
+        logger.info(f"Compiled static-cache decode for sequence buckets {sorted(self._static_caches)}")
+
+    def _decode_step(self, input_ids, cache_position, cache):
+        # Text model only: after the prefill the image is already in the cache
+        model = self._model.model
+        inputs_embeds = model.text_model.get_input_embeddings()(input_ids)
+        hidden = model.text_model(
+            inputs_embeds=inputs_embeds, past_key_values=cache, cache_position=cache_position, use_cache=True
+        ).last_hidden_state
+        return self._model.lm_head(hidden[:, -1])
+
+    def _generate_compiled(self, inputs, max_new_tokens):
+        """Greedy decode with an eager prefill and the compiled step on a static cache.
+
+        Returns prompt and generated ids like generate. Falls back to generate
+        when the sequence doesn't fit the largest bucket.
+        """
+        input_ids = inputs["input_ids"]
+        prompt_len = input_ids.shape[1]
+        buckets = [bucket for bucket in sorted(self._static_caches) if bucket >= prompt_len + max_new_tokens]
+        if not buckets:
+            logger.info(f"{prompt_len + max_new_tokens} tokens exceed the compiled buckets, decoding eagerly")
+            return self._model.generate(**inputs, max_new_tokens=max_new_tokens)
+
+        eos_ids = self._model.generation_config.eos_token_id
+        eos_ids = set(eos_ids if isinstance(eos_ids, list) else [eos_ids])
+        device = input_ids.device
+        # One static cache per bucket, so requests in this process take turns
+        with self._static_lock, torch.no_grad():
+            cache = self._static_caches[buckets[0]]
+            cache.reset()
+            logits = self._model(
+                **inputs, past_key_values=cache, use_cache=True,
+                cache_position=torch.arange(prompt_len, device=device),
+            ).logits[:, -1]
+            tokens = []
+            for step in range(max_new_tokens):
+                next_token = logits.argmax(-1, keepdim=True)
+                tokens.append(next_token)
+                if next_token.item() in eos_ids or step == max_new_tokens - 1:
+                    break
+                logits = self._compiled_decode(
+                    next_token, torch.tensor([prompt_len + step], device=device), cache
+                )
+        return torch.cat([input_ids] + tokens, dim=1)
+
+    def _record_speculation(self, prompt_type, new_tokens, rounds, proposed, accepted):
+        with self._stats_lock:
+            stats = self._speculative_stats.setdefault(
+                prompt_type, {'generations': 0, 'tokens': 0, 'rounds': 0, 'proposed': 0, 'accepted': 0}
+            )
+            stats['generations'] += 1
+            stats['tokens'] += new_tokens
+            stats['rounds'] += rounds
+            stats['proposed'] += proposed
+            stats['accepted'] += accepted
+        logger.info(
+            f"Speculative {prompt_type}: {new_tokens} tokens in {rounds} target passes, "
+            f"{accepted}/{proposed} draft tokens accepted"
+        )
+
+    def speculative_stats(self):
+        """Per prompt type draft acceptance since start-up."""
+        with self._stats_lock:
+            return {
+                prompt_type: dict(stats, acceptance_rate=stats['accepted'] / stats['proposed'] if stats['proposed'] else None)
+                for prompt_type, stats in self._speculative_stats.items()
+            }
+
+    def prepare_image(self, image):
+        """Open and decode an upload into an RGB image ready for the processor."""
+        if not isinstance(image, Image.Image):
+            image = Image.open(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        # Decode the pixels now rather than lazily inside the first generate call
+        image.load()
+        return image
+
     def _prepare_inputs(self, image, question_text):
         # Support image path or PIL Image
         if isinstance(image, str):
@@ -65,10 +469,10 @@ class ModelHandler:
     def generate_short_caption(self, image):
         """Generate a short caption for the image."""
         try:
-            if self._use_cuda:
-                torch.cuda.empty_cache()
-            inputs = self._prepare_inputs(image, "Describe the image in detail.")
-            generated_ids = self._model.generate(**inputs, max_new_tokens=50)
+            self._release_cuda_cache()
+            prompt = self.PROMPTS["short_caption"]
+            inputs = self._prepare_inputs(image, prompt["prompt"])
+            generated_ids = self._generate(inputs, "short_caption", prompt["max_new_tokens"])
             generated_texts = self._processor.batch_decode(generated_ids, skip_special_tokens=True)
             caption = generated_texts[0]
             logger.info(f"Generated short caption: {caption}")
@@ -80,10 +484,10 @@ class ModelHandler:
     def generate_normal_caption(self, image):
         """Generate a descriptive caption for the image."""
         try:
-            if self._use_cuda:
-                torch.cuda.empty_cache()
-            inputs = self._prepare_inputs(image, "Describe this image in detail.")
-            generated_ids = self._model.generate(**inputs, max_new_tokens=100)
+            self._release_cuda_cache()
+            prompt = self.PROMPTS["normal_caption"]
+            inputs = self._prepare_inputs(image, prompt["prompt"])
+            generated_ids = self._generate(inputs, "normal_caption", prompt["max_new_tokens"])
             generated_texts = self._processor.batch_decode(generated_ids, skip_special_tokens=True)
             caption = generated_texts[0]
             logger.info(f"Generated normal caption: {caption}")
@@ -92,17 +496,133 @@ class ModelHandler:
             logger.error(f"Error generating normal caption: {e}")
             raise
 
+    def caption_batch(self, images, prompt_type="short_caption", question=None):
+        """Run one prompt over several images in a single batched generate.
+
+        ``question`` is the prompt for "query". Returns one decoded text per
+        image, formatted like the single-image methods. Speculative and
+        compiled decoding only take one sequence at a time, so with those
+        the images go through one by one.
+        """
+        if len(images) == 1 or self._speculative['ENABLED'] or self._compile['ENABLED']:
+            single = {
+                "short_caption": self.generate_short_caption,
+                "normal_caption": self.generate_normal_caption,
+                "query": lambda image: self.process_query(image, question),
+            }[prompt_type]
+            return [single(image) for image in images]
+
+        prompt = self.PROMPTS[prompt_type]
+        messages = [{
+            "role": "user",
+            "content": [{"type": "image"}, {"type": "text", "text": prompt["prompt"] or question}],
+        }]
+        text = self._processor.apply_chat_template(messages, add_generation_prompt=True)
+        DEVICE = "cuda" if self._use_cuda else "cpu"
+        self._release_cuda_cache()
+        # Left padding so every sequence ends at its prompt and generation appends to all
+        inputs = self._processor(
+            text=[text] * len(images), images=[[image] for image in images], return_tensors="pt",
+            padding=True, padding_side="left",
+        ).to(DEVICE)
+        with self._vision_pool.pooling(inputs["pixel_values"]):
+            generated_ids = self._model.generate(**inputs, max_new_tokens=prompt["max_new_tokens"])
+        return self._processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+    END_OF_UTTERANCE = "<end_of_utterance>"
+
+    def _conversation(self, turns, question=None):
+        """Chat messages for earlier (question, answer) turns about one image, plus a new question."""
+        messages = []
+        for index, (turn_question, answer) in enumerate(turns):
+            content = [{"type": "image"}] if index == 0 else []
+            content.append({"type": "text", "text": turn_question})
+            messages.append({"role": "user", "content": content})
+            messages.append({"role": "assistant", "content": [{"type": "text", "text": answer}]})
+        if question is not None:
+            content = [{"type": "image"}] if not turns else []
+            content.append({"type": "text", "text": question})
+            messages.append({"role": "user", "content": content})
+        return messages
+
+    def _generate_turn(self, input_ids, cache, max_new_tokens, **inputs):
+        prefill_tokens = input_ids.shape[1] - cache.get_seq_length()
+        generated = self._model.generate(
+            input_ids=input_ids, past_key_values=cache, max_new_tokens=max_new_tokens,
+            return_dict_in_generate=True, **inputs,
+        )
+        answer = self._processor.batch_decode(
+            generated.sequences[:, input_ids.shape[1]:], skip_special_tokens=True
+        )[0].strip()
+        return ConversationTurn(answer, generated.sequences, generated.past_key_values, prefill_tokens)
+
+    def start_conversation(self, image, turns, question, max_new_tokens=100):
+        """Answer ``question`` after prefilling the image and all earlier turns.
+
+        Returns a ConversationTurn; pass its token ids and cache to
+        continue_conversation so the next question only prefills its own tokens.
+        """
+        image = self.prepare_image(image)
+        self._release_cuda_cache()
+        prompt = self._processor.apply_chat_template(self._conversation(turns, question), add_generation_prompt=True)
+        DEVICE = "cuda" if self._use_cuda else "cpu"
+        inputs = self._processor(text=prompt, images=[image], return_tensors="pt").to(DEVICE)
+        input_ids = inputs.pop("input_ids")
+        return self._generate_turn(input_ids, DynamicCache(), max_new_tokens, **inputs)
+
+    def continue_conversation(self, token_ids, cache, turns, question, max_new_tokens=100):
+        """Answer a follow-up reusing the KV cache of everything said so far.
+
+        ``turns`` must be the turns already in ``cache``. Only the template
+        text between the cached tokens and the new generation prompt is
+        tokenized and prefilled; the image is not processed again. Raises
+        ValueError when the chat template can't be extended that way.
+        """
+        before = self._processor.apply_chat_template(self._conversation(turns))
+        after = self._processor.apply_chat_template(self._conversation(turns, question), add_generation_prompt=True)
+        if not after.startswith(before) or self.END_OF_UTTERANCE not in before:
+            raise ValueError("Chat template is not append-only, the conversation must be rebuilt")
+        tokenizer = self._processor.tokenizer
+        # The cache ends at the last generated token: after the end-of-utterance
+        # marker if the answer finished, before it if it hit max_new_tokens
+        answer_end = before.rindex(self.END_OF_UTTERANCE)
+        if token_ids[0, -1].item() == tokenizer.convert_tokens_to_ids(self.END_OF_UTTERANCE):
+            answer_end += len(self.END_OF_UTTERANCE)
+        new_ids = tokenizer(after[answer_end:], add_special_tokens=False, return_tensors="pt").input_ids
+        input_ids = torch.cat([token_ids, new_ids.to(token_ids.device)], dim=1)
+        return self._generate_turn(input_ids, cache, max_new_tokens, attention_mask=torch.ones_like(input_ids))
+
     def process_query(self, image, query="What is in this image?"):
         """Process a query about the image."""
         try:
-            if self._use_cuda:
-                torch.cuda.empty_cache()
+            self._release_cuda_cache()
             inputs = self._prepare_inputs(image, query)
-            generated_ids = self._model.generate(**inputs, max_new_tokens=100)
+            generated_ids = self._generate(inputs, "query", self.PROMPTS["query"]["max_new_tokens"])
             generated_texts = self._processor.batch_decode(generated_ids, skip_special_tokens=True)
             answer = generated_texts[0]
             logger.info(f"Generated query response: {answer}")
             return answer
         except Exception as e:
             logger.error(f"Error processing query: {e}")
-            raise 
\ No newline at end of file
+            raise
+
+    def self_check(self, image, prompt="What is in this image?", max_new_tokens=20):
+        """Warm the model up and check it answers before it takes real requests.
+
+        Runs one short caption (first-call allocations and kernel choice)
+        and then ``prompt``; raises RuntimeError if the answer is empty.
+        Returns the answer and both latencies.
+        """
+        started = time.perf_counter()
+        self.generate_short_caption(image)
+        warm_up = time.perf_counter() - started
+        started = time.perf_counter()
+        inputs = self._prepare_inputs(image, prompt)
+        generated_ids = self._generate(inputs, "query", max_new_tokens)
+        answer = self._processor.decode(
+            generated_ids[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True
+        ).strip()
+        latency = time.perf_counter() - started
+        if not answer:
+            raise RuntimeError(f"{self.model_version} gave an empty answer to the self-check prompt")
+        return {'answer': answer, 'warm_up': warm_up, 'latency': latency}
@@ -0,0 +1,238 @@
+"""
+Zero-downtime switching of the VLM checkpoint in running workers.
+
+The fleet's target checkpoint is a record in Redis (see `manage.py
+model_swap`). Every worker runs a ModelSwapper thread that notices a new
+target, loads it next to the model it is serving, warms it up and
+self-checks it, and only then installs it as the shared ModelHandler. The
+install waits for the job in progress (HotSwapWorker holds ``job_lock``
+while a job runs), so each job sees exactly one version and records it.
+A worker whose self-check fails keeps serving its old model and reports
+the failure, which the control command answers with a rollback.
+"""
+import gc
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+import torch
+from django.conf import settings
+from PIL import Image
+from rq.worker import SimpleWorker
+
+from .model_handler import ModelHandler, _speculative_settings
+from .procmem import process_memory
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TARGET_KEY = 'vlm:model:target'
+HISTORY_KEY = 'vlm:model:history'
+GENERATION_KEY = 'vlm:model:generation'
+STATUS_KEY = 'vlm:model:workers'
+
+# Held while a job runs, so a new model is only ever installed between jobs
+job_lock = threading.Lock()
+
+
+def _swap_settings():
+    options = {
+        'POLL_S': 10,
+        'CHECK_IMAGE': None,
+        'CHECK_PROMPT': "What is in this image?",
+        'CHECK_MAX_NEW_TOKENS': 20,
+        'HISTORY': 20,
+    }
+    options.update(getattr(settings, 'VLM_HOT_SWAP', {}))
+    return options
+
+
+def _connection():
+    import django_rq
+    return django_rq.get_connection('default')
+
+
+def default_model_id():
+    """The checkpoint a worker serves when the fleet has no target."""
+    speculative = _speculative_settings()
+    return speculative['TARGET_MODEL'] if speculative['ENABLED'] else ModelHandler.MODEL_ID
+
+
+def fleet_target(connection=None):
+    """The current target {model_id, generation, set_at}, or None if never set."""
+    connection = connection or _connection()
+    raw = connection.get(TARGET_KEY)
+    return json.loads(raw) if raw else None
+
+
+def _write_target(connection, model_id):
+    target = {'model_id': model_id, 'generation': connection.incr(GENERATION_KEY), 'set_at': time.time()}
+    connection.set(TARGET_KEY, json.dumps(target))
+    return target
+
+
+def set_target(model_id, connection=None):
+    """Point the fleet at ``model_id``, remembering the current target for rollback."""
+    connection = connection or _connection()
+    current = fleet_target(connection)
+    previous = current['model_id'] if current else default_model_id()
+    if previous != model_id:
+        connection.lpush(HISTORY_KEY, previous)
+        connection.ltrim(HISTORY_KEY, 0, _swap_settings()['HISTORY'] - 1)
+    return _write_target(connection, model_id)
+
+
+def rollback(connection=None):
+    """Point the fleet back at the previous target; None if there is none."""
+    connection = connection or _connection()
+    previous = connection.lpop(HISTORY_KEY)
+    if previous is None:
+        return None
+    return _write_target(connection, previous.decode() if isinstance(previous, bytes) else previous)
+
+
+def worker_statuses(connection=None):
+    """What each worker last reported: state, model_version, generation, updated, ..."""
+    connection = connection or _connection()
+    return {
+        (name.decode() if isinstance(name, bytes) else name): json.loads(raw)
+        for name, raw in connection.hgetall(STATUS_KEY).items()
+    }
+
+
+def check_image(path=None):
+    """The self-check image: VLM_HOT_SWAP['CHECK_IMAGE'] or a generated gradient."""
+    if path:
+        return Image.open(path).convert('RGB')
+    ramp = np.linspace(0, 255, 384, dtype=np.uint8)
+    pixels = np.stack([np.tile(ramp, (384, 1)), np.tile(ramp[:, None], (1, 384)), np.full((384, 384), 128, np.uint8)],
+                      axis=-1)
+    return Image.fromarray(pixels)
+
+
+def _release_memory():
+    # The replaced handler goes once the last job holding it is done
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def load_fleet_model(connection=None):
+    """Load the fleet's current target at worker start-up instead of the default."""
+    try:
+        target = fleet_target(connection)
+    except Exception as e:
+        logger.warning(f"Could not read the fleet model target, loading the default: {str(e)}")
+        target = None
+    if target is None or target['model_id'] == default_model_id():
+        return ModelHandler.get_instance()
+    try:
+        handler = ModelHandler(model_id=target['model_id'])
+    except Exception as e:
+        logger.error(f"Could not load fleet model {target['model_id']}, loading the default: {str(e)}")
+        return ModelHandler.get_instance()
+    ModelHandler.swap_instance(handler)
+    return handler
+
+
+class HotSwapWorker(SimpleWorker):
+    """RQ worker that runs jobs in process and never has the model swapped mid-job."""
+
+    def execute_job(self, job, queue):
+        with job_lock:
+            return super().execute_job(job, queue)
+
+
+class ModelSwapper:
+    """Follows the fleet target in one process, swapping ModelHandler between jobs."""
+
+    def __init__(self, connection=None, worker=None, poll_interval=None, factory=None):
+        options = _swap_settings()
+        self.connection = connection or _connection()
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval or options['POLL_S']
+        self.factory = factory or (lambda model_id: ModelHandler(model_id=model_id))
+        self._options = options
+        self._generation = None
+        self._state = 'serving'
+        self._details = {}
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='model-swapper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(self.poll_interval)
+        self.connection.hdel(STATUS_KEY, self.worker)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                # A Redis outage must not take the worker down; try again next poll
+                logger.warning(f"Model swap poll failed: {str(e)}")
+            self._stopping.wait(self.poll_interval)
+
+    def serving(self):
+        handler = ModelHandler._instance
+        return handler.model_version if handler is not None else None
+
+    def poll(self):
+        """Act on a new target, if any, and report this worker's state."""
+        target = fleet_target(self.connection)
+        if target is not None and target['generation'] != self._generation:
+            self._generation = target['generation']
+            if target['model_id'] != self.serving():
+                self.swap(target)
+                return
+            self._state, self._details = 'serving', {}
+        # Heartbeat; a failed swap stays reported until the next target
+        self.report(self._state)
+
+    def swap(self, target):
+        """Load, warm up and check ``target`` beside the current model, then install it."""
+        model_id = target['model_id']
+        logger.info(f"Loading {model_id} to replace {self.serving()}")
+        self._details = {}
+        self.report('loading', loading=model_id)
+        started = time.perf_counter()
+        handler = None
+        try:
+            handler = self.factory(model_id)
+            check = handler.self_check(
+                check_image(self._options['CHECK_IMAGE']), self._options['CHECK_PROMPT'],
+                self._options['CHECK_MAX_NEW_TOKENS'],
+            )
+        except Exception as e:
+            logger.error(f"Not switching to {model_id}: {str(e)}")
+            handler = None
+            _release_memory()
+            self._details = {'loading': model_id, 'error': str(e)}
+            self.report('failed')
+            return False
+        load = time.perf_counter() - started
+
+        with job_lock:
+            ModelHandler.swap_instance(handler)
+        _release_memory()
+        logger.info(f"Switched to {model_id} in {load:.1f}s, self-check answer: {check['answer']!r}")
+        self._details = {'load': round(load, 2), 'check_latency': round(check['latency'], 3)}
+        self.report('serving')
+        return True
+
+    def report(self, state, **details):
+        self._state = state
+        status = {
+            'state': state, 'model_version': self.serving(), 'generation': self._generation,
+            'updated': time.time(), 'pss': process_memory()['pss'], **self._details, **details,
+        }
+        self.connection.hset(STATUS_KEY, self.worker, json.dumps(status))
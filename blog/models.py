@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.contrib.auth.models import User
+from .storage import ContentAddressedStorage, ContentAddressedImageField, hash_content
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -11,14 +12,32 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
+class ImageAnalysisQuerySet(models.QuerySet):
+    def with_content(self, file):
+        """Analyses whose image has exactly the same bytes as ``file``."""
+        return self.filter(content_hash=hash_content(file))
+
 class ImageAnalysis(models.Model):
-    image = models.ImageField(upload_to='uploads/')
+    image = ContentAddressedImageField(upload_to='uploads/', storage=ContentAddressedStorage(), hash_field='content_hash')
     upload_date = models.DateTimeField(default=timezone.now)
     short_caption = models.TextField(blank=True)
     normal_caption = models.TextField(blank=True)
     query_text = models.TextField(blank=True, null=True)
     query_result = models.TextField(blank=True, null=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='analyses')
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    model_version = models.CharField(max_length=200, blank=True, db_index=True)
+    # Provenance of the captions and answer (ModelHandler.result_provenance);
+    # config_hash differs for rows produced by another model, prompt or params
+    prompt_hash = models.CharField(max_length=16, blank=True)
+    result_tier = models.CharField(max_length=100, blank=True)
+    generation_params = models.JSONField(null=True, blank=True)
+    config_hash = models.CharField(max_length=16, blank=True, db_index=True)
+    # Stage timings in seconds for voice questions (process_voice_query)
+    transcription_time = models.FloatField(null=True, blank=True)
+    query_time = models.FloatField(null=True, blank=True)
+    
+    objects = ImageAnalysisQuerySet.as_manager()
     
     class Meta:
         ordering = ['-upload_date']
@@ -27,6 +46,11 @@ class ImageAnalysis(models.Model):
     def __str__(self):
         return f"Analysis {self.id} - {self.upload_date.strftime('%Y-%m-%d %H:%M')}"
 
+    def save(self, *args, **kwargs):
+        # The image field locks the blob's content hash; hold it until the row commits
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 class DetectedObject(models.Model):
     image_analysis = models.ForeignKey(ImageAnalysis, on_delete=models.CASCADE, related_name='detected_objects', null=True, blank=True)
     label = models.CharField(max_length=100)
@@ -41,4 +65,20 @@ class DetectedObject(models.Model):
     
     def __str__(self):
         return f"{self.label} ({self.confidence:.2f})"
+
+class ChatTurn(models.Model):
+    """One question and answer in a multi-turn chat about an analysed image."""
+    analysis = models.ForeignKey(ImageAnalysis, on_delete=models.CASCADE, related_name='chat_turns')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='chat_turns')
+    question = models.TextField()
+    answer = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    # Seconds from the question to the answer, including any cache rebuild
+    latency = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+
+    def __str__(self):
+        return f"Chat turn {self.id} on analysis {self.analysis_id}"
 # Create your models here.
@@ -0,0 +1,222 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+
+from .models import ImageAnalysis
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _coalescing_settings():
+    defaults = {'ENABLED': False, 'MAX_BATCH': 50, 'MAX_DELAY': 0.05, 'REPLY_TIMEOUT': 30}
+    defaults.update(getattr(settings, 'WRITE_COALESCING', {}))
+    return defaults
+
+
+def bulk_save_analyses(rows):
+    """Insert several analyses in a single transaction and return the saved objects.
+
+    ``bulk_create`` skips model signals, so ``post_save`` is sent for every row
+    once the transaction has committed to keep cache invalidation working.
+    """
+    analyses = [ImageAnalysis(**row) for row in rows]
+    with transaction.atomic():
+        ImageAnalysis.objects.bulk_create(analyses)
+    for analysis in analyses:
+        post_save.send(
+            sender=ImageAnalysis, instance=analysis, created=True,
+            update_fields=None, raw=False, using=analysis._state.db,
+        )
+    return analyses
+
+
+class CoalescingWriter:
+    """Group-commit writer for completed analyses.
+
+    Callers block in ``submit`` while a background thread gathers whatever
+    rows arrive within ``max_delay`` (up to ``max_batch``) and commits them in
+    one transaction, so concurrent jobs share a single SQLite write lock.
+    Only rows submitted in this process are batched together; inference
+    workers in separate processes share one through a WriterService.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            # The writer thread does not survive a fork, so a forked child needs its own
+            if cls._instance is None or cls._instance.pid != os.getpid():
+                options = _coalescing_settings()
+                cls._instance = cls(max_batch=options['MAX_BATCH'], max_delay=options['MAX_DELAY'])
+            return cls._instance
+
+    def __init__(self, max_batch=50, max_delay=0.05):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pid = os.getpid()
+        self.transactions = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='analysis-writer', daemon=True)
+        self._thread.start()
+
+    def submit_async(self, analysis_data):
+        """Queue one analysis for the next batch; the future resolves once it is committed."""
+        future = Future()
+        self._queue.put((analysis_data, future))
+        return future
+
+    def submit(self, analysis_data):
+        """Queue one analysis for the next batch and wait until it is committed."""
+        return self.submit_async(analysis_data).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            analyses = bulk_save_analyses([data for data, _ in batch])
+            logger.info(f"Committed {len(analyses)} analyses in one transaction")
+            self.transactions += 1
+            self.rows += len(analyses)
+            for analysis, (_, future) in zip(analyses, batch):
+                future.set_result(analysis)
+        except Exception as e:
+            logger.error(f"Error committing analysis batch: {str(e)}")
+            for _, future in batch:
+                future.set_exception(e)
+        finally:
+            # Don't hold a connection (and its file handles) while idle
+            if self._queue.empty():
+                connection.close()
+
+
+class WriterService:
+    """Commits the analyses of several worker processes through one CoalescingWriter.
+
+    Runs in the long-lived process that starts the inference workers (see
+    InferencePool), the one place that sees rows from all of them. Each
+    worker gets an endpoint from ``connect``, sends its rows over the shared
+    request queue and reads the outcome from its own pipe (RemoteWriter).
+    """
+
+    def __init__(self, context, writer=None):
+        self.requests = context.Queue()
+        self._context = context
+        self._writer = writer or CoalescingWriter.get_instance()
+        self._replies = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='analysis-writer-service', daemon=True)
+        self._thread.start()
+
+    def connect(self):
+        """Endpoint for one worker process: pass it over and build a RemoteWriter from it there."""
+        receiver, sender = self._context.Pipe(duplex=False)
+        with self._lock:
+            client_id = next(self._ids)
+            self._replies[client_id] = sender
+        return self.requests, receiver, client_id
+
+    def disconnect(self, endpoint):
+        """Forget a worker that has exited."""
+        with self._lock:
+            sender = self._replies.pop(endpoint[2], None)
+        if sender is not None:
+            sender.close()
+
+    def stop(self):
+        self.requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            message = self.requests.get()
+            if message is None:
+                return
+            client_id, seq, analysis_data = message
+            future = self._writer.submit_async(analysis_data)
+            future.add_done_callback(lambda future, client_id=client_id, seq=seq: self._reply(client_id, seq, future))
+
+    def _reply(self, client_id, seq, future):
+        error = future.exception()
+        reply = (seq, None, error) if error is not None else (seq, future.result().pk, None)
+        with self._lock:
+            sender = self._replies.get(client_id)
+        if sender is None:
+            return
+        try:
+            sender.send(reply)
+        except Exception as e:
+            # The worker has gone, or the error can't be pickled: it times out waiting
+            logger.error(f"Could not report analysis commit to worker {client_id}: {str(e)}")
+
+
+class RemoteWriter:
+    """Worker-side end of a WriterService: ``submit`` blocks until the row is committed."""
+
+    def __init__(self, requests, replies, client_id, timeout=None):
+        self.timeout = timeout or _coalescing_settings()['REPLY_TIMEOUT']
+        self._requests = requests
+        self._replies = replies
+        self._client_id = client_id
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def submit(self, analysis_data):
+        with self._lock:
+            self._seq += 1
+            self._requests.put((self._client_id, self._seq, analysis_data))
+            while True:
+                if not self._replies.poll(self.timeout):
+                    raise TimeoutError(f"Analysis not committed within {self.timeout}s")
+                seq, pk, error = self._replies.recv()
+                # Replies to earlier submits that timed out are stale
+                if seq == self._seq:
+                    break
+        if error is not None:
+            raise error
+        return ImageAnalysis.objects.get(pk=pk)
+
+
+# Set in inference workers whose pool runs a WriterService
+_process_writer = None
+
+
+def use_writer(writer):
+    """Send this process's analyses through ``writer`` (a RemoteWriter) from now on."""
+    global _process_writer
+    _process_writer = writer
+
+
+def save_analysis(analysis_data):
+    """Persist a completed analysis, coalescing writes when enabled in settings.
+
+    Inference workers hand their rows to the pool's WriterService; any other
+    process coalesces the rows of its own threads.
+    """
+    if _coalescing_settings()['ENABLED']:
+        writer = _process_writer or CoalescingWriter.get_instance()
+        return writer.submit(analysis_data)
+    return ImageAnalysis.objects.create(**analysis_data)
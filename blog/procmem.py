@@ -0,0 +1,26 @@
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def process_memory(pid='self'):
+    """Memory of a process in MB, read from /proc (Linux only).
+
+    ``rss`` counts every resident page, ``rss_file`` the file-backed part
+    (memory-mapped weights) and ``rss_anon`` the private part. ``pss``
+    divides shared pages between the processes mapping them, so it sums to
+    the real footprint across workers. Missing fields are None.
+    """
+    memory = {'rss': None, 'rss_anon': None, 'rss_file': None, 'pss': None}
+    fields = {'VmRSS:': 'rss', 'RssAnon:': 'rss_anon', 'RssFile:': 'rss_file', 'Pss:': 'pss'}
+    for name in ('status', 'smaps_rollup'):
+        try:
+            with open(f'/proc/{pid}/{name}') as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and parts[0] in fields and memory[fields[parts[0]]] is None:
+                        memory[fields[parts[0]]] = int(parts[1]) / 1024
+        except OSError as e:
+            logger.debug(f"Could not read /proc/{pid}/{name}: {str(e)}")
+    return memory
@@ -0,0 +1,57 @@
+"""
+State files and file-tree walks for batch jobs that resume where they stopped.
+
+Shared by retention, the recaption backfill, directory captioning and the
+embedding index: state is a JSON file replaced atomically, and ``iter_files``
+walks a tree in a stable order from a cursor.
+"""
+import json
+import os
+import posixpath
+
+
+def load_state(path):
+    """Load the state saved by the previous run, or ``{}`` on the first."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(path, state):
+    """Write ``state`` as JSON, replacing ``path`` atomically so a crash never leaves half a file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _parts(rel_path):
+    return rel_path.split('/') if rel_path else []
+
+
+def iter_files(base, after='', rel=''):
+    """Yield ``(relative path, DirEntry)`` for files under ``base`` in sorted order.
+
+    Only files strictly after the ``after`` cursor are yielded, and whole
+    subtrees that lie before it are skipped without being listed, so a
+    resumed scan does not pay for what earlier runs already covered.
+    """
+    directory = os.path.join(base, rel)
+    if not os.path.isdir(directory):
+        return
+    after_parts = _parts(after)
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    for entry in entries:
+        rel_path = posixpath.join(rel, entry.name) if rel else entry.name
+        parts = _parts(rel_path)
+        if entry.is_dir(follow_symlinks=False):
+            if parts < after_parts and after_parts[:len(parts)] != parts:
+                continue
+            yield from iter_files(base, after, rel_path)
+        elif entry.is_file(follow_symlinks=False) and parts > after_parts:
+            if entry.name.endswith('.part'):
+                # In-flight upload, see ContentAddressedStorage._save
+                continue
+            yield rel_path, entry
@@ -0,0 +1,179 @@
+import logging
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image
+
+from .fragment_cache import bump_generation
+from .models import ImageAnalysis, UserProfile
+from .resumable import iter_files
+from .storage import ContentAddressedStorage, lock_content
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+HOUR = 3600
+
+
+def _referenced_names(names):
+    """Return which of the given media names are referenced by a model row."""
+    names = list(names)
+    referenced = set(ImageAnalysis.objects.filter(image__in=names).values_list('image', flat=True))
+    referenced.update(UserProfile.objects.filter(profile_picture__in=names).values_list('profile_picture', flat=True))
+    return referenced
+
+
+def _referenced_locked(name):
+    """Re-check one name under its content lock; the caller holds a transaction.
+
+    An identical upload reuses an existing blob under the same lock (see
+    lock_content), so until the transaction ends no row can start pointing
+    at ``name`` behind the caller's back. The batch snapshot can't promise
+    that: reusing a blob doesn't touch its mtime.
+    """
+    digest = ContentAddressedStorage.digest_from_name(name)
+    if digest:
+        lock_content(digest)
+    return name in _referenced_names([name])
+
+
+def _delete_expired(policy, batch, now, dry_run):
+    """Delete files older than ``max_age_hours`` (debug artifacts)."""
+    max_age = policy['max_age_hours'] * HOUR
+    reclaimed, acted = 0, 0
+    for name, entry in batch:
+        stat = entry.stat()
+        if now - stat.st_mtime < max_age:
+            continue
+        if not dry_run:
+            os.remove(entry.path)
+        reclaimed += stat.st_size
+        acted += 1
+    return acted, reclaimed
+
+
+# Modes WebP holds without changing a pixel (palette and grey images are expanded)
+LOSSLESS_MODES = {'1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA'}
+
+
+def _archive_to_cold_tier(policy, batch, now, dry_run):
+    """Re-encode old, referenced originals as lossless WebP under the cold tier and repoint their rows.
+
+    The pixels are kept exactly, so captions and embeddings computed from an
+    archived image match those of the original. Animated images and modes
+    WebP cannot hold losslessly stay where they are. A dry run only counts
+    the candidates: what each saves is only known once it is encoded.
+    """
+    max_age = policy['max_age_hours'] * HOUR
+    referenced = _referenced_names(name for name, _ in batch)
+    reclaimed, acted = 0, 0
+    for name, entry in batch:
+        stat = entry.stat()
+        # Unreferenced files are left to the orphan collector
+        if now - stat.st_mtime < max_age or name not in referenced:
+            continue
+        if dry_run:
+            acted += 1
+            continue
+        # The full original name keeps bike.jpg and bike.png apart
+        cold_name = posixpath.join(policy['cold_path'], f"{name}.webp")
+        cold_path = os.path.join(settings.MEDIA_ROOT, cold_name)
+        try:
+            with Image.open(entry.path) as image:
+                if image.mode not in LOSSLESS_MODES or getattr(image, 'n_frames', 1) > 1:
+                    continue
+                os.makedirs(os.path.dirname(cold_path), exist_ok=True)
+                icc_profile, exif = image.info.get('icc_profile'), image.info.get('exif')
+                image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'PA', 'P') else 'RGB')
+                image.save(f"{cold_path}.part", format='WEBP', lossless=True, exact=True,
+                           quality=policy.get('effort', 80), icc_profile=icc_profile, exif=exif or b'')
+        except Exception as e:
+            logger.error(f"Error archiving {name}: {str(e)}")
+            continue
+        cold_size = os.path.getsize(f"{cold_path}.part")
+        if cold_size >= stat.st_size:
+            # Already well compressed, keep the original where it is
+            os.remove(f"{cold_path}.part")
+            continue
+        with transaction.atomic():
+            if not _referenced_locked(name):
+                # Its rows went away meanwhile: leave the original to the orphan collector
+                os.remove(f"{cold_path}.part")
+                continue
+            os.replace(f"{cold_path}.part", cold_path)
+            user_ids = set(ImageAnalysis.objects.filter(image=name).values_list('user_id', flat=True))
+            ImageAnalysis.objects.filter(image=name).update(image=cold_name)
+            # Queryset updates skip signals, so invalidate cached listings by hand
+            for user_id in user_ids:
+                transaction.on_commit(lambda user_id=user_id: bump_generation(user_id))
+            os.remove(entry.path)
+        reclaimed += stat.st_size - cold_size
+        acted += 1
+    return acted, reclaimed
+
+
+def _collect_orphans(policy, batch, now, dry_run):
+    """Delete files that no model row references.
+
+    A grace period protects files whose row is still being committed. Each
+    candidate is checked again under its content lock right before removal,
+    since an identical upload may have reused it since the batch snapshot.
+    """
+    min_age = policy.get('min_age_hours', 1) * HOUR
+    referenced = _referenced_names(name for name, _ in batch)
+    reclaimed, acted = 0, 0
+    for name, entry in batch:
+        stat = entry.stat()
+        if name in referenced or now - stat.st_mtime < min_age:
+            continue
+        if not dry_run:
+            with transaction.atomic():
+                if _referenced_locked(name):
+                    continue
+                os.remove(entry.path)
+        reclaimed += stat.st_size
+        acted += 1
+    return acted, reclaimed
+
+
+ACTIONS = {
+    'delete': _delete_expired,
+    'archive': _archive_to_cold_tier,
+    'collect_orphans': _collect_orphans,
+}
+
+
+def run_policy(name, policy, state, batch_size, dry_run=False):
+    """Process one bounded batch of a policy, advancing its cursor in ``state``.
+
+    Returns a stats dict with the number of files scanned and acted on and
+    the bytes reclaimed. When the scan reaches the end of the directory the
+    cursor is reset so the next run starts a fresh pass.
+    """
+    base = os.path.join(settings.MEDIA_ROOT, policy['path'])
+    policy_state = state.setdefault(name, {'cursor': '', 'passes': 0})
+    batch = []
+    for rel_path, entry in iter_files(base, after=policy_state['cursor']):
+        batch.append((posixpath.join(policy['path'], rel_path), entry))
+        if len(batch) >= batch_size:
+            break
+
+    acted, reclaimed = ACTIONS[policy['action']](policy, batch, time.time(), dry_run)
+
+    finished_pass = len(batch) < batch_size
+    if not dry_run:
+        if finished_pass:
+            policy_state['cursor'] = ''
+            policy_state['passes'] += 1
+        else:
+            policy_state['cursor'] = posixpath.relpath(batch[-1][0], policy['path'])
+    logger.info(f"Retention policy {name}: scanned {len(batch)}, acted on {acted}, reclaimed {reclaimed} bytes")
+    return {
+        'scanned': len(batch),
+        'acted': acted,
+        'reclaimed_bytes': reclaimed,
+        'finished_pass': finished_pass,
+    }
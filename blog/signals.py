@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .fragment_cache import bump_generation
+from .models import ImageAnalysis, UserProfile
+from .storage import lock_content
+
+
+@receiver(post_save, sender=ImageAnalysis)
+@receiver(post_delete, sender=ImageAnalysis)
+def invalidate_analysis_fragments(sender, instance, **kwargs):
+    """Drop the owner's cached listings once a change to one of their analyses commits.
+
+    Bumping earlier would let a concurrent request render the uncommitted
+    state and cache it under the new generation.
+    """
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_generation(user_id))
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_profile_fragments(sender, instance, **kwargs):
+    """Drop the user's cached listings once a change to their profile commits."""
+    user_id = instance.user_id
+    transaction.on_commit(lambda: bump_generation(user_id))
+
+
+@receiver(post_delete, sender=ImageAnalysis)
+def release_image_blob(sender, instance, **kwargs):
+    """Delete the stored image once no remaining analysis references it.
+
+    Uploads are deduplicated by content, so several analyses can share one
+    blob; the remaining references are counted after the delete commits,
+    under the content lock an identical upload takes (see lock_content).
+    """
+    name = instance.image.name
+    if not name:
+        return
+
+    def release():
+        with transaction.atomic():
+            if instance.content_hash:
+                lock_content(instance.content_hash)
+            still_referenced = ImageAnalysis.objects.filter(
+                content_hash=instance.content_hash, image=name
+            ).exists()
+            if not still_referenced:
+                instance.image.storage.delete(name)
+
+    transaction.on_commit(release)
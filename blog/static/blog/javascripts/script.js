@@ -211,6 +211,51 @@ document.addEventListener("DOMContentLoaded", function() {
         });
     }
 
+    function processVoiceQuery(file, audioBlob) {
+        uploadBtn.disabled = true;
+        uploadBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
+        const formData = new FormData();
+        formData.append('image', file);
+        formData.append('audio', audioBlob, 'question.webm');
+
+        const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+
+        fetch('/blog/process-voice-query/', {
+            method: 'POST',
+            body: formData,
+            headers: {
+                'X-CSRFToken': csrftoken
+            }
+        })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('Network response was not ok: ' + response.status);
+            }
+            return response.json();
+        })
+        .then(data => {
+            if (data.error) {
+                throw new Error(data.error);
+            }
+            if (data.status === 'processing') {
+                pollForResults(data.job_id);
+            } else {
+                displayResults(data);
+            }
+            refreshRecentAnalyses()
+        })
+        .catch(error => {
+            resultsContainer.innerHTML = `
+                <div class="error-message">
+                    <i class="fas fa-exclamation-circle"></i>
+                    <p>${error.message}</p>
+                </div>
+            `;
+            uploadBtn.disabled = false;
+            uploadBtn.innerHTML = '<span class="btn-icon">⇪</span> Upload';
+        });
+    }
+
     function pollForResults(jobId) {
         // Set a maximum poll count to avoid infinite polling
         let pollCount = 0;
@@ -288,6 +333,37 @@ document.addEventListener("DOMContentLoaded", function() {
         }, 2000); // Poll every 2 seconds
     }
 
+    async function streamFollowUp(question, analysisId, answerEl) {
+        const csrftoken = document.querySelector('[name=csrfmiddlewaretoken]').value;
+        answerEl.hidden = false;
+        answerEl.textContent = '';
+        try {
+            const response = await fetch('/blog/llm/follow-up/', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': csrftoken
+                },
+                body: JSON.stringify({ question: question, analysis_id: analysisId })
+            });
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.message || 'Server returned ' + response.status);
+            }
+            // Show tokens as they are generated
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                answerEl.textContent += decoder.decode(value, { stream: true });
+            }
+        } catch (err) {
+            console.error('Error streaming follow-up:', err);
+            answerEl.textContent = err.message;
+        }
+    }
+
     function displayResults(data) {
         resultsContainer.innerHTML = `
             <img src="${data.image_url}" alt="Analyzed image" class="result-image">
@@ -302,17 +378,41 @@ document.addEventListener("DOMContentLoaded", function() {
             ${data.query_result ? `
                 <div class="caption-section">
                     <h3>Query Result</h3>
+                    ${data.transcription_time != null ? `
+                        <p class="query-question">“${data.query_text}”</p>
+                    ` : ''}
                     <div class="caption-content">
                         ${data.query_result}
                     </div>
                 </div>
             ` : ''}
             
+            ${data.analysis_id ? `
+                <div class="caption-section">
+                    <h3>Ask a Follow-up</h3>
+                    <form id="follow-up-form" class="follow-up-form">
+                        <input type="text" id="follow-up-input" placeholder="Ask more about this image...">
+                        <button type="submit" class="btn">Ask</button>
+                    </form>
+                    <div id="follow-up-answer" class="caption-content" hidden></div>
+                </div>
+            ` : ''}
+            
             <div class="upload-another-container">
                 <button id="upload-another-btn" class="btn blue">Upload Again</button>
             </div>
         `;
 
+        if (data.analysis_id) {
+            document.getElementById('follow-up-form').addEventListener('submit', function(e) {
+                e.preventDefault();
+                const question = document.getElementById('follow-up-input').value.trim();
+                if (question) {
+                    streamFollowUp(question, data.analysis_id, document.getElementById('follow-up-answer'));
+                }
+            });
+        }
+
         // Add event listener to the "Upload Again" button
         document.getElementById('upload-another-btn').addEventListener('click', function() {
             console.log("Upload Again button clicked");
@@ -458,26 +558,33 @@ if (speechToTextBtn) {
         mediaRecorder.ondataavailable = e => audioChunks.push(e.data);
         mediaRecorder.onstop = async () => {
             const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
+            console.log("Audio blob size:", audioBlob.size);
 
-            // Convert WebM/Opus blob to base64
-            const audioBase64 = await blobToBase64(audioBlob);
-            console.log("Base64 audio data length:", audioBase64.length);
+            // With an image selected, ask the question about it in a single job
+            if (fileInput && fileInput.files.length > 0) {
+                processVoiceQuery(fileInput.files[0], audioBlob);
+                return;
+            }
 
             try {
+                // Send the WebM/Opus bytes as-is, no base64 inflation
                 const response = await fetch('/blog/speech-to-text/', {
                     method: 'POST',
                     headers: {
-                        'Content-Type': 'application/json',
+                        'Content-Type': 'audio/webm',
                         'X-CSRFToken': csrftoken
                     },
-                    body: JSON.stringify({ audio_base64: `data:audio/webm;base64,${audioBase64}` })
+                    body: audioBlob
                 });
 
                 if (!response.ok) throw new Error('Server returned ' + response.status);
                 const data = await response.json();
                 console.log("Data received from server:", data);
 
-                if (data.status === 'success' && data.text) {
+                if (data.job_id) {
+                    // Long recordings are transcribed in the background
+                    pollTranscription(data.job_id);
+                } else if (data.status === 'success' && data.text) {
                     queryInput.value = data.text;
                     console.log("detected text from backend: "+ data.text);
                     
@@ -510,6 +617,31 @@ if (speechToTextBtn) {
 }
 
 
+    function pollTranscription(jobId) {
+        const pollInterval = setInterval(() => {
+            fetch(`/blog/check-job/${jobId}/`)
+            .then(response => {
+                if (!response.ok) throw new Error('Server returned ' + response.status);
+                return response.json();
+            })
+            .then(data => {
+                if (data.status === 'completed') {
+                    clearInterval(pollInterval);
+                    queryInput.value = data.text || "Could not hear anything. Please try again";
+                } else if (data.status === 'failed') {
+                    throw new Error(data.error || 'Transcription failed');
+                } else if (data.progress) {
+                    queryInput.value = `Transcribing... ${data.progress.completed}/${data.progress.total}`;
+                }
+            })
+            .catch(err => {
+                clearInterval(pollInterval);
+                console.error('Error transcribing audio:', err);
+                queryInput.value = "Error transcribing audio";
+            });
+        }, 2000);
+    }
+
     function stopRecording() {
         if (!isRecording) return;
         mediaRecorder.stop();
@@ -524,18 +656,6 @@ if (speechToTextBtn) {
         speechToTextBtn.title = 'Speak your question (15s)';
     }
 
-    // Convert blob to base64
-function blobToBase64(blob) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onloadend = () => {
-            const base64data = reader.result.split(',')[1]; // remove "data:...base64,"
-            resolve(base64data);
-        };
-        reader.onerror = reject;
-        reader.readAsDataURL(blob);
-    });
-}
 }
 
 
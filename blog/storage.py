@@ -0,0 +1,128 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import DEFAULT_DB_ALIAS, connections, models, router
+from django.db.transaction import TransactionManagementError
+from django.utils.deconstruct import deconstructible
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def hash_content(content):
+    """Return the SHA-256 hex digest of a file, leaving it rewound."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def lock_content(digest, using=DEFAULT_DB_ALIAS):
+    """Hold the lock on one content hash until the current transaction ends.
+
+    Taken by an upload before it looks for an existing blob and by the
+    release of a blob before it counts references, so a blob can't be
+    deleted between an identical upload finding it and that upload's row
+    committing. Postgres takes a transaction-level advisory lock; SQLite's
+    IMMEDIATE transactions already hold the database write lock.
+    """
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        raise TransactionManagementError("lock_content() must be called inside an atomic block")
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [int(digest[:15], 16)])
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage that names files by the SHA-256 of their content.
+
+    ``uploads/photo.jpg`` is stored as ``uploads/ab/cd/abcd...ef.jpg``, so
+    identical uploads land on the same blob instead of getting a random
+    suffix, and the directory fan-out keeps each folder small.
+    """
+
+    def __init__(self, shard_depth=2, shard_width=2, **kwargs):
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        super().__init__(**kwargs)
+
+    def blob_name(self, digest, name):
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        ext = os.path.splitext(name)[1].lower()
+        shards = [digest[i * self.shard_width:(i + 1) * self.shard_width] for i in range(self.shard_depth)]
+        return posixpath.join(directory, *shards, f"{digest}{ext}")
+
+    @staticmethod
+    def digest_from_name(name):
+        """Return the content hash encoded in a blob name, or '' for legacy names."""
+        stem = os.path.splitext(posixpath.basename(name or ''))[0]
+        return stem if DIGEST_RE.match(stem) else ''
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.blob_name(hash_content(content), name)
+        # Identical content is already stored, just reference it
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so concurrent uploads of the same
+        # content never observe a half-written blob
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+
+class ContentAddressedImageField(models.ImageField):
+    """ImageField that copies the blob's content hash onto ``hash_field`` when saved."""
+
+    def __init__(self, *args, hash_field=None, **kwargs):
+        self.hash_field = hash_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.hash_field:
+            kwargs['hash_field'] = self.hash_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        pending = getattr(model_instance, self.attname)
+        if pending and not pending._committed and isinstance(self.storage, ContentAddressedStorage):
+            using = router.db_for_write(type(model_instance), instance=model_instance)
+            # Callers outside a transaction (ImageAnalysis.save always opens one) can't hold the lock
+            if connections[using].in_atomic_block:
+                lock_content(hash_content(pending), using)
+        file = super().pre_save(model_instance, add)
+        if self.hash_field and file:
+            digest = ContentAddressedStorage.digest_from_name(file.name)
+            if digest:
+                setattr(model_instance, self.hash_field, digest)
+        return file
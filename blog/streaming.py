@@ -0,0 +1,308 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+import numpy as np
+import webrtcvad
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+
+from .audio import SAMPLE_RATE
+from .transcription import TranscriptionQueueFull, TranscriptionTimeout, transcribe
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 30  # webrtcvad accepts 10, 20 or 30 ms frames
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+FRAME_BYTES = FRAME_SAMPLES * 2  # 16-bit PCM
+
+
+def _streaming_settings():
+    options = {
+        'VAD_AGGRESSIVENESS': 2,
+        'START_FRAMES': 3,
+        'END_SILENCE_MS': 300,
+        'PADDING_MS': 150,
+        'MAX_UTTERANCE_S': 15,
+        'PARTIAL_INTERVAL_MS': 1000,
+        'CONTEXT_WORDS': 50,
+        'PROFILE': 'voice_query',
+    }
+    options.update(getattr(settings, 'STREAMING_STT', {}))
+    return options
+
+
+def pcm_to_float(pcm):
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+class VadSegmenter:
+    """Split a 16 kHz mono 16-bit PCM stream into utterances with webrtcvad.
+
+    An utterance starts after ``start_frames`` consecutive voiced frames
+    (keeping ``padding_ms`` of pre-roll) and ends after ``end_silence_ms``
+    of silence or when it reaches ``max_utterance_s``. ``utterance`` is the
+    0-based number of the utterance in progress or last ended.
+    """
+
+    def __init__(self, aggressiveness=2, start_frames=3, end_silence_ms=300, padding_ms=150, max_utterance_s=15):
+        self._vad = webrtcvad.Vad(aggressiveness)
+        self.start_frames = start_frames
+        self.end_silence_frames = max(1, end_silence_ms // FRAME_MS)
+        self.max_frames = int(max_utterance_s * 1000 // FRAME_MS)
+        self._preroll = deque(maxlen=max(1, padding_ms // FRAME_MS))
+        self._pending = b''
+        self._frames = []
+        self._voiced_run = 0
+        self._silent_run = 0
+        self.start_frame = 0
+        self.frames_seen = 0
+        self.utterance = -1
+        self.in_speech = False
+
+    def feed(self, pcm):
+        """Consume PCM bytes and return the utterances completed by them.
+
+        Each utterance is ``(pcm bytes, start seconds, end seconds)`` on the
+        stream's own timeline.
+        """
+        self._pending += pcm
+        completed = []
+        while len(self._pending) >= FRAME_BYTES:
+            frame, self._pending = self._pending[:FRAME_BYTES], self._pending[FRAME_BYTES:]
+            utterance = self._process(frame)
+            if utterance:
+                completed.append(utterance)
+        return completed
+
+    def _process(self, frame):
+        voiced = self._vad.is_speech(frame, SAMPLE_RATE)
+        self.frames_seen += 1
+        if not self.in_speech:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                self.utterance += 1
+                self._frames = list(self._preroll)
+                self.start_frame = self.frames_seen - len(self._frames)
+                self._silent_run = 0
+            return None
+        self._frames.append(frame)
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.end_silence_frames or len(self._frames) >= self.max_frames:
+            return self._close()
+        return None
+
+    def _close(self):
+        # Trailing silence isn't part of the utterance
+        speech_frames = self._frames[:len(self._frames) - self._silent_run] or self._frames
+        start = self.start_frame * FRAME_MS / 1000
+        utterance = (b''.join(speech_frames), start, start + len(speech_frames) * FRAME_MS / 1000)
+        self.in_speech = False
+        self._frames = []
+        self._preroll.clear()
+        self._voiced_run = 0
+        self._silent_run = 0
+        return utterance
+
+    def flush(self):
+        """End the utterance in progress, if any (e.g. when the client stops)."""
+        return self._close() if self.in_speech else None
+
+    def current_audio(self):
+        """PCM of the utterance still in progress, for partial transcripts."""
+        return b''.join(self._frames) if self.in_speech else b''
+
+
+class StreamingSession:
+    """Per-connection state: VAD segmentation, partials and ordered finals.
+
+    Finals are transcribed in order on a dedicated task using the previous
+    finals as a rolling ``initial_prompt``; a partial is only started when
+    nothing else is being transcribed, so partials never delay a final.
+    Messages carry the number of their utterance, and a partial that is
+    ready only after its utterance ended is dropped.
+    """
+
+    def __init__(self, send, options=None):
+        self.options = options or _streaming_settings()
+        self.segmenter = VadSegmenter(
+            aggressiveness=self.options['VAD_AGGRESSIVENESS'],
+            start_frames=self.options['START_FRAMES'],
+            end_silence_ms=self.options['END_SILENCE_MS'],
+            padding_ms=self.options['PADDING_MS'],
+            max_utterance_s=self.options['MAX_UTTERANCE_S'],
+        )
+        self._send = send
+        self._context = deque(maxlen=self.options['CONTEXT_WORDS'])
+        self._finals = asyncio.Queue()
+        self._final_task = asyncio.create_task(self._final_worker())
+        self._partial_task = None
+        self._partial_utterance = None
+        self._last_partial_frames = 0
+        self._finals_sent = 0
+
+    async def _send_json(self, payload):
+        await self._send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    async def _transcribe(self, pcm):
+        options = {
+            'condition_on_previous_text': False,
+            'without_timestamps': True,
+        }
+        if self._context:
+            options['initial_prompt'] = " ".join(self._context)
+        # In a thread: the first call loads the profile's model
+        result = await asyncio.to_thread(transcribe, pcm_to_float(pcm), self.options['PROFILE'], **options)
+        return " ".join(segment.text.strip() for segment in result['segments']).strip()
+
+    async def feed(self, pcm):
+        for utterance in self.segmenter.feed(pcm):
+            await self._finals.put(utterance)
+        self._maybe_start_partial()
+
+    def _maybe_start_partial(self):
+        if not self.segmenter.in_speech or (self._partial_task and not self._partial_task.done()):
+            return
+        if not self._finals.empty():
+            return
+        if self.segmenter.utterance != self._partial_utterance:
+            # A new utterance started
+            self._partial_utterance = self.segmenter.utterance
+            self._last_partial_frames = 0
+        frames = len(self.segmenter.current_audio()) // FRAME_BYTES
+        if (frames - self._last_partial_frames) * FRAME_MS < self.options['PARTIAL_INTERVAL_MS']:
+            return
+        self._last_partial_frames = frames
+        self._partial_task = asyncio.create_task(
+            self._partial(self.segmenter.current_audio(), self.segmenter.utterance)
+        )
+
+    async def _partial(self, pcm, utterance):
+        try:
+            text = await self._transcribe(pcm)
+            # Drop partials overtaken by the end of their utterance, even if the next one has begun
+            if text and self.segmenter.in_speech and self.segmenter.utterance == utterance:
+                await self._send_json({'type': 'partial', 'utterance': utterance, 'text': text})
+        except (TranscriptionQueueFull, TranscriptionTimeout) as e:
+            logger.warning(f"Skipped partial transcript: {str(e)}")
+
+    async def _final_worker(self):
+        while True:
+            utterance = await self._finals.get()
+            if utterance is None:
+                return
+            pcm, start, end = utterance
+            # Utterances end, and are queued, in order
+            number = self._finals_sent
+            self._finals_sent += 1
+            started = time.monotonic()
+            try:
+                text = await self._transcribe(pcm)
+            except (TranscriptionQueueFull, TranscriptionTimeout) as e:
+                await self._send_json({
+                    'type': 'error', 'utterance': number, 'message': str(e), 'start': start, 'end': end,
+                })
+                continue
+            if text:
+                self._context.extend(text.split())
+            await self._send_json({
+                'type': 'final', 'utterance': number, 'text': text, 'start': round(start, 3), 'end': round(end, 3),
+                'transcription_time': round(time.monotonic() - started, 3),
+            })
+
+    async def finish(self):
+        """Flush the utterance in progress and wait for every final to be sent."""
+        utterance = self.segmenter.flush()
+        if utterance:
+            await self._finals.put(utterance)
+        await self._finals.put(None)
+        await self._final_task
+        await self._send_json({'type': 'done'})
+
+    def close(self):
+        self._final_task.cancel()
+        if self._partial_task:
+            self._partial_task.cancel()
+
+
+async def get_scope_user_id(scope):
+    """Resolve the logged-in user from the session cookie of an ASGI scope.
+
+    Goes through django.contrib.auth.get_user like an HTTP request does, so
+    a session whose auth hash no longer matches (the password changed) or
+    whose user was deactivated counts as anonymous.
+    """
+    headers = dict(scope.get('headers') or [])
+    cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+    store = import_module(settings.SESSION_ENGINE).SessionStore(morsel.value)
+    user = await sync_to_async(auth.get_user)(SimpleNamespace(session=store))
+    if not user.is_authenticated or not user.is_active:
+        return None
+    return user.pk
+
+
+def is_same_origin(scope):
+    """Whether a WebSocket handshake comes from this site, or one in CSRF_TRUSTED_ORIGINS.
+
+    Browsers send Origin with every handshake and attach the session cookie
+    whatever page opened the socket, so this is the WebSocket's CSRF check.
+    Clients that send no Origin aren't browsers and are let through.
+    """
+    headers = dict(scope.get('headers') or [])
+    origin = headers.get(b'origin', b'').decode('latin-1')
+    if not origin:
+        return True
+    if origin in getattr(settings, 'CSRF_TRUSTED_ORIGINS', []):
+        return True
+    return urlsplit(origin).netloc == headers.get(b'host', b'').decode('latin-1')
+
+
+async def speech_socket(scope, receive, send):
+    """ASGI WebSocket endpoint for real-time speech recognition.
+
+    Expects ``scope['user_id']`` to be set by the ASGI router (see
+    djangoproject/asgi.py); anonymous connections are closed with 4401.
+    Clients send binary frames of 16 kHz mono little-endian 16-bit PCM and
+    a ``{"type": "end"}`` text message when they stop. The server replies
+    with ``partial`` and ``final`` JSON messages, then ``done``.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope.get('user_id') is None:
+        await send({'type': 'websocket.close', 'code': 4401})
+        return
+    await send({'type': 'websocket.accept'})
+
+    session = StreamingSession(send)
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes'):
+                await session.feed(message['bytes'])
+            elif message.get('text'):
+                control = json.loads(message['text'])
+                if control.get('type') == 'end':
+                    await session.finish()
+                    await send({'type': 'websocket.close', 'code': 1000})
+                    break
+    except Exception:
+        logger.exception("Streaming speech recognition failed")
+        await send({'type': 'websocket.close', 'code': 1011})
+    finally:
+        session.close()
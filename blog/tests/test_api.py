@@ -0,0 +1,122 @@
+import asyncio
+import base64
+import io
+import json
+
+import numpy as np
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+
+from blog.audio import SAMPLE_RATE, encode_webm, read_request_audio
+from blog.llm import LLMBusy, LLMClient, LLMTimeout
+from blog.views import _stream_tokens
+from Development.fake_ollama import FakeOllamaServer
+
+
+class SpeechToTextUploadTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        t = np.arange(SAMPLE_RATE * 2) / SAMPLE_RATE
+        cls.webm = encode_webm((0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32))
+        cls.factory = RequestFactory()
+
+    def assertTwoSeconds(self, audio):
+        self.assertEqual(audio.dtype, np.float32)
+        self.assertAlmostEqual(len(audio) / SAMPLE_RATE, 2.0, delta=0.05)
+
+    def test_raw_webm_body(self):
+        request = self.factory.post('/blog/speech-to-text/', data=self.webm, content_type='audio/webm')
+        self.assertTwoSeconds(read_request_audio(request))
+
+    def test_multipart_upload(self):
+        upload = io.BytesIO(self.webm)
+        upload.name = 'recording.webm'
+        request = self.factory.post('/blog/speech-to-text/', data={'audio': upload})
+        self.assertTwoSeconds(read_request_audio(request))
+
+    def test_json_base64_body_still_supported(self):
+        payload = {'audio_base64': f"data:audio/webm;base64,{base64.b64encode(self.webm).decode()}"}
+        request = self.factory.post('/blog/speech-to-text/', data=json.dumps(payload), content_type='application/json')
+        self.assertTwoSeconds(read_request_audio(request))
+
+    def test_missing_audio(self):
+        request = self.factory.generic('POST', '/blog/speech-to-text/', CONTENT_TYPE='audio/webm')
+        self.assertIsNone(read_request_audio(request))
+        request = self.factory.post('/blog/speech-to-text/', data=json.dumps({}), content_type='application/json')
+        self.assertIsNone(read_request_audio(request))
+
+
+class LLMClientTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeOllamaServer(first_token_delay=0, token_delay=0)
+        self.server.start()
+        self.host = self.server.url
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _client(self, **kwargs):
+        return LLMClient(host=self.host, model='fake', **kwargs)
+
+    def _ask(self, text):
+        return [{'role': 'user', 'content': text}]
+
+    def test_tokens_stream_in_order_over_one_pooled_connection(self):
+        client = self._client()
+        self.assertEqual(list(client.stream_chat(self._ask('a red bicycle'))), ['You ', 'said: ', 'a ', 'red ', 'bicycle '])
+        self.assertEqual(client.chat(self._ask('twice')), 'You said: twice ')
+        self.assertEqual(self.server.connections, 1)
+
+    def test_concurrency_limit_rejects_when_no_slot_frees_up(self):
+        client = self._client(max_concurrency=1)
+        first = client.stream_chat(self._ask('first'))
+        with self.assertRaises(LLMBusy):
+            client.stream_chat(self._ask('second'), timeout=0.2)
+        first.close()
+        self.assertEqual(client.chat(self._ask('second')), 'You said: second ')
+
+    def test_deadline_covers_the_whole_stream(self):
+        self.server.token_delay = 0.2
+        client = self._client()
+        with self.assertRaises(LLMTimeout):
+            list(client.stream_chat(self._ask('one two three four five'), timeout=0.5))
+        # The slot was given back
+        self.assertEqual(client.chat(self._ask('ok'), timeout=5), 'You said: ok ')
+
+    def test_unsent_response_gives_the_slot_back(self):
+        client = self._client(max_concurrency=1)
+        StreamingHttpResponse(_stream_tokens(client.stream_chat(self._ask('never read')))).close()
+        self.assertEqual(client.chat(self._ask('next'), timeout=1), 'You said: next ')
+
+        async def unsent_async_response():
+            tokens = await client.astream_chat(self._ask('never read'))
+            # Django's ASGI handler closes responses from a worker thread
+            await asyncio.to_thread(StreamingHttpResponse(_stream_tokens(tokens)).close)
+            return await client.achat(self._ask('next'), timeout=1)
+
+        self.assertEqual(asyncio.run(unsent_async_response()), 'You said: next ')
+
+    def test_cancelled_wait_for_a_slot_gives_it_back(self):
+        client = self._client(max_concurrency=1)
+
+        async def cancel_while_waiting():
+            first = client.stream_chat(self._ask('first'))
+            waiting = asyncio.create_task(client.astream_chat(self._ask('second'), timeout=5))
+            await asyncio.sleep(0.1)
+            waiting.cancel()
+            # The waiting thread gets the slot after the task is gone
+            first.close()
+            await asyncio.sleep(0.1)
+            return await client.achat(self._ask('third'), timeout=1)
+
+        self.assertEqual(asyncio.run(cancel_while_waiting()), 'You said: third ')
+
+    def test_asyncio_interface(self):
+        client = self._client(max_concurrency=2)
+
+        async def ask_both():
+            return await asyncio.gather(client.achat(self._ask('one')), client.achat(self._ask('two')))
+
+        self.assertEqual(asyncio.run(ask_both()), ['You said: one ', 'You said: two '])
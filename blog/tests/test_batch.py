@@ -0,0 +1,284 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+import torch
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from blog import backfill, batch_caption, embedding_index
+from blog.model_handler import ModelHandler, _VisionPooler
+from blog.models import ImageAnalysis
+from blog.tests.utils import TEST_CACHES
+
+
+class FakeQueue:
+    def __init__(self):
+        self.count = 0
+        self.jobs = []
+
+    def enqueue(self, func, *args):
+        self.jobs.append((func, args))
+
+
+class RecaptionBackfillTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.config_hash = ModelHandler.result_provenance('new-model')['config_hash']
+        # Image sizes out of pk order; the last row is already current
+        self.stale = [
+            ImageAnalysis.objects.create(image=SimpleUploadedFile(f'{size}.jpg', b'x' * size)).pk
+            for size in (500, 100, 300, 200, 400)
+        ]
+        ImageAnalysis.objects.create(image=SimpleUploadedFile('new.jpg', b'y'), config_hash=self.config_hash)
+        self.state_file = os.path.join(self.media_root, 'state.json')
+        self.slept = []
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _backfill(self, queue):
+        return backfill.RecaptionBackfill(
+            self.config_hash, self.state_file, queue, window=3, batch_size=2, rate=10,
+            clock=lambda: sum(self.slept), sleep=self.slept.append,
+        )
+
+    def test_provenance_changes_with_prompts(self):
+        before = ModelHandler.result_provenance('new-model')
+        prompts = dict(ModelHandler.PROMPTS, query={'prompt': None, 'max_new_tokens': 200})
+        with mock.patch.object(ModelHandler, 'PROMPTS', prompts):
+            after = ModelHandler.result_provenance('new-model')
+        self.assertEqual(before['prompt_hash'], after['prompt_hash'])
+        self.assertNotEqual(before['config_hash'], after['config_hash'])
+
+    def test_stopped_backfill_resumes_in_size_sorted_batches(self):
+        first = FakeQueue()
+        self.assertEqual(self._backfill(first).run(limit=2), 2)
+        second = FakeQueue()
+        resumed = self._backfill(second)
+        self.assertEqual(resumed.run(), 3)
+        self.assertTrue(resumed.state['finished'])
+
+        batches = [args[0] for _, args in first.jobs + second.jobs]
+        first_window, second_window = self.stale[:3], self.stale[3:]
+        self.assertEqual(batches, [
+            [first_window[1], first_window[2]], [first_window[0]], [second_window[0], second_window[1]],
+        ])
+        self.assertTrue(all(args[1] == self.config_hash for _, args in second.jobs))
+        # 10 analyses per second: the resumed run waits 0.1s after its 1-analysis batch
+        self.assertAlmostEqual(sum(self.slept), 0.1)
+
+
+def _jpeg(size, color):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+class FakeBatchHandler:
+    """Stands in for ModelHandler in batch captioning: captions name the image size."""
+
+    max_image_edge = 64
+
+    def __init__(self):
+        self.batches = []
+
+    def provenance(self):
+        return ModelHandler.result_provenance('fake-model', 'cpu-float32-eager')
+
+    @contextmanager
+    def capture_embeddings(self):
+        self._embeddings = []
+        yield self._embeddings
+
+    def caption_batch(self, images, prompt_type='short_caption', question=None):
+        self.batches.append(len(images))
+        self._embeddings.extend(np.full(4, image.width, dtype=np.float32) for image in images)
+        return [f"{image.width}x{image.height}" for image in images]
+
+
+class BatchCaptionTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.source = os.path.join(self.root, 'images')
+        os.makedirs(os.path.join(self.source, 'sub'))
+        self.files = {
+            'a.jpg': _jpeg((640, 480), 'red'), 'b.png': b'not an image', 'notes.txt': b'skip me',
+            'sub/c.jpg': _jpeg((32, 32), 'blue'), 'sub/d.jpg': _jpeg((48, 16), 'green'),
+        }
+        for name, data in self.files.items():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(data)
+        self.state_file = os.path.join(self.root, 'state.json')
+        self.embeddings_override = override_settings(EMBEDDING_INDEX={'DIR': os.path.join(self.root, 'embeddings')})
+        self.embeddings_override.enable()
+
+    def tearDown(self):
+        self.embeddings_override.disable()
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_sources_list_images_in_a_stable_order_after_the_cursor(self):
+        archive = os.path.join(self.root, 'images.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, data in self.files.items():
+                zf.writestr(name, data)
+        tar = os.path.join(self.root, 'images.tar.gz')
+        with tarfile.open(tar, 'w:gz') as tf:
+            for name in self.files:
+                tf.add(os.path.join(self.source, name), arcname=name)
+        for path in (self.source, archive, tar):
+            keys = [key for key, _ in batch_caption.iter_source(path)]
+            self.assertEqual(sorted(keys), ['a.jpg', 'b.png', 'sub/c.jpg', 'sub/d.jpg'])
+            self.assertEqual([key for key, _ in batch_caption.iter_source(path, keys[1])], keys[2:])
+        self.assertEqual(batch_caption.count_source(self.source, 'a.jpg'), 3)
+        self.assertEqual(batch_caption.count_source(archive, 'a.jpg'), 3)
+        self.assertIsNone(batch_caption.count_source(tar))
+
+    def test_run_reads_a_zip_archive(self):
+        archive = os.path.join(self.root, 'images.zip')
+        with zipfile.ZipFile(archive, 'w') as zf:
+            for name, data in self.files.items():
+                zf.writestr(name, data)
+        handler = FakeBatchHandler()
+        with self.assertLogs('blog.batch_caption', 'WARNING'):
+            stats = batch_caption.BatchCaptioner(archive, handler, batch_size=2, decode_workers=2).run()
+        # Every member was read, including those still decoding when the archive closed
+        self.assertEqual((stats['captioned'], stats['failed']), (3, 1))
+        self.assertEqual(
+            sorted(ImageAnalysis.objects.values_list('short_caption', flat=True)), ['160x120', '32x32', '48x16'],
+        )
+
+    def test_run_resumes_from_the_checkpoint_without_duplicates(self):
+        handler = FakeBatchHandler()
+        captioner = batch_caption.BatchCaptioner(
+            self.source, handler, batch_size=2, chunk_size=1, decode_workers=2, state_file=self.state_file,
+        )
+        with self.assertLogs('blog.batch_caption', 'WARNING'):
+            stats = captioner.run()
+        self.assertEqual((stats['captioned'], stats['failed']), (3, 1))
+        self.assertEqual(handler.batches, [1, 2])  # b.png failed to decode
+        # Large JPEGs are decoded at reduced scale, never below the processor's size
+        self.assertEqual(
+            sorted(ImageAnalysis.objects.values_list('short_caption', flat=True)), ['160x120', '32x32', '48x16'],
+        )
+        self.assertEqual(batch_caption.load_state(self.state_file)[captioner.path], {'cursor': 'sub/d.jpg', 'done': 4})
+        # Every captioned image's embedding is stored under its analysis
+        store = embedding_index.EmbeddingStore(embedding_index.store_path('fake-model'))
+        self.assertEqual(sorted(store.arrays()[1]), sorted(ImageAnalysis.objects.values_list('pk', flat=True)))
+
+        # Lose the checkpoint of the last chunk: its images are recognised and skipped
+        batch_caption.save_state(self.state_file, {captioner.path: {'cursor': 'sub/c.jpg', 'done': 3}})
+        again = batch_caption.BatchCaptioner(self.source, FakeBatchHandler(), state_file=self.state_file).run()
+        self.assertEqual((again['captioned'], again['skipped']), (0, 1))
+        self.assertEqual(ImageAnalysis.objects.count(), 3)
+        self.assertEqual(ImageAnalysis.objects.filter(config_hash=handler.provenance()['config_hash']).count(), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class EmbeddingIndexTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.settings_override = override_settings(EMBEDDING_INDEX={'DIR': self.root, 'PQ_M': 4, 'RERANK': 5})
+        self.settings_override.enable()
+        rng = np.random.default_rng(0)
+        centres = rng.standard_normal((20, 16), dtype=np.float32)
+        self.vectors = centres[rng.integers(20, size=1000)] + 0.1 * rng.standard_normal((1000, 16), dtype=np.float32)
+        self.store = embedding_index.EmbeddingStore(os.path.join(self.root, 'model'))
+        self.store.append(np.arange(1000), self.vectors)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def _brute_force(self, query, k):
+        vectors = np.asarray(self.store.arrays()[0][:1000], dtype=np.float32)
+        return np.argsort(-(vectors @ embedding_index._normalize(query)[0]))[:k].tolist()
+
+    def test_exact_search_ranks_by_cosine_similarity(self):
+        query = self.vectors[7] * 3
+        found = self.store.search(query, 5)
+        self.assertEqual([analysis_id for analysis_id, _ in found], self._brute_force(query, 5))
+        self.assertAlmostEqual(found[0][1], 1.0, places=2)
+        among = self.store.search(query, 3, among=[1, 2, 3])
+        self.assertEqual(sorted(analysis_id for analysis_id, _ in among), [1, 2, 3])
+
+    def test_append_discards_an_unfinished_write(self):
+        # A worker died between writing rows and committing the count
+        with open(os.path.join(self.store.path, embedding_index.VECTORS_FILE), 'ab') as f:
+            f.write(b'\x00' * 100)
+        self.store.append([1000], self.vectors[:1])
+        vectors, ids = self.store.arrays()
+        self.assertEqual((len(vectors), ids[-1]), (1001, 1000))
+        np.testing.assert_allclose(vectors[-1], vectors[0], atol=1e-3)
+        with self.assertRaises(ValueError):
+            self.store.append([1001], np.ones((1, 8)))
+
+    def test_index_search_matches_exact_and_covers_later_rows(self):
+        index = self.store.build_index(nlist=8)
+        self.assertEqual((index.indexed, index.codes.shape), (1000, (1000, 4)))
+        self.store.append([5000], self.vectors[3:4] * 2)  # appended after the build
+        with override_settings(EMBEDDING_INDEX={'DIR': self.root, 'PQ_M': 4, 'IVF_THRESHOLD': 0}):
+            for row in (400, 999):
+                found = [analysis_id for analysis_id, _ in self.store.search(self.vectors[row], 5, nprobe=8)]
+                self.assertEqual(found[0], row)
+                self.assertGreaterEqual(len(set(found) & set(self._brute_force(self.vectors[row], 5))), 4)
+            # Rows appended since the build are scanned exactly
+            self.assertIn(5000, [analysis_id for analysis_id, _ in self.store.search(self.vectors[3], 2)])
+
+    def test_pooling_averages_each_images_real_tiles(self):
+        tower = torch.nn.Linear(2, 2, bias=False)
+        tower.weight.data = torch.eye(2)
+        pooler = _VisionPooler(tower)
+        # Two images of up to two tiles; the second has one padding tile
+        pixel_values = torch.tensor([[[1.0, 0.0], [0.0, 1.0]], [[1.0, 1.0], [0.0, 0.0]]]).unsqueeze(-1)
+        vectors = pooler.start()
+        with pooler.pooling(pixel_values):
+            # What the tower sees: the real tiles only, each a sequence of one patch
+            tower(torch.tensor([[[1.0, 0.0]], [[0.0, 1.0]], [[1.0, 1.0]]]))
+        pooler.stop()
+        np.testing.assert_allclose(vectors, [[2 ** -0.5, 2 ** -0.5], [2 ** -0.5, 2 ** -0.5]], rtol=1e-6)
+        with pooler.pooling(pixel_values):
+            tower(torch.ones((3, 1, 2)))  # not capturing: nothing recorded
+        self.assertEqual(len(vectors), 2)
+
+    def test_similar_endpoint_returns_the_users_nearest_analyses(self):
+        owner = User.objects.create_user('owner', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        analyses = [
+            ImageAnalysis.objects.create(image=f'uploads/{i}.jpg', user=owner if i < 4 else other,
+                                         short_caption=f'caption {i}', model_version='captioner')
+            for i in range(6)
+        ]
+        store = embedding_index.get_store('captioner')
+        store.append([analysis.pk for analysis in analyses],
+                     [[1, 0], [1, 0.1], [0, 1], [1, 0.2], [1, 0.05], [1, 0.01]])
+        analyses[3].delete()
+        self.client.login(username='owner', password='pw')
+
+        response = self.client.get(reverse('blog:analysis_similar', args=[analyses[0].pk]), {'k': 5})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        # The other user's closer images and the deleted one are left out
+        self.assertEqual([result['analysis_id'] for result in data['results']], [analyses[1].pk, analyses[2].pk])
+        self.assertTrue(data['indexed'])
+        unindexed = ImageAnalysis.objects.create(image='uploads/x.jpg', user=owner, model_version='captioner')
+        self.assertFalse(self.client.get(reverse('blog:analysis_similar', args=[unindexed.pk])).json()['indexed'])
+        self.assertEqual(self.client.get(reverse('blog:analysis_similar', args=[analyses[4].pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('blog:analysis_similar', args=[analyses[0].pk]), {'k': 0}).status_code, 400)
@@ -0,0 +1,213 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+import torch
+from django.test import SimpleTestCase, override_settings
+from transformers import DynamicCache, Idefics3Config, Idefics3ForConditionalGeneration
+
+from blog import model_artifacts
+from blog.chat_sessions import ChatSessionStore
+from blog.model_handler import ConversationTurn, ModelHandler
+
+
+class FakeConversationHandler:
+    """Stands in for ModelHandler: every turn adds 10 tokens to a 1-layer cache."""
+    model_version = 'fake'
+
+    def __init__(self):
+        self.calls = []
+
+    def _turn(self, token_ids, cache, turns, question):
+        new_ids = torch.ones((1, 10), dtype=torch.long)
+        cache.update(torch.zeros((1, 1, 10, 8)), torch.zeros((1, 1, 10, 8)), 0)
+        token_ids = new_ids if token_ids is None else torch.cat([token_ids, new_ids], dim=1)
+        return ConversationTurn(f"answer {len(turns) + 1}", token_ids, cache, 10)
+
+    def start_conversation(self, image, turns, question, max_new_tokens=100):
+        self.calls.append(('start', len(turns)))
+        cache = DynamicCache()
+        for _ in turns:
+            self._turn(None, cache, [], question)
+        return self._turn(None, cache, turns, question)
+
+    def continue_conversation(self, token_ids, cache, turns, question, max_new_tokens=100):
+        self.calls.append(('continue', len(turns)))
+        return self._turn(token_ids, cache, turns, question)
+
+
+class ChatSessionStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.handler = FakeConversationHandler()
+        # 10 tokens x 8 dims x 4 bytes x (keys + values) = 640 bytes per turn
+        self.store = ChatSessionStore(memory_budget=2000, model_handler=self.handler)
+
+    def _chat(self, key, questions):
+        turns = []
+        for question in questions:
+            answer, info = self.store.ask(key, None, turns, question)
+            turns.append((question, answer))
+        return turns, info
+
+    def test_follow_ups_reuse_the_cached_conversation(self):
+        _, info = self._chat('a', ['q1', 'q2', 'q3'])
+        self.assertEqual(self.handler.calls, [('start', 0), ('continue', 1), ('continue', 2)])
+        self.assertTrue(info['reused'])
+        self.assertEqual(self.store.stats()['memory_used'], 3 * 640)
+
+    def test_least_recently_used_session_is_evicted_and_rebuilt(self):
+        turns_a, _ = self._chat('a', ['q1'])
+        self._chat('b', ['q1', 'q2'])
+        # a (640) + b (1280) fit; growing b to three turns pushes a out
+        self.store.ask('b', None, [('q1', 'answer 1'), ('q2', 'answer 2')], 'q3')
+        self.assertEqual(self.store.stats()['evictions'], 1)
+        self.handler.calls.clear()
+        answer, info = self.store.ask('a', None, turns_a, 'q2')
+        self.assertEqual((answer, info['reused']), ('answer 2', False))
+        self.assertEqual(self.handler.calls, [('start', 1)])
+
+    def test_stale_session_is_rebuilt_from_stored_turns(self):
+        turns, _ = self._chat('a', ['q1', 'q2'])
+        self.handler.calls.clear()
+        # Another process answered a turn this one never saw
+        turns.append(('q3', 'answer 3'))
+        self.store.ask('a', None, turns, 'q4')
+        self.assertEqual(self.handler.calls, [('start', 3)])
+
+
+TINY_IMAGE_TOKEN = 63
+
+
+def tiny_vlm(text_layers=2, seed=0):
+    """A randomly initialised Idefics3 (SmolVLM's architecture) small enough to run in a test."""
+    config = Idefics3Config(
+        vision_config=dict(hidden_size=16, intermediate_size=32, num_hidden_layers=1, num_attention_heads=2,
+                           image_size=32, patch_size=16),
+        text_config=dict(model_type='llama', vocab_size=64, hidden_size=32, intermediate_size=64,
+                         num_hidden_layers=text_layers, num_attention_heads=2, num_key_value_heads=2, pad_token_id=0),
+        image_token_id=TINY_IMAGE_TOKEN, scale_factor=2,
+    )
+    torch.manual_seed(seed)
+    model = Idefics3ForConditionalGeneration(config).eval()
+    model.generation_config.eos_token_id = 2
+    return model
+
+
+def tiny_inputs():
+    """Processor output for one 32x32 image (a single image token) in a short prompt."""
+    return {
+        'input_ids': torch.tensor([[1, 5, TINY_IMAGE_TOKEN, 7, 9]]),
+        'attention_mask': torch.ones((1, 5), dtype=torch.long),
+        'pixel_values': torch.rand((1, 1, 3, 32, 32), generator=torch.Generator().manual_seed(0)),
+        'pixel_attention_mask': torch.ones((1, 1, 32, 32), dtype=torch.bool),
+    }
+
+
+class TinyModelHandler(ModelHandler):
+    """ModelHandler over tiny_vlm models; the tests build the processor inputs themselves."""
+
+    def __init__(self, models, **kwargs):
+        self._processor = object()
+        self._models = models
+        super().__init__(**kwargs)
+
+    def _load_model(self, model_id, device):
+        return self._models[model_id]
+
+
+@override_settings(VLM_SPECULATIVE={'DRAFT_MODEL': 'draft', 'TARGET_MODEL': 'target', 'PROMPTS': {'query': True}})
+class SpeculativeDecodeTests(SimpleTestCase):
+    def decode(self, draft):
+        handler = TinyModelHandler({'target': tiny_vlm(), 'draft': draft}, speculative=True, compiled=False)
+        greedy = handler._generate(tiny_inputs(), 'query', 20, speculative=False)
+        self.assertEqual(handler.speculative_stats(), {})
+        speculative = handler._generate(tiny_inputs(), 'query', 20)
+        self.assertTrue(torch.equal(speculative, greedy))
+        stats = handler.speculative_stats()['query']
+        self.assertEqual(stats['generations'], 1)
+        self.assertEqual(stats['tokens'], greedy.shape[1] - tiny_inputs()['input_ids'].shape[1])
+        # Every round keeps the draft tokens the target accepted plus one of its own
+        self.assertEqual(stats['tokens'], stats['accepted'] + stats['rounds'])
+        self.assertLessEqual(stats['accepted'], stats['proposed'])
+        return stats
+
+    def test_matching_draft_is_always_accepted(self):
+        stats = self.decode(tiny_vlm())
+        self.assertGreater(stats['accepted'], 0)
+        self.assertEqual(stats['accepted'], stats['proposed'])
+        self.assertLess(stats['rounds'], stats['tokens'])
+
+    def test_different_draft_gives_the_target_answer(self):
+        stats = self.decode(tiny_vlm(1, seed=1))
+        self.assertGreater(stats['proposed'], 0)
+        self.assertEqual(stats['acceptance_rate'], stats['accepted'] / stats['proposed'])
+
+
+@override_settings(VLM_COMPILE={'BUCKETS': [32]})
+class CompiledDecodeTests(SimpleTestCase):
+    def test_static_cache_decode_matches_generate(self):
+        model = tiny_vlm()
+        with self.assertLogs('blog.model_handler', 'INFO') as logs:
+            handler = TinyModelHandler({'target': model}, compiled=True, speculative=False, model_id='target')
+        self.assertNotIn('Speculative decoding enabled', '\n'.join(logs.output))
+        self.assertEqual(list(handler._static_caches), [32])
+        self.assertTrue(handler.tier.endswith('-compiled'))
+        inputs = tiny_inputs()
+        with torch.no_grad():
+            # 5 + 20 tokens fit the 32 bucket; 5 + 40 don't and are decoded eagerly
+            for max_new_tokens in (20, 40):
+                self.assertTrue(torch.equal(
+                    handler._generate(inputs, 'query', max_new_tokens),
+                    model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False),
+                ))
+
+    def test_falls_back_to_eager_decoding_when_compile_is_unavailable(self):
+        model = tiny_vlm()
+        with mock.patch('blog.model_handler.torch.compile', side_effect=RuntimeError('no C compiler')), \
+                self.assertLogs('blog.model_handler', 'WARNING') as logs:
+            handler = TinyModelHandler({'target': model}, compiled=True, speculative=False, model_id='target')
+        self.assertIn('no C compiler', logs.output[0])
+        self.assertEqual(handler._static_caches, {})
+        self.assertTrue(handler.tier.endswith('-eager'))
+        inputs = tiny_inputs()
+        with torch.no_grad():
+            self.assertTrue(torch.equal(handler._generate(inputs, 'query', 20),
+                                        model.generate(**inputs, max_new_tokens=20, do_sample=False)))
+
+
+class ModelArtifactTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def _write_artifact(self, kind, model_id, dtype=None):
+        with override_settings(MODEL_ARTIFACTS={'DIR': self.root}):
+            path = model_artifacts.artifact_path(kind, model_id, dtype)
+        os.makedirs(path)
+        with open(os.path.join(path, 'model.safetensors'), 'wb') as f:
+            f.write(b'weights')
+        with open(os.path.join(path, model_artifacts.MANIFEST), 'w') as f:
+            json.dump({'files': model_artifacts._file_entries(path)}, f)
+        return path
+
+    def test_verify_detects_changed_files(self):
+        path = self._write_artifact('model', 'org/model', 'bfloat16')
+        model_artifacts.verify(path)
+        with open(os.path.join(path, 'model.safetensors'), 'ab') as f:
+            f.write(b'!')
+        with self.assertRaisesMessage(model_artifacts.ArtifactError, 'model.safetensors'):
+            model_artifacts.verify(path)
+
+    def test_workers_prefer_artifacts_and_offline_mode_never_falls_back(self):
+        path = self._write_artifact('model', 'org/model', 'bfloat16')
+        with override_settings(MODEL_ARTIFACTS={'DIR': self.root}):
+            self.assertEqual(
+                model_artifacts.load_kwargs('model', 'org/model', 'bfloat16'), (path, {'local_files_only': True})
+            )
+            # Another dtype is another artifact
+            self.assertEqual(model_artifacts.load_kwargs('model', 'org/model', 'float32'), ('org/model', {}))
+        with override_settings(MODEL_ARTIFACTS={'DIR': self.root, 'OFFLINE': True}):
+            with self.assertRaises(model_artifacts.ArtifactError):
+                model_artifacts.resolve('model', 'org/model', 'float32')
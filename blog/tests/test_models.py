@@ -0,0 +1,269 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest import mock
+
+import numpy as np
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image
+
+from blog import persistence, resumable, retention
+from blog.models import ImageAnalysis
+from blog.storage import ContentAddressedStorage
+
+
+class ContentAddressedUploadTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _create_analysis(self, name, content):
+        return ImageAnalysis.objects.create(image=SimpleUploadedFile(name, content, content_type='image/jpeg'))
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self._create_analysis('bike.jpg', b'same-bytes')
+        second = self._create_analysis('bike_copy.jpg', b'same-bytes')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertTrue(first.image.name.startswith(f'uploads/{first.content_hash[:2]}/{first.content_hash[2:4]}/'))
+        self.assertEqual(ImageAnalysis.objects.with_content(SimpleUploadedFile('x.jpg', b'same-bytes')).count(), 2)
+
+    def test_blob_is_removed_only_after_last_reference(self):
+        first = self._create_analysis('bike.jpg', b'same-bytes')
+        second = self._create_analysis('bike_copy.jpg', b'same-bytes')
+        path = first.image.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+
+
+class ContentAddressedRaceTests(TransactionTestCase):
+    """An identical upload racing the delete of the last row using its blob."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_identical_upload_during_delete_keeps_the_blob(self):
+        first = ImageAnalysis.objects.create(image=SimpleUploadedFile('bike.jpg', b'same-bytes'))
+        path = first.image.path
+        found_blob, deleting = threading.Event(), threading.Event()
+        exists = ContentAddressedStorage.exists
+
+        def exists_then_wait(storage, name):
+            result = exists(storage, name)
+            if threading.current_thread().name == 'uploader':
+                # The upload has found the blob; let the delete run before its row commits
+                found_blob.set()
+                deleting.wait(5)
+                time.sleep(0.5)
+            return result
+
+        def upload():
+            try:
+                ImageAnalysis.objects.create(image=SimpleUploadedFile('bike_copy.jpg', b'same-bytes'))
+            finally:
+                connection.close()
+
+        with mock.patch.object(ContentAddressedStorage, 'exists', exists_then_wait):
+            uploader = threading.Thread(target=upload, name='uploader')
+            uploader.start()
+            self.assertTrue(found_blob.wait(5))
+            deleting.set()
+            first.delete()  # blocks on the upload's lock until its row commits
+            uploader.join(10)
+
+        second = ImageAnalysis.objects.get()
+        self.assertEqual(second.image.path, path)
+        self.assertTrue(os.path.exists(path))
+
+
+class CoalescingWriterTests(TransactionTestCase):
+    """Analyses are committed by a writer thread, so the rows must really commit."""
+
+    def test_concurrent_submits_share_one_transaction(self):
+        writer = persistence.CoalescingWriter(max_batch=3, max_delay=5)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            analyses = list(executor.map(writer.submit, [{'image': f'uploads/{i}.jpg'} for i in range(3)]))
+        self.assertEqual(sorted(analysis.image.name for analysis in analyses),
+                         ['uploads/0.jpg', 'uploads/1.jpg', 'uploads/2.jpg'])
+        self.assertEqual(ImageAnalysis.objects.count(), 3)
+        self.assertEqual((writer.transactions, writer.rows), (1, 3))
+
+    def test_a_lone_row_is_committed_after_max_delay(self):
+        writer = persistence.CoalescingWriter(max_batch=50, max_delay=0.05)
+        started = time.monotonic()
+        analysis = writer.submit({'image': 'uploads/alone.jpg'})
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(ImageAnalysis.objects.filter(pk=analysis.pk).exists())
+
+    def test_commit_errors_reach_every_caller_in_the_batch(self):
+        writer = persistence.CoalescingWriter(max_batch=2, max_delay=5)
+        with mock.patch('blog.persistence.bulk_save_analyses', side_effect=ValueError('disk full')):
+            futures = [writer.submit_async({'image': f'uploads/{i}.jpg'}) for i in range(2)]
+            for future in futures:
+                with self.assertRaisesMessage(ValueError, 'disk full'):
+                    future.result(5)
+        self.assertFalse(ImageAnalysis.objects.exists())
+
+    def test_worker_processes_submit_through_the_writer_service(self):
+        context = multiprocessing.get_context('spawn')
+        service = persistence.WriterService(context, persistence.CoalescingWriter(max_delay=0.05))
+        remote = persistence.RemoteWriter(*service.connect(), timeout=10)
+        try:
+            analysis = remote.submit({'image': 'uploads/remote.jpg'})
+            self.assertEqual(ImageAnalysis.objects.get(pk=analysis.pk).image.name, 'uploads/remote.jpg')
+            with mock.patch('blog.persistence.bulk_save_analyses', side_effect=ValueError('disk full')):
+                with self.assertRaisesMessage(ValueError, 'disk full'):
+                    remote.submit({'image': 'uploads/lost.jpg'})
+        finally:
+            service.stop()
+
+    def test_remote_submit_times_out_without_a_writer(self):
+        requests = queue.Queue()
+        receiver, _ = multiprocessing.get_context('spawn').Pipe(duplex=False)
+        with self.assertRaises(TimeoutError):
+            persistence.RemoteWriter(requests, receiver, 0, timeout=0.1).submit({'image': 'uploads/x.jpg'})
+        self.assertEqual(requests.get_nowait()[1:], (1, {'image': 'uploads/x.jpg'}))
+
+
+class RetentionScanTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        for rel_path in ['recorded_audio/a.wav', 'recorded_audio/a/b.wav', 'recorded_audio/a.b/c.wav', 'recorded_audio/z.wav']:
+            path = os.path.join(self.media_root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'\0' * 10)
+            os.utime(path, (0, 0))
+
+    def tearDown(self):
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_batches_resume_where_the_previous_run_stopped(self):
+        policy = {'path': 'recorded_audio', 'action': 'delete', 'max_age_hours': 1}
+        state = {}
+        with override_settings(MEDIA_ROOT=self.media_root):
+            first = retention.run_policy('debug_audio', policy, state, batch_size=3)
+            second = retention.run_policy('debug_audio', policy, state, batch_size=3)
+        self.assertEqual((first['acted'], first['reclaimed_bytes'], first['finished_pass']), (3, 30, False))
+        self.assertEqual((second['acted'], second['finished_pass']), (1, True))
+        self.assertEqual(state['debug_audio'], {'cursor': '', 'passes': 1})
+        self.assertEqual(list(resumable.iter_files(os.path.join(self.media_root, 'recorded_audio'))), [])
+
+    def test_archive_is_lossless_and_keeps_same_stem_originals_apart(self):
+        ramp = np.arange(64, dtype=np.uint8) * 4
+        pixels = np.stack(np.broadcast_arrays(ramp[:, None], ramp[None, :], 128), axis=-1).astype(np.uint8)
+        for name, format, image in [('bike.png', 'PNG', Image.fromarray(pixels)),
+                                    ('bike.bmp', 'BMP', Image.fromarray(pixels[::-1]))]:
+            path = os.path.join(self.media_root, 'uploads', name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            image.save(path, format=format)
+            os.utime(path, (0, 0))
+            ImageAnalysis.objects.create(image=f"uploads/{name}")
+        policy = {'path': 'uploads', 'action': 'archive', 'max_age_hours': 1, 'cold_path': 'cold'}
+        with override_settings(MEDIA_ROOT=self.media_root):
+            dry = retention.run_policy('upload_originals', policy, {}, batch_size=10, dry_run=True)
+            self.assertEqual((dry['acted'], dry['reclaimed_bytes']), (2, 0))
+            self.assertFalse(os.path.exists(os.path.join(self.media_root, 'cold')))
+
+            stats = retention.run_policy('upload_originals', policy, {}, batch_size=10)
+        self.assertEqual(stats['acted'], 2)
+        self.assertGreater(stats['reclaimed_bytes'], 0)
+        self.assertEqual(sorted(ImageAnalysis.objects.values_list('image', flat=True)),
+                         ['cold/uploads/bike.bmp.webp', 'cold/uploads/bike.png.webp'])
+        with Image.open(os.path.join(self.media_root, 'cold/uploads/bike.png.webp')) as archived:
+            np.testing.assert_array_equal(np.asarray(archived), pixels)
+        with Image.open(os.path.join(self.media_root, 'cold/uploads/bike.bmp.webp')) as archived:
+            np.testing.assert_array_equal(np.asarray(archived), pixels[::-1])
+
+
+    def old_blob(self, data, ext='.png'):
+        """Write ``data`` as an old content-addressed upload and return its name."""
+        digest = hashlib.sha256(data).hexdigest()
+        name = f"uploads/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (0, 0))
+        return name, digest
+
+    @contextmanager
+    def after_snapshot(self, change):
+        """Run ``change`` right after a policy takes its batch reference snapshot.
+
+        Only that snapshot is stale; the per-file checks see the database as it is.
+        """
+        snapshot = retention._referenced_names
+        calls = []
+
+        def referenced(names):
+            calls.append(names)
+            result = snapshot(names)
+            if len(calls) == 1:
+                change()
+            return result
+
+        with mock.patch.object(retention, '_referenced_names', side_effect=referenced), \
+                mock.patch.object(retention, 'lock_content', wraps=retention.lock_content) as lock:
+            yield lock
+
+    def test_orphan_reused_after_the_snapshot_is_kept(self):
+        name, digest = self.old_blob(b'identical upload')
+        policy = {'path': 'uploads', 'action': 'collect_orphans', 'min_age_hours': 1}
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                self.after_snapshot(lambda: ImageAnalysis.objects.create(image=name)) as lock:
+            stats = retention.run_policy('orphans', policy, {}, batch_size=10)
+        self.assertEqual(stats['acted'], 0)
+        lock.assert_called_once_with(digest)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_archive_rechecks_references_under_the_lock(self):
+        pixels = np.tile(np.arange(64, dtype=np.uint8) * 4, (64, 1))
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='PNG', compress_level=0)
+        name, digest = self.old_blob(buffer.getvalue())
+        first = ImageAnalysis.objects.create(image=name)
+        policy = {'path': 'uploads', 'action': 'archive', 'max_age_hours': 1, 'cold_path': 'cold'}
+        cold_name = f"cold/{name}.webp"
+
+        # Every row gone by the time it is encoded: nothing is repointed or removed
+        with override_settings(MEDIA_ROOT=self.media_root), self.after_snapshot(first.delete) as lock:
+            stats = retention.run_policy('upload_originals', policy, {}, batch_size=10)
+        self.assertEqual(stats['acted'], 0)
+        lock.assert_called_once_with(digest)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, cold_name)))
+
+        # An identical upload reused it meanwhile: its row moves to the cold tier too
+        ImageAnalysis.objects.create(image=name)
+        with override_settings(MEDIA_ROOT=self.media_root), \
+                self.after_snapshot(lambda: ImageAnalysis.objects.create(image=name)):
+            stats = retention.run_policy('upload_originals', policy, {}, batch_size=10)
+        self.assertEqual(stats['acted'], 1)
+        self.assertEqual(list(ImageAnalysis.objects.values_list('image', flat=True)), [cold_name, cold_name])
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
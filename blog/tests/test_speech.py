@@ -0,0 +1,464 @@
+import asyncio
+import io
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from blog import long_audio, streaming, transcript_cache, transcription, views
+from blog.audio import SAMPLE_RATE, decode_audio, encode_webm, save_debug_wav
+from blog.long_audio import split_on_silence, stitch_chunks
+from blog.management.commands.bench_stt_profiles import normalize_words, word_edits
+from blog.tests.utils import TEST_CACHES
+
+
+def _wav(channels, rate, seconds=0.5, frequency=440):
+    """A tiny in-memory WAV fixture: a sine tone, the right channel inverted when stereo."""
+    t = np.arange(int(rate * seconds)) / rate
+    tone = 0.5 * np.sin(2 * np.pi * frequency * t)
+    samples = np.stack([tone, -tone][:channels], axis=1) if channels > 1 else tone[:, None]
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wf:
+        wf.setnchannels(channels)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes((samples * 32767).astype('<i2').tobytes())
+    return out.getvalue()
+
+
+def _peak_frequency(audio, rate=SAMPLE_RATE):
+    spectrum = np.abs(np.fft.rfft(audio))
+    return np.fft.rfftfreq(len(audio), 1 / rate)[spectrum.argmax()]
+
+
+class AudioDecodingTests(SimpleTestCase):
+    def test_resamples_to_16k_mono_float32(self):
+        for rate in (8000, 44100, 48000):
+            with self.subTest(rate=rate):
+                audio = decode_audio(_wav(1, rate))
+                self.assertEqual(audio.dtype, np.float32)
+                self.assertAlmostEqual(len(audio), SAMPLE_RATE // 2, delta=SAMPLE_RATE // 100)
+                self.assertAlmostEqual(_peak_frequency(audio), 440, delta=4)
+                self.assertAlmostEqual(np.abs(audio).max(), 0.5, delta=0.02)
+
+    def test_stereo_is_downmixed(self):
+        # Opposite channels cancel out, identical ones keep their level
+        self.assertLess(np.abs(decode_audio(_wav(2, 44100))).max(), 0.01)
+        left = _wav(1, 44100)
+        with wave.open(io.BytesIO(left)) as wf:
+            frames = np.frombuffer(wf.readframes(wf.getnframes()), dtype='<i2')
+        both = io.BytesIO()
+        with wave.open(both, 'wb') as wf:
+            wf.setnchannels(2)
+            wf.setsampwidth(2)
+            wf.setframerate(44100)
+            wf.writeframes(np.repeat(frames, 2).tobytes())
+        audio = decode_audio(both.getvalue())
+        self.assertAlmostEqual(len(audio), SAMPLE_RATE // 2, delta=SAMPLE_RATE // 100)
+        self.assertAlmostEqual(np.abs(audio).max(), 0.5, delta=0.02)
+
+    def test_sources_and_containers(self):
+        wav = _wav(1, SAMPLE_RATE)
+        expected = decode_audio(wav)
+        np.testing.assert_array_equal(decode_audio(io.BytesIO(wav)), expected)
+        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
+            f.write(wav)
+            f.flush()
+            np.testing.assert_array_equal(decode_audio(f.name), expected)
+        # A browser-style WebM/Opus upload of the same tone
+        webm = decode_audio(encode_webm(expected))
+        self.assertAlmostEqual(len(webm), len(expected), delta=SAMPLE_RATE // 20)
+        self.assertAlmostEqual(_peak_frequency(webm), 440, delta=4)
+
+    def test_undecodable_audio_raises(self):
+        with self.assertRaises(ValueError):
+            decode_audio(b'this is not audio' * 100)
+        with self.assertRaises(ValueError):
+            decode_audio(_wav(1, SAMPLE_RATE)[:20])
+
+    def test_debug_wav_only_when_enabled(self):
+        audio = decode_audio(_wav(1, SAMPLE_RATE))
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        with override_settings(MEDIA_ROOT=media, STT_SAVE_DEBUG_AUDIO=False):
+            self.assertIsNone(save_debug_wav(audio))
+        self.assertEqual(os.listdir(media), [])
+        with override_settings(MEDIA_ROOT=media, STT_SAVE_DEBUG_AUDIO=True):
+            path = save_debug_wav(np.concatenate([audio, [2.0, -2.0]]))
+        self.assertEqual(os.path.dirname(path), os.path.join(media, 'recorded_audio'))
+        with wave.open(path) as wf:
+            self.assertEqual((wf.getnchannels(), wf.getsampwidth(), wf.getframerate()), (1, 2, SAMPLE_RATE))
+            written = np.frombuffer(wf.readframes(wf.getnframes()), dtype='<i2')
+        np.testing.assert_allclose(written[:-2] / 32767, audio, atol=1e-4)
+        # Out-of-range samples are clipped rather than wrapped
+        self.assertEqual(written[-2:].tolist(), [32767, -32767])
+
+
+class LongAudioChunkingTests(SimpleTestCase):
+    def test_chunks_cut_at_pauses_and_cover_the_recording(self):
+        # 70 s of tone with half-second pauses at 27 s and 52 s
+        t = np.arange(SAMPLE_RATE * 70) / SAMPLE_RATE
+        audio = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+        for pause in (27, 52):
+            audio[pause * SAMPLE_RATE:int((pause + 0.5) * SAMPLE_RATE)] = 0
+        bounds = split_on_silence(audio, chunk_s=30, search_s=5)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], len(audio))
+        self.assertEqual([end for _, end in bounds[:-1]], [start for start, _ in bounds[1:]])
+        for (start, end), pause in zip(bounds, (27, 52)):
+            self.assertLessEqual(end - start, 30 * SAMPLE_RATE)
+            self.assertTrue(pause * SAMPLE_RATE <= end <= (pause + 0.5) * SAMPLE_RATE)
+
+    def test_stitched_segments_follow_chunk_order(self):
+        chunks = [
+            {'offset': 30.0, 'duration': 10.0, 'language': 'en', 'segments': [{'start': 31.0, 'end': 33.0, 'text': 'world'}]},
+            {'offset': 0.0, 'duration': 30.0, 'language': 'en', 'segments': [{'start': 1.0, 'end': 2.0, 'text': 'hello'}]},
+        ]
+        result = stitch_chunks(chunks)
+        self.assertEqual(result['text'], 'hello world')
+        self.assertEqual([segment['start'] for segment in result['segments']], [1.0, 31.0])
+        self.assertEqual((result['duration'], result['language']), (40.0, 'en'))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LongAudioProfileTests(SimpleTestCase):
+    def test_long_audio_is_cached_under_the_profile_it_was_transcribed_with(self):
+        audio = np.zeros(SAMPLE_RATE * 40, dtype=np.float32)
+        request = RequestFactory().post('/blog/speech-to-text/')
+        request.user = mock.Mock(is_authenticated=True, id=1)
+        transcript = {'text': 'a long dictation', 'language': 'en'}
+        with mock.patch('blog.views.read_request_audio', return_value=audio), \
+                mock.patch('blog.views.save_debug_wav', return_value=None), \
+                mock.patch('blog.views.lookup_transcript', return_value=(None, None)), \
+                mock.patch('blog.views.enqueue_transcription', side_effect=ConnectionError('redis down')), \
+                mock.patch('blog.views.transcribe_locally', return_value=transcript) as local, \
+                mock.patch('blog.views.store_transcript') as store:
+            response = views.speech_to_text(request)
+        self.assertEqual(json.loads(response.content)['text'], 'a long dictation')
+        local.assert_called_once_with(audio, 'dictation')
+        fingerprint = store.call_args[0][0]
+        self.assertEqual(fingerprint, transcript_cache.audio_fingerprint(audio, 'dictation'))
+        self.assertNotEqual(fingerprint, transcript_cache.audio_fingerprint(audio, None))
+
+
+class TranscriptionJobStatusTests(TestCase):
+    def test_only_the_owner_can_poll_a_transcription_job(self):
+        owner = User.objects.create_user('owner', password='pw')
+        User.objects.create_user('other', password='pw')
+        job = mock.Mock(meta={'kind': long_audio.JOB_KIND, 'user_id': owner.id})
+        url = reverse('blog:check_job_status', args=['job-1'])
+        with mock.patch('blog.views.django_rq.get_queue') as get_queue, \
+                mock.patch('blog.views.transcription_job_status', return_value={'status': 'completed', 'text': 'hi'}):
+            get_queue.return_value.fetch_job.return_value = job
+            self.assertEqual(self.client.get(url).status_code, 302)
+            self.client.login(username='other', password='pw')
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.client.login(username='owner', password='pw')
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['text'], 'hi')
+
+
+def _voice_pcm(*spans):
+    """16-bit PCM alternating silence and a harmonic tone webrtcvad takes for speech.
+
+    ``spans`` are seconds, starting with silence.
+    """
+    parts = []
+    for index, seconds in enumerate(spans):
+        t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+        if index % 2:
+            parts.append(0.2 * sum(np.sin(2 * np.pi * f * t) / n for n, f in enumerate((150, 300, 450, 600), 1)))
+        else:
+            parts.append(np.zeros_like(t))
+    return (np.concatenate(parts) * 32767).astype('<i2').tobytes()
+
+
+def _chunks(pcm, size=1000):
+    return [pcm[offset:offset + size] for offset in range(0, len(pcm), size)]
+
+
+class VadSegmenterTests(SimpleTestCase):
+    def test_utterances_are_cut_at_pauses_on_the_stream_timeline(self):
+        segmenter = streaming.VadSegmenter(padding_ms=150, end_silence_ms=300)
+        utterances = []
+        # Chunks that don't line up with the 30 ms frames
+        for chunk in _chunks(_voice_pcm(0.6, 1.0, 0.6, 0.8, 0.6)):
+            utterances.extend(segmenter.feed(chunk))
+        self.assertEqual(len(utterances), 2)
+        self.assertEqual(segmenter.utterance, 1)
+        (first, start1, end1), (second, start2, end2) = utterances
+        # Within the pre-roll before and webrtcvad's hangover after the speech
+        self.assertAlmostEqual(start1, 0.6, delta=0.15)
+        self.assertAlmostEqual(end1, 1.6, delta=0.15)
+        self.assertAlmostEqual(start2, 2.2, delta=0.15)
+        self.assertAlmostEqual(end2, 3.0, delta=0.15)
+        self.assertEqual(len(first), round((end1 - start1) * SAMPLE_RATE) * 2)
+        self.assertIsNone(segmenter.flush())
+
+    def test_long_speech_is_split_and_flushed(self):
+        segmenter = streaming.VadSegmenter(max_utterance_s=1)
+        utterances = segmenter.feed(_voice_pcm(0.3, 2.5))
+        self.assertEqual(len(utterances), 2)
+        self.assertTrue(all(end - start <= 1.0 for _, start, end in utterances))
+        self.assertTrue(segmenter.in_speech)
+        _, start, end = segmenter.flush()
+        self.assertAlmostEqual(end, 2.8, delta=0.05)
+        self.assertFalse(segmenter.in_speech)
+
+
+class StreamingSessionTests(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+        self.sent = []
+        self.release_first = threading.Event()
+        self.release_first.set()
+
+    def fake_transcribe(self, audio, profile, **options):
+        self.calls.append(options.get('initial_prompt'))
+        if len(self.calls) == 1:
+            self.release_first.wait(5)
+        return {'segments': [mock.Mock(text=f" {len(audio) / SAMPLE_RATE:.1f}s ")]}
+
+    async def send(self, message):
+        self.sent.append(json.loads(message['text']))
+
+    def run_session(self, scenario, **options):
+        async def main():
+            session = streaming.StreamingSession(self.send, dict(streaming._streaming_settings(), **options))
+            try:
+                await scenario(session)
+            finally:
+                session.close()
+
+        with mock.patch('blog.streaming.transcribe', self.fake_transcribe):
+            asyncio.run(main())
+
+    def test_finals_are_numbered_in_order_and_prompted_with_earlier_text(self):
+        async def scenario(session):
+            for chunk in _chunks(_voice_pcm(0.5, 0.9, 0.6, 0.6)):
+                await session.feed(chunk)
+            await session.finish()
+
+        self.run_session(scenario, PARTIAL_INTERVAL_MS=60000)
+        finals = [message for message in self.sent if message['type'] == 'final']
+        self.assertEqual([final['utterance'] for final in finals], [0, 1])
+        self.assertEqual(finals[0]['text'], f"{finals[0]['end'] - finals[0]['start']:.1f}s")
+        self.assertEqual(self.calls, [None, finals[0]['text']])
+        self.assertEqual(self.sent[-1], {'type': 'done'})
+
+    def test_partial_finishing_after_its_utterance_is_dropped(self):
+        self.release_first.clear()
+
+        async def scenario(session):
+            # Utterance 0 runs long enough for a partial, which is held up...
+            for chunk in _chunks(_voice_pcm(0.3, 0.8)):
+                await session.feed(chunk)
+            partial = session._partial_task
+            self.assertIsNotNone(partial)
+            # ...until utterance 0 has ended and utterance 1 is under way
+            for chunk in _chunks(_voice_pcm(0.6, 0.3)):
+                await session.feed(chunk)
+            self.assertEqual(session.segmenter.utterance, 1)
+            self.release_first.set()
+            await partial
+            await session.finish()
+
+        self.run_session(scenario, PARTIAL_INTERVAL_MS=300)
+        self.assertNotIn(0, [message['utterance'] for message in self.sent if message['type'] == 'partial'])
+        self.assertEqual([m['utterance'] for m in self.sent if m['type'] == 'final'], [0, 1])
+
+
+class SpeechSocketAuthTests(TransactionTestCase):
+    """The user is looked up on another thread, whose connection must see the rows."""
+
+    def scope(self, **headers):
+        return {'headers': [(name.encode(), value.encode()) for name, value in headers.items()]}
+
+    def test_session_must_still_be_valid_for_an_active_user(self):
+        user = User.objects.create_user('speaker', password='pw')
+        self.client.login(username='speaker', password='pw')
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        scope = self.scope(cookie=f"{settings.SESSION_COOKIE_NAME}={session_key}")
+        self.assertEqual(asyncio.run(streaming.get_scope_user_id(scope)), user.pk)
+        user.is_active = False
+        user.save()
+        self.assertIsNone(asyncio.run(streaming.get_scope_user_id(scope)))
+        user.is_active = True
+        user.set_password('changed')
+        user.save()
+        # Changing the password ends the other sessions, as it does over HTTP
+        self.assertIsNone(asyncio.run(streaming.get_scope_user_id(scope)))
+        self.assertIsNone(asyncio.run(streaming.get_scope_user_id(self.scope())))
+
+    @override_settings(CSRF_TRUSTED_ORIGINS=['https://app.example.com'])
+    def test_cross_origin_handshakes_are_refused(self):
+        self.assertTrue(streaming.is_same_origin(self.scope(host='localhost:8000', origin='http://localhost:8000')))
+        self.assertTrue(streaming.is_same_origin(self.scope(host='localhost:8000', origin='https://app.example.com')))
+        self.assertTrue(streaming.is_same_origin(self.scope(host='localhost:8000')))
+        self.assertFalse(streaming.is_same_origin(self.scope(host='localhost:8000', origin='https://evil.example')))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TranscriptCacheTests(SimpleTestCase):
+    def setUp(self):
+        transcript_cache.memory_tier.clear()
+        transcript_cache._get_cache().clear()
+        self.audio = np.linspace(-0.5, 0.5, SAMPLE_RATE, dtype=np.float32)
+
+    def test_fingerprint_depends_on_samples_and_profile(self):
+        fingerprint = transcript_cache.audio_fingerprint(self.audio, 'dictation')
+        self.assertEqual(fingerprint, transcript_cache.audio_fingerprint(self.audio.copy(), 'dictation'))
+        self.assertNotEqual(fingerprint, transcript_cache.audio_fingerprint(self.audio, 'voice_query'))
+        self.assertNotEqual(fingerprint, transcript_cache.audio_fingerprint(self.audio[1:], 'dictation'))
+
+    def test_shared_tier_serves_other_processes_and_fills_memory(self):
+        fingerprint = transcript_cache.audio_fingerprint(self.audio, 'dictation')
+        before = transcript_cache.cache_stats()
+        self.assertEqual(transcript_cache.lookup(fingerprint), (None, None))
+        transcript_cache.store(fingerprint, {'text': 'a red bicycle'})
+        # Simulate another process: nothing in its memory tier yet
+        transcript_cache.memory_tier.clear()
+        self.assertEqual(transcript_cache.lookup(fingerprint), ({'text': 'a red bicycle'}, 'shared'))
+        self.assertEqual(transcript_cache.lookup(fingerprint), ({'text': 'a red bicycle'}, 'memory'))
+        after = transcript_cache.cache_stats()
+        self.assertEqual(
+            {key: after[key] - before[key] for key in after},
+            {'memory_hits': 1, 'shared_hits': 1, 'misses': 1},
+        )
+
+
+class StubWhisperModel:
+    """Stands in for faster_whisper.WhisperModel: holds each decode until ``release`` is set."""
+
+    def __init__(self, *args, **kwargs):
+        self.release = threading.Event()
+        self.started = queue.Queue()
+
+    def transcribe(self, audio, **options):
+        self.started.put(options)
+
+        def segments():
+            self.release.wait(timeout=5)
+            if options.get('language') == 'xx':
+                raise ValueError('unsupported language')
+            yield mock.Mock(text=' hello ')
+
+        return segments(), mock.Mock(duration=len(audio) / SAMPLE_RATE, language='en', language_probability=0.9)
+
+
+class TranscriptionServiceTests(SimpleTestCase):
+    def make_service(self, **options):
+        with mock.patch('faster_whisper.WhisperModel', StubWhisperModel):
+            service = transcription.TranscriptionService(num_workers=1, cpu_threads=2, **options)
+        self.addCleanup(service._executor.shutdown, wait=True)
+        self.addCleanup(service.model.release.set)
+        return service
+
+    def in_background(self, service, **options):
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown, wait=True)
+        return pool.submit(service.transcribe, np.zeros(SAMPLE_RATE, dtype=np.float32), **options)
+
+    def test_full_queue_rejects_new_requests(self):
+        service = self.make_service(max_queue=1)
+        running = self.in_background(service)
+        service.model.started.get(timeout=5)
+        waiting = self.in_background(service)
+        for _ in range(100):
+            if service.stats()['queued'] == 1:
+                break
+            time.sleep(0.01)
+        with self.assertRaises(transcription.TranscriptionQueueFull):
+            service.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+        self.assertEqual(service.stats()['rejected'], 1)
+
+        service.model.release.set()
+        self.assertEqual(running.result(timeout=5)['segments'][0].text, ' hello ')
+        waiting.result(timeout=5)
+        stats = service.stats()
+        self.assertEqual((stats['completed'], stats['queued'], stats['active']), (2, 0, 0))
+        # The slots came back
+        service.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+
+    def test_timeout_cancels_the_request(self):
+        service = self.make_service(max_queue=1, timeout=0.1)
+        running = self.in_background(service)
+        service.model.started.get(timeout=5)
+        with self.assertRaises(transcription.TranscriptionTimeout):
+            service.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+        with self.assertRaises(transcription.TranscriptionTimeout):
+            running.result(timeout=5)
+        # The queued request never started and the running one stops at its next segment
+        service.model.release.set()
+        for _ in range(100):
+            if service.stats()['active'] == 0:
+                break
+            time.sleep(0.01)
+        stats = service.stats()
+        self.assertEqual(stats['timeouts'], 2)
+        self.assertEqual((stats['completed'], stats['failed'], stats['queued'], stats['active']), (0, 0, 0, 0))
+        self.assertEqual(service.model.started.qsize(), 0)
+        service.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), timeout=5)
+
+    def test_stats_track_audio_and_failures(self):
+        service = self.make_service()
+        service.model.release.set()
+        result = service.transcribe(np.zeros(2 * SAMPLE_RATE, dtype=np.float32), beam_size=1)
+        self.assertEqual(service.model.started.get_nowait(), {'beam_size': 1})
+        self.assertGreaterEqual(result['queue_wait'], 0)
+        with self.assertRaises(ValueError):
+            service.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language='xx')
+        stats = service.stats()
+        self.assertEqual((stats['completed'], stats['failed'], stats['rejected'], stats['timeouts']), (1, 1, 0, 0))
+        self.assertEqual(stats['audio_seconds'], 2.0)
+        self.assertEqual((stats['num_workers'], stats['cpu_threads']), (1, 2))
+        self.assertEqual(stats['mean_real_time_factor'], round(stats['processing_seconds'] / 2.0, 3))
+        self.assertEqual(stats['last_real_time_factor'], round(result['real_time_factor'], 3))
+
+
+class DecodingProfileTests(SimpleTestCase):
+    def test_default_profile_detects_the_language(self):
+        profile = transcription.get_profile()
+        self.assertEqual(profile['NAME'], 'voice_query')
+        self.assertIsNone(transcription.decode_options(profile)['language'])
+
+    def test_unknown_profile_is_rejected(self):
+        with self.assertRaises(transcription.UnknownProfile):
+            transcription.get_profile('shouting')
+        request = RequestFactory().post('/blog/speech-to-text/?profile=shouting')
+        request.user = mock.Mock(is_authenticated=True, id=1)
+        with mock.patch('blog.views.read_request_audio') as read_audio:
+            response = views.speech_to_text(request)
+        self.assertEqual(response.status_code, 400)
+        read_audio.assert_not_called()
+
+    def test_reference_set_measures_accuracy(self):
+        with open(os.path.join(settings.BASE_DIR, 'stt_reference.json')) as f:
+            reference_set = json.load(f)
+        scored = [entry for entry in reference_set if entry.get('text')]
+        self.assertGreaterEqual(len(scored), 2)
+        for entry in reference_set:
+            audio = decode_audio(os.path.join(settings.BASE_DIR, entry['audio']))
+            self.assertGreater(len(audio), SAMPLE_RATE)
+
+    def test_word_error_rate_counts_word_edits(self):
+        reference = normalize_words("A dog, on the grass.")
+        self.assertEqual(reference, ['a', 'dog', 'on', 'the', 'grass'])
+        # Two substitutions (on -> in, the -> green)
+        self.assertEqual(word_edits(reference, normalize_words("a dog in green grass")), 2)
+        # A deletion (the) and an insertion (big)
+        self.assertEqual(word_edits(reference, normalize_words("a big dog on grass")), 2)
+        self.assertEqual(word_edits(reference, reference), 0)
@@ -0,0 +1,293 @@
+import csv
+import io
+import json
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import torch
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from blog import export, fragment_cache, transcription, views
+from blog.model_handler import ModelHandler
+from blog.models import DetectedObject, ImageAnalysis, UserProfile
+from blog.tests.utils import TEST_CACHES
+
+
+@override_settings(CACHES=TEST_CACHES, FRAGMENT_CACHE_ALIAS='fragments')
+class FragmentCacheInvalidationTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        fragment_cache._get_cache().clear()
+        self.user = User.objects.create_user(username='alice', password='secret-pass-123')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _create_analysis(self, caption):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ImageAnalysis.objects.create(
+                image=SimpleUploadedFile('test.jpg', b'fake-image', content_type='image/jpeg'),
+                short_caption=caption,
+                user=self.user,
+            )
+
+    def _render(self):
+        return fragment_cache.render_fragment(
+            'recent_analyses', self.user.id, 'blog/recent_analyses_partial.html',
+            lambda: {'analyses': ImageAnalysis.objects.filter(user=self.user)[:10]}
+        )
+
+    def test_repeat_render_is_served_from_cache(self):
+        self._create_analysis('a red bicycle')
+        self._render()
+        with self.assertNumQueries(0):
+            html = self._render()
+        self.assertIn('a red bicycle', html)
+        stats = fragment_cache.fragment_stats()['recent_analyses']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 50.0)
+
+    def test_new_analysis_is_never_served_stale(self):
+        self._create_analysis('a red bicycle')
+        self.assertNotIn('a blue car', self._render())
+        self._create_analysis('a blue car')
+        self.assertIn('a blue car', self._render())
+
+    def test_deleted_analysis_is_never_served_stale(self):
+        analysis = self._create_analysis('a red bicycle')
+        self.assertIn('a red bicycle', self._render())
+        with self.captureOnCommitCallbacks(execute=True):
+            analysis.delete()
+        self.assertNotIn('a red bicycle', self._render())
+
+    def test_profile_update_invalidates_fragments(self):
+        self._render()
+        generation = fragment_cache.get_generation(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            UserProfile.objects.create(user=self.user, bio='hello')
+        self.assertNotEqual(fragment_cache.get_generation(self.user.id), generation)
+
+    def test_generation_is_bumped_only_after_commit(self):
+        generation = fragment_cache.get_generation(self.user.id)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._render()
+            ImageAnalysis.objects.create(image='uploads/a.jpg', short_caption='a red bicycle', user=self.user)
+            # Until the row commits, readers keep the old generation and the fragments cached under it
+            self.assertEqual(fragment_cache.get_generation(self.user.id), generation)
+            with self.assertNumQueries(0):
+                self.assertNotIn('a red bicycle', self._render())
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertNotEqual(fragment_cache.get_generation(self.user.id), generation)
+        self.assertIn('a red bicycle', self._render())
+
+    def test_evicted_generation_does_not_resurrect_old_fragments(self):
+        self._create_analysis('a red bicycle')
+        self._render()
+        fragment_cache._get_cache().delete(fragment_cache.GENERATION_KEY.format(user_id=self.user.id))
+        ImageAnalysis.objects.filter(user=self.user).update(short_caption='a green boat')
+        self.assertIn('a green boat', self._render())
+
+    def test_cache_outage_does_not_fail_writes(self):
+        broken = mock.Mock()
+        broken.get.side_effect = broken.incr.side_effect = broken.set.side_effect = ConnectionError('cache down')
+        with mock.patch.object(fragment_cache, '_get_cache', return_value=broken), \
+                self.assertLogs('blog.fragment_cache', 'ERROR'):
+            analysis = self._create_analysis('a red bicycle')
+            with self.captureOnCommitCallbacks(execute=True):
+                analysis.delete()
+            self.assertIn('a blue car', fragment_cache.render_fragment(
+                'recent_analyses', self.user.id, 'blog/recent_analyses_partial.html',
+                lambda: {'analyses': [ImageAnalysis(short_caption='a blue car')]},
+            ))
+        self.assertFalse(ImageAnalysis.objects.exists())
+
+    def test_other_users_fragments_are_untouched(self):
+        other = User.objects.create_user(username='bob', password='secret-pass-123')
+        generation = fragment_cache.get_generation(other.id)
+        self._create_analysis('a red bicycle')
+        self.assertEqual(fragment_cache.get_generation(other.id), generation)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExportTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        day = timezone.make_aware(datetime(2026, 3, 1, 12))
+        self.analyses = [
+            ImageAnalysis.objects.create(image=f'{i}.jpg', upload_date=day + timedelta(days=i), user=user,
+                                         short_caption=f'caption, "{i}"', model_version=version)
+            for i, (user, version) in enumerate([
+                (self.alice, 'v1'), (self.alice, 'v2'), (self.bob, 'v1'), (self.alice, 'v1'), (None, 'v1'),
+            ])
+        ]
+        DetectedObject.objects.create(image_analysis=self.analyses[0], label='dog', confidence=0.9,
+                                      x_min=0, y_min=0, x_max=1, y_max=1)
+        DetectedObject.objects.create(image_analysis=self.analyses[2], label='cat', confidence=0.8,
+                                      x_min=0, y_min=0, x_max=1, y_max=1)
+
+    def export_ids(self, fmt, table='analyses', **filters):
+        chunks = list(export.stream_export(fmt, table, chunk_size=2, **filters))
+        if fmt == 'jsonl':
+            return [json.loads(line)['id'] for line in ''.join(chunks).splitlines()]
+        if fmt == 'csv':
+            return [int(row['id']) for row in csv.DictReader(io.StringIO(''.join(chunks)))]
+        import pyarrow.parquet as pq
+        parquet = pq.ParquetFile(io.BytesIO(b''.join(chunks)))
+        # One row group per chunk of rows
+        self.assertEqual(parquet.metadata.num_row_groups, -(-parquet.metadata.num_rows // 2))
+        return parquet.read().column('id').to_pylist()
+
+    def test_formats_stream_every_row_in_order(self):
+        ids = [a.id for a in self.analyses]
+        for fmt in export.FORMATS:
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.export_ids(fmt), ids)
+        rows = list(csv.DictReader(io.StringIO(''.join(export.stream_export('csv')))))
+        self.assertEqual(rows[0]['short_caption'], 'caption, "0"')
+        self.assertEqual(rows[0]['user__username'], 'alice')
+        line = json.loads(next(export.stream_export('jsonl')).splitlines()[0])
+        self.assertEqual(line['upload_date'], '2026-03-01T12:00:00Z')
+
+    def test_filters(self):
+        a = [analysis.id for analysis in self.analyses]
+        start = export.parse_bound('2026-03-02')
+        end = export.parse_bound('2026-03-04', end=True)
+        for fmt in export.FORMATS:
+            with self.subTest(fmt=fmt):
+                self.assertEqual(self.export_ids(fmt, user_id=self.alice.id), [a[0], a[1], a[3]])
+                self.assertEqual(self.export_ids(fmt, model_version='v1'), [a[0], a[2], a[3], a[4]])
+                # A bare end date covers that whole day
+                self.assertEqual(self.export_ids(fmt, start=start, end=end), [a[1], a[2], a[3]])
+                objects = DetectedObject.objects.order_by('pk').values_list('id', flat=True)
+                self.assertEqual(self.export_ids(fmt, 'objects', user_id=self.bob.id), [objects[1]])
+        self.assertEqual(export.parse_bound('2026-03-04T10:30:00', end=True),
+                         timezone.make_aware(datetime(2026, 3, 4, 10, 30)))
+        for value in ('yesterday', '2026-02-30'):
+            with self.assertRaises(ValueError):
+                export.parse_bound(value)
+
+    def get(self, login, **params):
+        if login is not None:
+            self.client.force_login(login)
+        response = self.client.get(reverse('blog:export_analyses'), params)
+        if response.status_code != 200:
+            return response, None
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="analyses.{params["format"]}"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return response, [json.loads(line)['id'] for line in lines]
+
+    def test_view_limits_users_to_their_own_rows(self):
+        response, _ = self.get(None, format='jsonl')
+        self.assertEqual(response.status_code, 302)
+        a = [analysis.id for analysis in self.analyses]
+        # Asking for someone else's rows still returns only your own
+        _, ids = self.get(self.bob, format='jsonl', user=str(self.alice.id))
+        self.assertEqual(ids, [a[2]])
+        _, ids = self.get(self.staff, format='jsonl', user=str(self.alice.id), model_version='v1')
+        self.assertEqual(ids, [a[0], a[3]])
+        _, ids = self.get(self.staff, format='jsonl')
+        self.assertEqual(ids, a)
+
+    def test_view_rejects_bad_parameters(self):
+        for params in ({'format': 'xml'}, {'format': 'csv', 'table': 'users'}, {'format': 'csv', 'start': 'soon'}):
+            with self.subTest(params=params):
+                response, _ = self.get(self.alice, **params)
+                self.assertEqual(response.status_code, 400)
+
+
+class FakeVoiceQueryHandler:
+    """Stands in for ModelHandler: captions only once Whisper is running too."""
+    model_version = 'fake'
+
+    def __init__(self, overlap, fail=False):
+        self.overlap = overlap
+        self.fail = fail
+        self.threads = {}
+
+    def prepare_image(self, image_file):
+        return image_file
+
+    @contextmanager
+    def capture_embeddings(self):
+        yield []
+
+    def generate_short_caption(self, image):
+        self.overlap.wait(timeout=5)
+        self.threads['caption'] = torch.get_num_threads()
+        if self.fail:
+            raise RuntimeError('out of memory')
+        return 'a dog'
+
+    def process_query(self, image, query_text):
+        self.threads['query'] = torch.get_num_threads()
+        return f'answer to {query_text}'
+
+    def provenance(self):
+        return {}
+
+
+@override_settings(CACHES=TEST_CACHES, WHISPER=dict(settings.WHISPER, CPU_THREADS=3))
+class VoiceQueryTaskTests(SimpleTestCase):
+    def setUp(self):
+        threads = torch.get_num_threads()
+        torch.set_num_threads(4)
+        self.addCleanup(torch.set_num_threads, threads)
+        self.overlap = threading.Barrier(2)
+
+    def run_task(self, handler, transcribe):
+        with mock.patch.object(ModelHandler, 'get_instance', return_value=handler), \
+                mock.patch('blog.views.decode_audio', return_value=np.zeros(16000, dtype=np.float32)), \
+                mock.patch('blog.views.transcribe_cached', side_effect=transcribe), \
+                mock.patch('blog.views.save_analysis', return_value=mock.Mock(id=7)) as save, \
+                mock.patch('blog.views.add_embeddings'):
+            return views.process_voice_query_task('dog.jpg', b'audio', user_id=None), save
+
+    def transcribe(self, audio, profile):
+        self.overlap.wait(timeout=5)
+        return {'text': 'what breed is it'}
+
+    def test_caption_and_transcription_split_the_cores(self):
+        handler = FakeVoiceQueryHandler(self.overlap)
+        analysis_id, save = self.run_task(handler, self.transcribe)
+        self.assertEqual(analysis_id, 7)
+        data = save.call_args.args[0]
+        self.assertEqual(data['short_caption'], 'a dog')
+        self.assertEqual(data['query_result'], 'answer to what breed is it')
+        # Whisper has 3 of the 4 threads while both run; the query gets all of them back
+        self.assertEqual(handler.threads, {'caption': 1, 'query': 4})
+        self.assertEqual(torch.get_num_threads(), 4)
+
+    def test_caption_failure_fails_the_task(self):
+        handler = FakeVoiceQueryHandler(self.overlap, fail=True)
+        analysis_id, save = self.run_task(handler, self.transcribe)
+        self.assertIsNone(analysis_id)
+        save.assert_not_called()
+        self.assertEqual(torch.get_num_threads(), 4)
+
+    def test_transcription_failure_fails_the_task(self):
+        def transcribe(audio, profile):
+            self.overlap.wait(timeout=5)
+            raise transcription.TranscriptionTimeout('too slow')
+
+        handler = FakeVoiceQueryHandler(self.overlap)
+        analysis_id, save = self.run_task(handler, transcribe)
+        self.assertIsNone(analysis_id)
+        save.assert_not_called()
+        self.assertNotIn('query', handler.threads)
+        self.assertEqual(torch.get_num_threads(), 4)
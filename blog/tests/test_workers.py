@@ -0,0 +1,159 @@
+import weakref
+
+from django.test import SimpleTestCase
+
+from blog import autoscaler, model_swap
+from blog.inference_pool import core_sets
+from blog.model_handler import ModelHandler
+
+
+class InferencePoolTests(SimpleTestCase):
+    def test_core_sets_are_disjoint_and_cover_every_core(self):
+        sets = core_sets(3, range(8))
+        self.assertEqual(sets, [[0, 1, 2], [3, 4, 5], [6, 7]])
+        self.assertEqual(core_sets(1, [5, 4]), [[4, 5]])
+
+    def test_more_processes_than_cores_share_them(self):
+        with self.assertLogs('blog.inference_pool', 'WARNING'):
+            self.assertEqual(core_sets(3, [0, 1]), [[0], [1], [0]])
+
+
+class AutoscalerTests(SimpleTestCase):
+    def test_policy_scales_up_on_backlog_and_down_after_idle(self):
+        policy = autoscaler.ScalingPolicy(min_workers=1, max_workers=4, jobs_per_worker=2, scale_down_idle=60,
+                                          cooldown=30)
+        busy = {'default': autoscaler.QueueState(depth=7, oldest_age=5)}
+        empty = {'default': autoscaler.QueueState()}
+        self.assertEqual(policy.desired(busy, 1, now=0), 4)
+        self.assertEqual(policy.desired(empty, 4, now=10), 4)
+        self.assertEqual(policy.desired(empty, 4, now=69), 4)
+        self.assertEqual(policy.desired(empty, 4, now=70), 3)
+        # One at a time: the next retirement waits for another idle period
+        self.assertEqual(policy.desired(empty, 3, now=75), 3)
+        self.assertEqual(policy.desired(empty, 3, now=130), 2)
+
+    def test_policy_respects_memory_budget_and_bounds(self):
+        policy = autoscaler.ScalingPolicy(min_workers=2, max_workers=8, memory_budget=4000, worker_memory=1000)
+        flood = {'default': autoscaler.QueueState(depth=100, oldest_age=600)}
+        self.assertEqual(policy.desired(flood, 2, now=0), 4)
+        # A measured footprint above the estimate lowers the cap
+        self.assertEqual(policy.desired(flood, 4, now=5, worker_memory=1900), 2)
+        self.assertEqual(policy.desired({}, 0, now=10), 2)
+
+    def test_draining_workers_hold_memory_until_they_exit(self):
+        policy = autoscaler.ScalingPolicy(min_workers=1, max_workers=8, memory_budget=4000, worker_memory=1000)
+        flood = {'default': autoscaler.QueueState(depth=100, oldest_age=600)}
+        # Two draining workers leave room for two more, not four
+        self.assertEqual(policy.desired(flood, 0, now=0, draining_memory=2000), 2)
+        # Running workers are not retired to make room
+        self.assertEqual(policy.desired(flood, 3, now=5, draining_memory=2000), 3)
+        self.assertEqual(policy.desired(flood, 3, now=10), 4)
+
+    def test_long_waits_add_one_worker_per_startup_period(self):
+        policy = autoscaler.ScalingPolicy(min_workers=1, max_workers=8, memory_budget=100000, startup=30)
+        # One slow job: the backlog fits the workers but it has waited too long
+        slow = {'default': autoscaler.QueueState(depth=1, oldest_age=120)}
+        self.assertEqual(policy.desired(slow, 1, now=0), 2)
+        # The new worker is still loading its models: don't pile on more
+        self.assertEqual(policy.desired(slow, 2, now=5), 2)
+        self.assertEqual(policy.desired(slow, 2, now=25), 2)
+        self.assertEqual(policy.desired(slow, 2, now=30), 3)
+
+    def test_simulation_trades_worker_time_for_latency(self):
+        trace = autoscaler.synthetic_trace(3 * 3600, base_rate=0.01, peak_rate=0.5, period=3600, seed=1)
+        policy = autoscaler.ScalingPolicy(min_workers=1, max_workers=4, memory_budget=100000)
+        scaled = autoscaler.simulate(trace, policy=policy, service_time=4, startup_time=30)
+        fixed = autoscaler.simulate(trace, workers=4, service_time=4, startup_time=30)
+        self.assertEqual(scaled['jobs'], len(trace))
+        self.assertEqual(fixed['jobs'], len(trace))
+        self.assertLessEqual(scaled['peak_workers'], 4)
+        self.assertLess(scaled['worker_hours'], fixed['worker_hours'])
+        self.assertLess(scaled['wait_p95'], 60)
+
+
+class FakeRedis:
+    """The few Redis commands model_swap uses, kept in dicts."""
+
+    def __init__(self):
+        self.values, self.lists, self.hashes = {}, {}, {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value.encode()
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+    def lpush(self, key, value):
+        self.lists.setdefault(key, []).insert(0, value.encode())
+
+    def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:end + 1]
+
+    def lpop(self, key):
+        return self.lists[key].pop(0) if self.lists.get(key) else None
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field.encode()] = value.encode()
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field.encode(), None)
+
+
+class FakeCheckedHandler:
+    def __init__(self, model_id, answer='a gradient'):
+        self.model_version = model_id
+        self.answer = answer
+
+    def self_check(self, image, prompt, max_new_tokens):
+        if not self.answer:
+            raise RuntimeError('empty answer')
+        return {'answer': self.answer, 'warm_up': 0.0, 'latency': 0.0}
+
+
+class ModelSwapTests(SimpleTestCase):
+    def setUp(self):
+        self.original = ModelHandler._instance
+        ModelHandler._instance = FakeCheckedHandler(model_swap.default_model_id())
+        self.redis = FakeRedis()
+
+    def tearDown(self):
+        ModelHandler._instance = self.original
+
+    def test_rollback_returns_to_previous_targets(self):
+        model_swap.set_target('v2', self.redis)
+        model_swap.set_target('v3', self.redis)
+        self.assertEqual(model_swap.fleet_target(self.redis)['model_id'], 'v3')
+        self.assertEqual(model_swap.rollback(self.redis)['model_id'], 'v2')
+        self.assertEqual(model_swap.rollback(self.redis)['model_id'], model_swap.default_model_id())
+        self.assertIsNone(model_swap.rollback(self.redis))
+
+    def test_swap_installs_checked_model_and_releases_the_old_one(self):
+        old = weakref.ref(ModelHandler._instance)
+        swapper = model_swap.ModelSwapper(self.redis, 'w1', factory=FakeCheckedHandler)
+        target = model_swap.set_target('v2', self.redis)
+        swapper.poll()
+        self.assertEqual(ModelHandler._instance.model_version, 'v2')
+        self.assertIsNone(old())
+        status = model_swap.worker_statuses(self.redis)['w1']
+        self.assertEqual((status['state'], status['generation']), ('serving', target['generation']))
+
+    def test_failed_self_check_keeps_serving_the_old_model(self):
+        swapper = model_swap.ModelSwapper(self.redis, 'w1', factory=lambda model_id: FakeCheckedHandler(model_id, ''))
+        model_swap.set_target('broken', self.redis)
+        with self.assertLogs('blog.model_swap', 'ERROR'):
+            swapper.poll()
+        self.assertEqual(ModelHandler._instance.model_version, model_swap.default_model_id())
+        swapper.poll()  # the failure stays reported until the next target
+        self.assertEqual(model_swap.worker_statuses(self.redis)['w1']['state'], 'failed')
+        # Rolling back to what it already serves needs no reload
+        model_swap.rollback(self.redis)
+        swapper.factory = None
+        swapper.poll()
+        self.assertEqual(model_swap.worker_statuses(self.redis)['w1']['state'], 'serving')
@@ -0,0 +1,8 @@
+"""Fixtures shared by the blog test modules."""
+
+# Every alias the app uses, so no test reaches a real Redis database
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'default'},
+    'fragments': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragments'},
+    'transcripts': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'transcripts'},
+}
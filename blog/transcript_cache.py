@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .transcription import get_profile, transcribe
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_KEY = "transcript:{fingerprint}"
+
+
+def _get_cache():
+    return caches[getattr(settings, 'TRANSCRIPT_CACHE_ALIAS', 'default')]
+
+
+def _cache_timeout():
+    return getattr(settings, 'TRANSCRIPT_CACHE_TIMEOUT', 86400)
+
+
+class TranscriptLRU:
+    """Thread-safe in-process LRU of recent transcripts."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+memory_tier = TranscriptLRU(getattr(settings, 'TRANSCRIPT_CACHE_LRU_SIZE', 256))
+
+_stats_lock = threading.Lock()
+_stats = {'memory_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+
+def _record(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    """Hit/miss counters of this process since it started."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def audio_fingerprint(audio, profile=None):
+    """Key a transcript by the decoded samples and the resolved decoding profile.
+
+    Hashing PCM rather than the upload means a clip re-sent in another
+    container, or with different metadata, still hits; including the profile
+    settings means changing a profile never serves transcripts made with
+    the old ones.
+    """
+    digest = hashlib.sha256(json.dumps(get_profile(profile), sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(audio, dtype=np.float32).data)
+    return digest.hexdigest()
+
+
+def lookup(fingerprint):
+    """Return ``(transcript, tier)`` from the memory or shared tier, or ``(None, None)``."""
+    transcript = memory_tier.get(fingerprint)
+    if transcript is not None:
+        _record('memory_hits')
+        return transcript, 'memory'
+    try:
+        transcript = _get_cache().get(TRANSCRIPT_KEY.format(fingerprint=fingerprint))
+    except Exception as e:
+        # A shared cache outage only costs a transcription
+        logger.error(f"Transcript cache error: {str(e)}")
+        transcript = None
+    if transcript is not None:
+        memory_tier.put(fingerprint, transcript)
+        _record('shared_hits')
+        return transcript, 'shared'
+    _record('misses')
+    return None, None
+
+
+def store(fingerprint, transcript):
+    memory_tier.put(fingerprint, transcript)
+    try:
+        _get_cache().set(TRANSCRIPT_KEY.format(fingerprint=fingerprint), transcript, timeout=_cache_timeout())
+    except Exception as e:
+        logger.error(f"Transcript cache error: {str(e)}")
+
+
+def cache_metadata(tier):
+    """The ``cache`` block of a speech_to_text response."""
+    return dict(cache_stats(), result='hit' if tier else 'miss', tier=tier)
+
+
+def transcribe_cached(audio, profile=None, fingerprint=None):
+    """Transcribe ``audio`` with ``profile``, reusing an earlier result for identical audio."""
+    fingerprint = fingerprint or audio_fingerprint(audio, profile)
+    transcript, tier = lookup(fingerprint)
+    if transcript is not None:
+        return dict(transcript, queue_wait=0.0, real_time_factor=0.0, cache=cache_metadata(tier))
+
+    result = transcribe(audio, profile)
+    info = result['info']
+    transcript = {
+        'text': " ".join(segment.text.strip() for segment in result['segments']).strip(),
+        'language': info.language,
+        'language_probability': info.language_probability,
+        'duration': info.duration,
+        'profile': result['profile'],
+    }
+    store(fingerprint, transcript)
+    return dict(
+        transcript, queue_wait=result['queue_wait'], real_time_factor=result['real_time_factor'],
+        cache=cache_metadata(None),
+    )
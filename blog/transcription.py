@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionQueueFull(Exception):
+    """Raised when the bounded transcription queue cannot take another request."""
+
+
+class TranscriptionTimeout(Exception):
+    """Raised when a transcription does not finish within its deadline."""
+
+
+class TranscriptionCancelled(Exception):
+    """Raised inside a worker when its request was cancelled."""
+
+
+class UnknownProfile(ValueError):
+    """Raised for a decoding profile name that isn't in WHISPER_PROFILES."""
+
+
+def _whisper_settings():
+    options = {
+        'MODEL_SIZE': 'small',
+        'DEVICE': 'cpu',
+        'COMPUTE_TYPE': 'int8',
+        'NUM_WORKERS': 1,
+        'CPU_THREADS': 0,
+        'MAX_QUEUE': 8,
+        'TIMEOUT': 120,
+    }
+    options.update(getattr(settings, 'WHISPER', {}))
+    return options
+
+
+def get_profile(name=None):
+    """Resolve a decoding profile, falling back to WHISPER_DEFAULT_PROFILE.
+
+    Unset keys take faster-whisper's own defaults (beam search, language
+    detection, the full temperature fallback) on the WHISPER model.
+    """
+    whisper = _whisper_settings()
+    profiles = {'default': {}}
+    profiles.update(getattr(settings, 'WHISPER_PROFILES', {}))
+    name = name or getattr(settings, 'WHISPER_DEFAULT_PROFILE', 'default')
+    if name not in profiles:
+        raise UnknownProfile(f"Unknown decoding profile: {name}")
+    profile = {
+        'MODEL_SIZE': whisper['MODEL_SIZE'],
+        'COMPUTE_TYPE': whisper['COMPUTE_TYPE'],
+        'BEAM_SIZE': 5,
+        'LANGUAGE': None,
+        'VAD_FILTER': False,
+        'TEMPERATURE': [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+    }
+    profile.update(profiles[name])
+    profile['NAME'] = name
+    return profile
+
+
+def decode_options(profile):
+    """faster-whisper ``transcribe`` keyword arguments for a profile."""
+    return {
+        'beam_size': profile['BEAM_SIZE'],
+        'language': profile['LANGUAGE'],
+        'vad_filter': profile['VAD_FILTER'],
+        'temperature': list(profile['TEMPERATURE']),
+    }
+
+
+def worker_threads(cpu_threads=None, num_workers=None):
+    """Intra-op threads per Whisper worker: ``CPU_THREADS``, or an even share of the cores."""
+    whisper = _whisper_settings()
+    cpu_threads = whisper['CPU_THREADS'] if cpu_threads is None else cpu_threads
+    num_workers = num_workers or whisper['NUM_WORKERS']
+    return cpu_threads or max(1, (os.cpu_count() or 1) // num_workers)
+
+
+def transcribe(audio, profile=None, timeout=None, **overrides):
+    """Transcribe ``audio`` with a named decoding profile on that profile's model pool."""
+    resolved = get_profile(profile)
+    service = TranscriptionService.get_instance(resolved['MODEL_SIZE'], resolved['COMPUTE_TYPE'])
+    options = decode_options(resolved)
+    options.update(overrides)
+    result = service.transcribe(audio, timeout=timeout, **options)
+    result['profile'] = resolved['NAME']
+    return result
+
+
+class TranscriptionService:
+    """Owns the faster-whisper model and bounds how many requests use it at once.
+
+    ``NUM_WORKERS`` transcriptions run in parallel (faster-whisper keeps one
+    model replica per worker), each with ``CPU_THREADS`` intra-op threads, so
+    concurrent requests no longer oversubscribe the cores. At most
+    ``MAX_QUEUE`` further requests wait; the rest are rejected immediately.
+    There is one service per model size and compute type in use by the
+    decoding profiles.
+    """
+    _instances = {}
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, model_size=None, compute_type=None):
+        options = {k.lower(): v for k, v in _whisper_settings().items()}
+        options['model_size'] = model_size or options['model_size']
+        options['compute_type'] = compute_type or options['compute_type']
+        key = (options['model_size'], options['compute_type'])
+        with cls._instance_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(**options)
+            return cls._instances[key]
+
+    @classmethod
+    def is_loaded(cls):
+        return bool(cls._instances)
+
+    @classmethod
+    def loaded(cls):
+        """Services created so far, keyed by ``(model_size, compute_type)``."""
+        with cls._instance_lock:
+            return dict(cls._instances)
+
+    def __init__(self, model_size='small', device='cpu', compute_type='int8', num_workers=1,
+                 cpu_threads=0, max_queue=8, timeout=120):
+        from faster_whisper import WhisperModel
+
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.num_workers = num_workers
+        self.cpu_threads = worker_threads(cpu_threads, num_workers)
+        self.timeout = timeout
+        self.model = WhisperModel(
+            model_size, device=device, compute_type=compute_type,
+            cpu_threads=self.cpu_threads, num_workers=num_workers,
+        )
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='whisper')
+        self._slots = threading.BoundedSemaphore(num_workers + max_queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            'queued': 0, 'active': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0, 'failed': 0,
+            'audio_seconds': 0.0, 'processing_seconds': 0.0, 'last_real_time_factor': None,
+        }
+        logger.info(
+            f"Loaded Whisper {model_size} ({compute_type}) with {num_workers} workers x {self.cpu_threads} threads"
+        )
+
+    def _update(self, **deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._stats[key] += delta
+
+    def _run(self, audio, options, cancelled, submitted_at):
+        self._update(queued=-1, active=1)
+        try:
+            if cancelled.is_set():
+                raise TranscriptionCancelled()
+            started_at = time.monotonic()
+            segments, info = self.model.transcribe(audio, **options)
+            # Segments are decoded lazily, so cancellation takes effect between segments
+            collected = []
+            for segment in segments:
+                if cancelled.is_set():
+                    raise TranscriptionCancelled()
+                collected.append(segment)
+            processing = time.monotonic() - started_at
+            real_time_factor = processing / info.duration if info.duration else 0.0
+            with self._lock:
+                self._stats['completed'] += 1
+                self._stats['audio_seconds'] += info.duration
+                self._stats['processing_seconds'] += processing
+                self._stats['last_real_time_factor'] = round(real_time_factor, 3)
+            return {
+                'segments': collected,
+                'info': info,
+                'queue_wait': started_at - submitted_at,
+                'processing_time': processing,
+                'real_time_factor': real_time_factor,
+            }
+        except TranscriptionCancelled:
+            raise
+        except Exception:
+            self._update(failed=1)
+            raise
+        finally:
+            self._update(active=-1)
+
+    def transcribe(self, audio, timeout=None, **options):
+        """Transcribe ``audio`` on the pool and wait for the result.
+
+        Raises TranscriptionQueueFull when the queue is full and
+        TranscriptionTimeout (after cancelling the work) when the deadline passes.
+        """
+        if not self._slots.acquire(blocking=False):
+            self._update(rejected=1)
+            raise TranscriptionQueueFull("Transcription queue is full, try again shortly")
+        cancelled = threading.Event()
+        self._update(queued=1)
+        try:
+            future = self._executor.submit(self._run, audio, options, cancelled, time.monotonic())
+        except Exception:
+            self._update(queued=-1)
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except FutureTimeoutError:
+            cancelled.set()
+            if future.cancel():
+                # Never started, so _run won't get to decrement it
+                self._update(queued=-1)
+            self._update(timeouts=1)
+            raise TranscriptionTimeout(f"Transcription did not finish within {timeout or self.timeout}s")
+
+    def stats(self):
+        """Queue depth, utilisation and real-time-factor metrics for sizing the pool."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['model_size'] = self.model_size
+        stats['compute_type'] = self.compute_type
+        stats['num_workers'] = self.num_workers
+        stats['cpu_threads'] = self.cpu_threads
+        stats['mean_real_time_factor'] = (
+            round(stats['processing_seconds'] / stats['audio_seconds'], 3) if stats['audio_seconds'] else None
+        )
+        return stats
@@ -18,6 +18,7 @@ urlpatterns = [
     
     # Image processing
     path('process-image/', views.process_image, name='process_image'),
+    path('process-voice-query/', views.process_voice_query, name='process_voice_query'),
     
     # Admin/Dashboard pages
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
@@ -25,10 +26,17 @@ urlpatterns = [
     path('analysis/list/', views.analysis_list, name='analysis_list'),
     path('analysis/<int:pk>/', views.analysis_detail, name='analysis_detail'),
     path('analysis/<int:pk>/delete/', views.analysis_delete, name='analysis_delete'),
+    path('analysis/<int:pk>/chat/', views.analysis_chat, name='analysis_chat'),
+    path('analysis/<int:pk>/similar/', views.analysis_similar, name='analysis_similar'),
     path('check-job/<str:job_id>/', views.check_job_status, name='check_job_status'),
+    path('analysis/export/', views.export_analyses, name='export_analyses'),
     
     # Speech to text
     path('speech-to-text/', views.speech_to_text, name='speech_to_text'),
+    path('speech-to-text/metrics/', views.transcription_metrics, name='transcription_metrics'),
+    
+    # Streamed LLM follow-ups to captions and transcripts
+    path('llm/follow-up/', views.llm_follow_up, name='llm_follow_up'),
     
     # recent analysis for a user
     path("recent-analyses/", views.recent_analyses, name="recent_analyses"),
@@ -1,10 +1,11 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from PIL import Image
 import io
 import base64
 from django.utils import timezone
+from django.core.handlers.asgi import ASGIRequest
 import logging
 from .models import ImageAnalysis, DetectedObject, UserProfile
 from .forms import UserRegistrationForm, UserLoginForm, UserProfileForm
@@ -22,20 +23,28 @@ from asgiref.sync import async_to_sync
 import asyncio
 import torch.multiprocessing as mp
 from .model_handler import ModelHandler
+from .fragment_cache import render_fragment, fragment_stats
+from .persistence import save_analysis
+from .audio import decode_audio, read_request_audio, save_debug_wav
+from .chat_sessions import ask_about_analysis
+from .embedding_index import add_embeddings, similar_analyses
+from .llm import LLMBusy, LLMClient, LLMError, LLMTimeout, follow_up_messages
+from .export import FORMATS as EXPORT_FORMATS, TABLES as EXPORT_TABLES, parse_bound, stream_export
 try:
     import django_rq
 except ImportError:
     raise ImportError("Please install django-rq: pip install django-rq")
 # from .speech_to_text import SpeechRecognizer
-from faster_whisper import WhisperModel
+from .transcription import TranscriptionService, TranscriptionQueueFull, TranscriptionTimeout, UnknownProfile, get_profile, worker_threads
+from .transcript_cache import audio_fingerprint, cache_metadata, lookup as lookup_transcript, store as store_transcript, transcribe_cached
+from .long_audio import JOB_KIND as TRANSCRIPTION_JOB, enqueue_transcription, is_long_audio, long_audio_profile, transcribe_locally, transcription_job_status
 import threading
 import tempfile
-from pydub import AudioSegment
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from django.conf import settings
 import time
 
-whisper_model = WhisperModel("small", device="cpu", compute_type="int8")
-
 # Set multiprocessing start method
 mp.set_start_method('spawn', force=True)
 
@@ -67,15 +76,18 @@ def home(request):
     try:
         # Get analyses based on authentication status
         if request.user.is_authenticated:
-            # Get the most recent analyses for the logged-in user
-            analyses = ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:5]
+            # Serve the user's most recent analyses from the fragment cache
+            recent_analyses_html = render_fragment(
+                'home', request.user.id, 'blog/recent_analyses_partial.html',
+                lambda: {'analyses': ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:5]}
+            )
         else:
             # No analyses for unauthenticated users
-            analyses = []
+            recent_analyses_html = ''
         
         # Prepare context data
         context = {
-            'analyses': analyses,
+            'recent_analyses_html': recent_analyses_html,
             'page_title': 'Home',
             'is_home': True  # Flag to identify home page in template
         }
@@ -85,7 +97,7 @@ def home(request):
     except Exception as e:
         logger.error(f"Error in home view: {str(e)}")
         return render(request, 'blog/home.html', {
-            'analyses': [],
+            'recent_analyses_html': '',
             'error': str(e),
             'page_title': 'Home',
             'is_home': True
@@ -110,8 +122,9 @@ def process_image_task(image_file, query_text="", user_id=None):
         image = Image.open(image_file).convert("RGB")
         logger.info(f"Processing image: {image_file}")
         
-        # Generate short caption (always)
-        short_caption = model_handler.generate_short_caption(image)
+        # Generate short caption (always), keeping the image embedding for similarity search
+        with model_handler.capture_embeddings() as embeddings:
+            short_caption = model_handler.generate_short_caption(image)
 
         # Process ONLY if user gave a query
         if query_text.strip():
@@ -127,20 +140,15 @@ def process_image_task(image_file, query_text="", user_id=None):
             'image': image_file,
             'short_caption': short_caption,
             'query_text': query_text if query_text.strip() else None,
-            'query_result': query_result
+            'query_result': query_result,
+            **model_handler.provenance(),
         }
         
         # Associate with user if user_id is provided
-        if user_id:
-            from django.contrib.auth.models import User
-            try:
-                user = User.objects.get(id=user_id)
-                analysis_data['user'] = user
-                logger.info(f"Associating analysis with user: {user.username}")
-            except User.DoesNotExist:
-                logger.warning(f"User with ID {user_id} not found")
+        attach_user(analysis_data, user_id)
         
-        analysis = ImageAnalysis.objects.create(**analysis_data)
+        analysis = save_analysis(analysis_data)
+        add_embeddings([analysis.id], embeddings, model_handler.model_version)
         
         logger.info(f"Created analysis record with ID: {analysis.id}")
         return analysis.id
@@ -148,6 +156,80 @@ def process_image_task(image_file, query_text="", user_id=None):
         logger.error(f"Error in process_image_task: {str(e)}")
         return None
 
+def attach_user(analysis_data, user_id):
+    """Add the uploading user to an analysis record, if they still exist."""
+    if not user_id:
+        return
+    from django.contrib.auth.models import User
+    try:
+        user = User.objects.get(id=user_id)
+        analysis_data['user'] = user
+        logger.info(f"Associating analysis with user: {user.username}")
+    except User.DoesNotExist:
+        logger.warning(f"User with ID {user_id} not found")
+
+@contextmanager
+def split_threads():
+    """Give torch only the cores Whisper leaves free while the two run side by side.
+
+    Whisper keeps its own ``CPU_THREADS`` pool; torch's intra-op pool is
+    process-wide, so it is shrunk for the overlap and restored afterwards.
+    """
+    total = torch.get_num_threads()
+    torch.set_num_threads(max(1, total - worker_threads()))
+    try:
+        yield
+    finally:
+        torch.set_num_threads(total)
+
+
+def process_voice_query_task(image_file, audio_bytes, user_id=None, profile=None):
+    """Background task for a spoken question about an image.
+
+    The image is decoded and captioned on a second thread while Whisper
+    transcribes the question, the two splitting the cores between them, then
+    the transcript is asked about the image with all of them.
+    """
+    try:
+        model_handler = ModelHandler.get_instance()
+
+        def prepare_image():
+            image = model_handler.prepare_image(image_file)
+            with model_handler.capture_embeddings() as embeddings:
+                return image, model_handler.generate_short_caption(image), embeddings
+
+        with split_threads(), ThreadPoolExecutor(max_workers=1) as executor:
+            image_stage = executor.submit(prepare_image)
+            started = time.perf_counter()
+            transcript = transcribe_cached(decode_audio(audio_bytes), profile)
+            transcription_time = time.perf_counter() - started
+            image, short_caption, embeddings = image_stage.result()
+
+        query_text = transcript['text']
+        logger.info(f"Transcribed voice query: {query_text}")
+        started = time.perf_counter()
+        query_result = model_handler.process_query(image, query_text) if query_text else None
+        query_time = time.perf_counter() - started
+
+        analysis_data = {
+            'image': image_file,
+            'short_caption': short_caption,
+            'query_text': query_text or None,
+            'query_result': query_result,
+            **model_handler.provenance(),
+            'transcription_time': round(transcription_time, 3),
+            'query_time': round(query_time, 3),
+        }
+        attach_user(analysis_data, user_id)
+
+        analysis = save_analysis(analysis_data)
+        add_embeddings([analysis.id], embeddings, model_handler.model_version)
+        logger.info(f"Created voice query analysis record with ID: {analysis.id}")
+        return analysis.id
+    except Exception as e:
+        logger.error(f"Error in process_voice_query_task: {str(e)}")
+        return None
+
 @login_required(login_url='blog:login')
 def process_image(request):
     """Handle image upload and processing."""
@@ -220,6 +302,74 @@ def process_image(request):
             'details': str(e)
         }, status=500)
 
+def analysis_payload(analysis, **extra):
+    """JSON for a finished analysis, as returned by the image job endpoints."""
+    return dict({
+        'analysis_id': analysis.id,
+        'image_url': analysis.image.url,
+        'short_caption': analysis.short_caption,
+        'query_text': analysis.query_text,
+        'query_result': analysis.query_result,
+        'transcription_time': analysis.transcription_time,
+        'query_time': analysis.query_time,
+    }, **extra)
+
+@login_required(login_url='blog:login')
+def process_voice_query(request):
+    """Accept an image and a spoken question together and answer them in one job."""
+    try:
+        if 'image' not in request.FILES or 'audio' not in request.FILES:
+            return JsonResponse({'error': 'Both an image and an audio file are required'}, status=400)
+
+        image_file = request.FILES['image']
+        audio_file = request.FILES['audio']
+        max_bytes = getattr(settings, 'STT_MAX_UPLOAD_BYTES', settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+        if audio_file.size > max_bytes:
+            return JsonResponse({'error': f"Audio upload exceeds {max_bytes} bytes"}, status=400)
+        audio_bytes = audio_file.read()
+
+        profile = request.POST.get('profile') or None
+        if profile:
+            get_profile(profile)
+        user_id = request.user.id
+        logger.info(f"Processing voice query for user: {request.user.username}")
+
+        try:
+            queue = django_rq.get_queue('default')
+            job = queue.enqueue(
+                'blog.views.process_voice_query_task',
+                args=(image_file, audio_bytes, user_id, profile),
+                job_timeout=1200,
+                result_ttl=86400
+            )
+            return JsonResponse({
+                'job_id': job.id,
+                'status': 'processing',
+                'message': 'Image and question uploaded and processing started'
+            })
+        except Exception as redis_error:
+            logger.error(f"Redis error: {str(redis_error)}")
+            # Fall back to direct processing without Redis
+            analysis_id = process_voice_query_task(image_file, audio_bytes, user_id, profile)
+            if analysis_id is None:
+                return JsonResponse({
+                    'status': 'failed',
+                    'error': 'Failed to process voice query directly'
+                }, status=500)
+            analysis = ImageAnalysis.objects.get(id=analysis_id)
+            return JsonResponse(analysis_payload(
+                analysis, status='completed', message='Voice query processed directly (Redis unavailable)'
+            ))
+
+    except UnknownProfile as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Error in process_voice_query view: {str(e)}")
+        return JsonResponse({
+            'error': 'Error processing voice query',
+            'details': str(e)
+        }, status=500)
+
 def register(request):
     """Handle user registration."""
     if request.user.is_authenticated:
@@ -289,13 +439,16 @@ def profile(request):
     else:
         form = UserProfileForm(instance=user_profile)
         
-    # Get user's analyses
-    user_analyses = ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:5]
+    # Get user's analyses from the fragment cache
+    user_analyses_html = render_fragment(
+        'profile', request.user.id, 'blog/profile_analyses_partial.html',
+        lambda: {'user_analyses': ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:5]}
+    )
     
     context = {
         'form': form,
         'user_profile': user_profile,
-        'user_analyses': user_analyses
+        'user_analyses_html': user_analyses_html
     }
     
     return render(request, 'blog/profile.html', context)
@@ -325,6 +478,13 @@ def admin_dashboard(request):
             # Safely add object_count attribute for template use
             analysis.object_count = 0
         
+        # Fragment cache hit rates for the per-user listings
+        try:
+            cache_stats = fragment_stats()
+        except Exception as cache_error:
+            logger.error(f"Error reading fragment cache stats: {str(cache_error)}")
+            cache_stats = {}
+        
         # Calculate success rate (assume all completed analyses are successful)
         success_rate = 100  # Default to 100% success
         recent_success_rate = 100
@@ -337,6 +497,7 @@ def admin_dashboard(request):
             'recent_objects_count': recent_objects_count,
             'success_rate': success_rate,
             'recent_success_rate': recent_success_rate,
+            'fragment_cache_stats': cache_stats,
             'user': request.user,  # Make user available in template
         }
         return render(request, 'blog/admin_dashboard.html', context)
@@ -387,7 +548,8 @@ def analysis_detail(request, pk):
         detected_objects = []
         return render(request, 'blog/analysis_detail.html', {
             'analysis': analysis,
-            'detected_objects': detected_objects
+            'detected_objects': detected_objects,
+            'chat_turns': analysis.chat_turns.all(),
         })
     except Exception as e:
         logger.error(f"Error in analysis_detail view: {str(e)}")
@@ -404,6 +566,38 @@ def analysis_delete(request, pk):
         return redirect('blog:analysis_list')
     return redirect('blog:analysis_list')
 
+@login_required
+def export_analyses(request):
+    """Stream analyses or detected objects as JSONL, CSV or Parquet."""
+    fmt = request.GET.get('format', 'jsonl')
+    table = request.GET.get('table', 'analyses')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({'error': f'Unsupported format: {fmt}'}, status=400)
+    if table not in EXPORT_TABLES:
+        return JsonResponse({'error': f'Unsupported table: {table}'}, status=400)
+    
+    try:
+        filters = {
+            'start': parse_bound(request.GET.get('start')),
+            'end': parse_bound(request.GET.get('end'), end=True),
+            'model_version': request.GET.get('model_version'),
+        }
+        # Regular users can only export their own analyses
+        if request.user.is_staff:
+            filters['user_id'] = int(request.GET['user']) if request.GET.get('user') else None
+        else:
+            filters['user_id'] = request.user.id
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    logger.info(f"Exporting {table} as {fmt} for {request.user.username}")
+    response = StreamingHttpResponse(
+        stream_export(fmt, table, **filters),
+        content_type=EXPORT_FORMATS[fmt]['content_type']
+    )
+    response['Content-Disposition'] = f'attachment; filename="{table}.{EXPORT_FORMATS[fmt]["extension"]}"'
+    return response
+
 def get_model_prediction(image):
     cache_key = f"image_analysis_{hash(image.tobytes())}"
     result = cache.get(cache_key)
@@ -462,8 +656,9 @@ async def process_query(image, query="What is in this image?"):
         logger.error(f"Error in process_query: {str(e)}")
         return f"Error processing query: {query}"
 
+@login_required
 def check_job_status(request, job_id):
-    """Check the status of a background job."""
+    """Check the status of one of the user's background jobs."""
     try:
         # Get the job from Redis
         try:
@@ -480,6 +675,15 @@ def check_job_status(request, job_id):
                 'status': 'failed',
                 'error': 'Job not found'
             }, status=404)
+
+        if job.meta.get('kind') == TRANSCRIPTION_JOB:
+            # Other users' jobs are reported as missing, not forbidden
+            if job.meta.get('user_id') != request.user.id:
+                return JsonResponse({
+                    'status': 'failed',
+                    'error': 'Job not found'
+                }, status=404)
+            return JsonResponse(transcription_job_status(job))
             
         if job.is_failed:
             return JsonResponse({
@@ -499,14 +703,8 @@ def check_job_status(request, job_id):
                 
             # Get the analysis object
             try:
-                analysis = ImageAnalysis.objects.get(id=analysis_id)
-                return JsonResponse({
-                    'status': 'completed',
-                    'image_url': analysis.image.url,
-                    'short_caption': analysis.short_caption,
-                    'query_text': analysis.query_text,
-                    'query_result': analysis.query_result
-                })
+                analysis = ImageAnalysis.objects.get(id=analysis_id, user=request.user)
+                return JsonResponse(analysis_payload(analysis, status='completed'))
             except ImageAnalysis.DoesNotExist:
                 return JsonResponse({
                     'status': 'failed',
@@ -593,8 +791,11 @@ def check_job_status(request, job_id):
     
 @login_required
 def recent_analyses(request):
-    analyses = ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:10]
-    return render(request, "blog/recent_analyses_partial.html", {"analyses": analyses})
+    html = render_fragment(
+        'recent_analyses', request.user.id, 'blog/recent_analyses_partial.html',
+        lambda: {'analyses': ImageAnalysis.objects.filter(user=request.user).order_by('-upload_date')[:10]}
+    )
+    return HttpResponse(html)
 
 @csrf_exempt
 @login_required
@@ -606,43 +807,245 @@ def speech_to_text(request):
         return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        audio_b64 = data.get("audio_base64")
-        logger.info(f"Received audio: {type(audio_b64)}, length: {len(audio_b64) if audio_b64 else 'None'}")
+        # Decoding profile from ?profile= or a multipart field, else WHISPER_DEFAULT_PROFILE
+        profile = request.GET.get('profile') or request.POST.get('profile')
+        if profile:
+            get_profile(profile)
 
-        if not audio_b64:
+        # Decode WebM/Opus straight to 16 kHz mono float32 samples in memory.
+        # Accepts raw audio/webm or audio/ogg bodies, multipart uploads and
+        # the original JSON {"audio_base64": ...} payload.
+        audio = read_request_audio(request)
+
+        if audio is None:
             return JsonResponse({'status': 'error', 'message': 'No audio provided'}, status=400)
-        
-        # Decode base64 to bytes
-        header_removed = audio_b64.split(",")[1] if "," in audio_b64 else audio_b64
-        audio_bytes = base64.b64decode(header_removed)
-        logger.info(f"Decoded audio bytes: {len(audio_bytes)}")
-
-        # Convert WebM/Opus to WAV using pydub
-        audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="webm")
-
-        # Save WAV file in MEDIA_ROOT/recorded_audio
-        recorded_dir = os.path.join(settings.MEDIA_ROOT, "recorded_audio")
-        os.makedirs(recorded_dir, exist_ok=True)  # create folder if not exists
-        tmp_wav_file_path = os.path.join(recorded_dir, f"audio_{int(time.time())}.wav")
-        audio_segment.export(tmp_wav_file_path, format="wav")
-        logger.info(f"WAV file saved for debugging: {tmp_wav_file_path}")
-
-        # Transcribe using Whisper
-        segments, info = whisper_model.transcribe(tmp_wav_file_path, beam_size=5)
-        text = " ".join([segment.text for segment in segments])
-        logger.info(f"Transcribed text: {text}, language: {info.language}, probability: {info.language_probability}")
+
+        # Optionally keep a WAV copy in MEDIA_ROOT/recorded_audio for debugging
+        debug_wav_path = save_debug_wav(audio)
+
+        # Long recordings are split at silences and transcribed as background
+        # jobs, by default with their own profile: key the cache by the one used
+        long_audio = is_long_audio(audio)
+        if long_audio:
+            profile = long_audio_profile(profile)
+
+        # Retried uploads of the same clip are answered from the transcript cache
+        fingerprint = audio_fingerprint(audio, profile)
+
+        if long_audio:
+            transcript, tier = lookup_transcript(fingerprint)
+            if transcript is not None:
+                return JsonResponse(dict(transcript, status='success', file_path=debug_wav_path, cache=cache_metadata(tier)))
+            try:
+                job = enqueue_transcription(audio, request.user.id, profile, fingerprint)
+                return JsonResponse({
+                    'job_id': job.id,
+                    'status': 'processing',
+                    'message': 'Audio uploaded and transcription started',
+                    'progress': {'completed': 0, 'total': len(job.meta['chunk_ids'])},
+                    'cache': cache_metadata(None),
+                })
+            except Exception as redis_error:
+                logger.error(f"Redis error: {str(redis_error)}")
+                # Fall back to transcribing the chunks in this process
+                transcript = transcribe_locally(audio, profile)
+                store_transcript(fingerprint, transcript)
+                return JsonResponse(dict(transcript, status='success', file_path=debug_wav_path, cache=cache_metadata(None)))
+
+        # Transcribe using Whisper on the profile's bounded transcription pool
+        result = transcribe_cached(audio, profile, fingerprint)
+        text = result['text']
+        logger.info(f"Transcribed text: {text}, language: {result['language']}, probability: {result['language_probability']}")
 
         print("Detected text:", text)
 
         return JsonResponse({
             "status": "success",
             "text": text,
-            "language": info.language,
-            "language_probability": info.language_probability,
-            "file_path": tmp_wav_file_path 
+            "language": result['language'],
+            "language_probability": result['language_probability'],
+            "file_path": debug_wav_path,
+            "profile": result['profile'],
+            "queue_wait": round(result['queue_wait'], 3),
+            "real_time_factor": round(result['real_time_factor'], 3),
+            "cache": result['cache']
         })
 
+    except UnknownProfile as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except TranscriptionQueueFull as e:
+        logger.warning(f"Speech-to-text rejected: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+    except TranscriptionTimeout as e:
+        logger.warning(f"Speech-to-text timed out: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
     except Exception as e:
         logger.exception("Speech-to-text failed")
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+@login_required
+def llm_follow_up(request):
+    """Stream an LLM answer to a follow-up about an analysis and/or a transcript.
+
+    Takes JSON {"question", "analysis_id"?, "transcript"?} and streams the
+    answer back as plain text while it is generated.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        question = (data.get('question') or '').strip()
+        if not question:
+            return JsonResponse({'status': 'error', 'message': 'No question provided'}, status=400)
+        analysis = None
+        if data.get('analysis_id'):
+            analysis = get_object_or_404(ImageAnalysis, pk=data['analysis_id'], user=request.user)
+        messages = follow_up_messages(question, analysis, data.get('transcript'))
+
+        client = LLMClient.get_instance()
+        # Match the iterator to the server so Django streams it instead of buffering
+        if isinstance(request, ASGIRequest):
+            tokens = async_to_sync(client.astream_chat)(messages)
+        else:
+            tokens = client.stream_chat(messages)
+        response = StreamingHttpResponse(_stream_tokens(tokens), content_type='text/plain; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    except LLMBusy as e:
+        logger.warning(f"LLM follow-up rejected: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+    except LLMTimeout as e:
+        logger.warning(f"LLM follow-up timed out: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=504)
+    except LLMError as e:
+        logger.error(f"LLM follow-up failed: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+
+@login_required
+def analysis_chat(request, pk):
+    """Answer the next question in a multi-turn chat about an analysed image.
+
+    Takes JSON {"question"}. The conversation's KV cache stays in this
+    process between turns, so follow-ups don't re-encode the image.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Method not allowed'}, status=405)
+
+    analyses = ImageAnalysis.objects.all() if request.user.is_staff else request.user.analyses.all()
+    analysis = get_object_or_404(analyses, pk=pk)
+    try:
+        data = json.loads(request.body)
+        question = (data.get('question') or '').strip()
+        if not question:
+            return JsonResponse({'status': 'error', 'message': 'No question provided'}, status=400)
+        answer, info = ask_about_analysis(analysis, question, request.user)
+        return JsonResponse({
+            'status': 'success',
+            'question': question,
+            'answer': answer,
+            'reused_cache': info['reused'],
+            'prefill_tokens': info['prefill_tokens'],
+            'latency': round(info['latency'], 3),
+        })
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': f'Invalid request: {str(e)}'}, status=400)
+    except Exception as e:
+        logger.error(f"Error in analysis chat: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+@login_required
+def analysis_similar(request, pk):
+    """The analysed images most similar to this one, by vision embedding.
+
+    Optional ?k= (default 10, at most 50). Users only find their own
+    analyses, staff everyone's.
+    """
+    analyses = ImageAnalysis.objects.all() if request.user.is_staff else request.user.analyses.all()
+    analysis = get_object_or_404(analyses, pk=pk)
+    try:
+        k = int(request.GET.get('k', 10))
+        if not 1 <= k <= 50:
+            raise ValueError('k must be between 1 and 50')
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': f'Invalid request: {str(e)}'}, status=400)
+
+    try:
+        neighbours = similar_analyses(analysis, analyses, k, restrict=not request.user.is_staff)
+    except Exception as e:
+        logger.error(f"Error finding analyses similar to {pk}: {str(e)}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+    return JsonResponse({
+        'status': 'success',
+        'analysis_id': analysis.id,
+        'indexed': neighbours is not None,
+        'results': [
+            {
+                'analysis_id': neighbour.id,
+                'score': round(score, 4),
+                'short_caption': neighbour.short_caption,
+                'image_url': neighbour.image.url if neighbour.image else None,
+                'url': reverse('blog:analysis_detail', args=[neighbour.id]),
+            }
+            for neighbour, score in neighbours or []
+        ],
+    })
+
+class _TokenBody:
+    """Streaming response body that closes its token stream when Django closes the response.
+
+    A generator that never started ignores close(), so without this a
+    client that leaves before the first token would keep the LLM slot.
+    """
+
+    def __init__(self, stream, tokens):
+        self._stream = stream
+        self._tokens = tokens
+
+    def close(self):
+        self._tokens.close()
+
+
+class _SyncTokenBody(_TokenBody):
+    def __iter__(self):
+        return self._stream
+
+
+class _AsyncTokenBody(_TokenBody):
+    def __aiter__(self):
+        return self._stream
+
+
+def _stream_tokens(tokens):
+    """Pass tokens through, ending the stream with a note if generation fails midway."""
+    if hasattr(tokens, '__aiter__'):
+        async def stream():
+            try:
+                async for token in tokens:
+                    yield token
+            except (LLMTimeout, LLMError) as e:
+                logger.error(f"LLM follow-up interrupted: {str(e)}")
+                yield f"\n\n[Response interrupted: {str(e)}]"
+        return _AsyncTokenBody(stream(), tokens)
+
+    def stream():
+        try:
+            yield from tokens
+        except (LLMTimeout, LLMError) as e:
+            logger.error(f"LLM follow-up interrupted: {str(e)}")
+            yield f"\n\n[Response interrupted: {str(e)}]"
+    return _SyncTokenBody(stream(), tokens)
+
+@login_required
+def transcription_metrics(request):
+    """Report transcription pool queue depth and real-time factor."""
+    if not TranscriptionService.is_loaded():
+        # Don't load Whisper just to report that nothing has run yet
+        return JsonResponse({'loaded': False})
+    return JsonResponse({
+        'loaded': True,
+        'models': {f"{size}/{compute_type}": service.stats()
+                   for (size, compute_type), service in TranscriptionService.loaded().items()},
+    })
@@ -13,4 +13,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangoproject.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from blog.streaming import get_scope_user_id, is_same_origin, speech_socket  # noqa: E402
+
+WEBSOCKET_ROUTES = {
+    '/ws/speech/': speech_socket,
+}
+
+
+async def application(scope, receive, send):
+    """Serve Django over HTTP and the real-time speech WebSocket alongside it."""
+    if scope['type'] == 'websocket':
+        consumer = WEBSOCKET_ROUTES.get(scope['path'])
+        if consumer is None:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        if not is_same_origin(scope):
+            # Another site's page trying to use the visitor's session cookie
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4403})
+            return
+        scope = dict(scope, user_id=await get_scope_user_id(scope))
+        return await consumer(scope, receive, send)
+    return await django_application(scope, receive, send)
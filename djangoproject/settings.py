@@ -75,11 +75,53 @@ WSGI_APPLICATION = 'djangoproject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
+# Select the persistence profile with PERSISTENCE_PROFILE=sqlite|postgres
+PERSISTENCE_PROFILE = os.environ.get('PERSISTENCE_PROFILE', 'sqlite')
+
+PERSISTENCE_PROFILES = {
+    # Tuned for several RQ workers and web processes writing concurrently
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+        'OPTIONS': {
+            'timeout': 20,  # busy timeout in seconds before "database is locked"
+            'transaction_mode': 'IMMEDIATE',  # take the write lock up front, no upgrade deadlocks
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'  # 256MB
+                'PRAGMA cache_size=-65536;'  # 64MB
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+        # On disk, not in memory: shared-cache memory databases fail concurrent
+        # writers at once instead of honouring the busy timeout and IMMEDIATE mode
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    },
+    'postgres': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'contextual_object_detection'),
+        'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 60,
+        'CONN_HEALTH_CHECKS': True,
+    },
+}
+
+DATABASES = {
+    'default': PERSISTENCE_PROFILES[PERSISTENCE_PROFILE],
+}
+
+# Batch completed analyses from concurrent jobs into a single transaction; the
+# workers of `manage.py inference_workers` / `autoscale_workers` hand theirs to
+# the supervising process, which commits them together
+WRITE_COALESCING = {
+    'ENABLED': os.environ.get('WRITE_COALESCING', '0') == '1',
+    'MAX_BATCH': 50,
+    'MAX_DELAY': 0.05,  # seconds to wait for more rows before committing
+    'REPLY_TIMEOUT': 30,  # seconds an inference worker waits for its pool's writer
 }
 
 
@@ -127,6 +169,196 @@ STATICFILES_DIRS = [
 MEDIA_URL ='/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR,'media')
 
+# Whisper transcription pool shared by all speech-to-text requests in a process
+WHISPER = {
+    'MODEL_SIZE': 'small',
+    'DEVICE': 'cpu',
+    'COMPUTE_TYPE': 'int8',
+    'NUM_WORKERS': int(os.environ.get('WHISPER_NUM_WORKERS', 2)),  # concurrent transcriptions
+    'CPU_THREADS': 0,  # intra-op threads per worker, 0 = cores / NUM_WORKERS
+    'MAX_QUEUE': 8,  # requests allowed to wait before new ones get a 503
+    'TIMEOUT': 120,  # seconds before a request is cancelled with a 504
+}
+
+# Ollama server used for streamed LLM follow-ups (see blog/llm.py)
+OLLAMA = {
+    'HOST': os.environ.get('OLLAMA_HOST', 'http://localhost:11434'),
+    'MODEL': os.environ.get('OLLAMA_MODEL', 'llama3.1'),
+    'MAX_CONCURRENCY': 2,  # generations in flight per process
+    'POOL_SIZE': 4,  # kept-alive HTTP connections to the server
+    'TIMEOUT': 60,  # overall deadline per request, including the wait for a slot
+    'CONNECT_TIMEOUT': 5,
+    'KEEP_ALIVE': '10m',  # how long Ollama keeps the model loaded between requests
+}
+
+# Local store of preconverted SmolVLM processor/model artifacts, written once by
+# `manage.py export_model_artifacts`. Workers load weights from it already in
+# DTYPE and memory-mapped, without touching the Hugging Face hub.
+# `manage.py bench_cold_start` compares worker start-up with the hub cache.
+MODEL_ARTIFACTS = {
+    'DIR': os.environ.get('MODEL_ARTIFACTS_DIR', str(BASE_DIR / 'model_artifacts')),
+    'DTYPE': os.environ.get('MODEL_ARTIFACTS_DTYPE', 'float32'),  # CPU weights dtype; CUDA always uses bfloat16
+    'OFFLINE': os.environ.get('MODEL_ARTIFACTS_OFFLINE', '') == '1',  # fail instead of falling back to the hub
+    'VERIFY_ON_LOAD': False,  # re-hash every file at start-up (slow for large models)
+}
+
+# Speculative (assisted) decoding for SmolVLM: the draft model proposes a few
+# tokens and the target model verifies them in one pass. Greedy answers are
+# unchanged, they just decode faster when the draft is usually right. The
+# target replaces the default 256M model while this is enabled.
+# `manage.py bench_speculative` reports tokens/sec and draft acceptance.
+VLM_SPECULATIVE = {
+    'ENABLED': os.environ.get('VLM_SPECULATIVE', '') == '1',
+    'TARGET_MODEL': 'HuggingFaceTB/SmolVLM-500M-Instruct',
+    'DRAFT_MODEL': 'HuggingFaceTB/SmolVLM-256M-Instruct',
+    'NUM_ASSISTANT_TOKENS': 5,  # initial draft length, adapted to the acceptance rate
+    # Which prompt types draft; short captions are too short to win back the draft's cost
+    'PROMPTS': {'short_caption': False, 'normal_caption': True, 'query': True},
+}
+
+# Compiled SmolVLM decoding on a preallocated static KV cache. Each bucket is
+# a max prompt+answer length with its own cache, compiled at worker start;
+# longer requests fall back to the eager path. `manage.py bench_compiled_decode`
+# compares both paths.
+VLM_COMPILE = {
+    'ENABLED': os.environ.get('VLM_COMPILE', '') == '1',
+    'BUCKETS': [512, 1280, 2048],  # one image tile is 64 tokens, a 4x4 split plus global image ~1100
+    'THREADS': int(os.environ.get('VLM_THREADS', 0)),  # intra-op threads per worker, 0 = torch default
+}
+
+# Hot swap of the VLM checkpoint in running workers (`manage.py model_swap set <model id>`).
+# Each worker loads the new checkpoint beside the old one (twice the weights
+# for a moment), answers CHECK_PROMPT about CHECK_IMAGE (a generated gradient
+# if None) and switches between two jobs only if the answer is non-empty.
+VLM_HOT_SWAP = {
+    'POLL_S': 10,  # how often workers look for a new target
+    'CHECK_IMAGE': None,
+    'CHECK_PROMPT': "What is in this image?",
+    'CHECK_MAX_NEW_TOKENS': 20,
+    'HISTORY': 20,  # targets kept for rollback
+}
+
+# Multi-turn chat about an analysed image (see blog/chat_sessions.py). Each
+# web process keeps the KV cache of recent conversations so a follow-up only
+# prefills its own tokens; `manage.py bench_chat_sessions` measures the gain.
+CHAT_SESSIONS = {
+    'MEMORY_BUDGET_MB': 512,  # KV cache kept per process, least recently used evicted first
+    'MAX_NEW_TOKENS': 100,  # answer length per turn
+}
+
+# Named Whisper decoding profiles, chosen per request with ?profile=<name>.
+# Each profile gets its own pool per MODEL_SIZE/COMPUTE_TYPE it uses.
+# `manage.py bench_stt_profiles` reports latency and WER for each of them.
+WHISPER_PROFILES = {
+    # Short spoken questions about an image: greedy, silence trimmed. The language
+    # is detected per clip; WHISPER_VOICE_QUERY_LANGUAGE=en pins it and skips the
+    # language-ID pass, but then mistranscribes every other language
+    'voice_query': {
+        'MODEL_SIZE': 'small',
+        'COMPUTE_TYPE': 'int8',
+        'BEAM_SIZE': 1,
+        'LANGUAGE': os.environ.get('WHISPER_VOICE_QUERY_LANGUAGE') or None,
+        'VAD_FILTER': True,
+        'TEMPERATURE': [0.0, 0.4, 0.8],
+    },
+    # Same, on the smaller English-only model (opt in with ?profile=voice_query_fast)
+    'voice_query_fast': {
+        'MODEL_SIZE': 'base.en',
+        'COMPUTE_TYPE': 'int8',
+        'BEAM_SIZE': 1,
+        'LANGUAGE': 'en',
+        'VAD_FILTER': True,
+        'TEMPERATURE': [0.0, 0.4, 0.8],
+    },
+    # Longer free-form speech in any language
+    'dictation': {
+        'MODEL_SIZE': 'small',
+        'COMPUTE_TYPE': 'int8',
+        'BEAM_SIZE': 5,
+        'LANGUAGE': None,  # auto-detect
+        'VAD_FILTER': False,
+        'TEMPERATURE': [0.0, 0.2, 0.4, 0.6, 0.8, 1.0],
+    },
+}
+WHISPER_DEFAULT_PROFILE = os.environ.get('WHISPER_DEFAULT_PROFILE', 'voice_query')
+
+# Recordings longer than THRESHOLD_S are split at silences and transcribed as
+# parallel RQ jobs (one per chunk); clients poll check-job for progress
+STT_LONG_AUDIO = {
+    'THRESHOLD_S': 30,
+    'CHUNK_S': 30,  # Whisper's own context window
+    'SEARCH_S': 5,  # how far back from a chunk's end to look for a pause
+    'PROFILE': 'dictation',
+    'QUEUE': 'default',  # check-job looks jobs up on the default queue
+    'JOB_TIMEOUT': 600,
+}
+
+# Real-time speech recognition over the /ws/speech/ WebSocket (see blog/streaming.py)
+STREAMING_STT = {
+    'VAD_AGGRESSIVENESS': 2,  # webrtcvad 0-3, higher rejects more non-speech
+    'START_FRAMES': 3,  # voiced 30 ms frames needed to open an utterance
+    'END_SILENCE_MS': 300,  # silence that closes an utterance
+    'PADDING_MS': 150,  # pre-roll kept before the detected start
+    'MAX_UTTERANCE_S': 15,  # force a final for long unbroken speech
+    'PARTIAL_INTERVAL_MS': 1000,  # new audio needed before another partial
+    'CONTEXT_WORDS': 50,  # rolling context passed to Whisper as initial_prompt
+    'PROFILE': 'voice_query',  # greedy decoding keeps finals under a second
+}
+
+# Keep a WAV copy of every speech-to-text request in MEDIA_ROOT/recorded_audio
+STT_SAVE_DEBUG_AUDIO = os.environ.get('STT_SAVE_DEBUG_AUDIO', '0') == '1'
+# Largest raw audio/* body speech_to_text will stream into the decoder
+STT_MAX_UPLOAD_BYTES = 52428800  # 50MB
+
+# Retention policies for media artifacts, applied by `manage.py apply_retention`
+# Paths are relative to MEDIA_ROOT
+RETENTION_POLICIES = {
+    'debug_audio': {'path': 'recorded_audio', 'action': 'delete', 'max_age_hours': 24},
+    'upload_originals': {
+        'path': 'uploads', 'action': 'archive', 'max_age_hours': 24 * 90,
+        'cold_path': 'cold', 'effort': 80,  # lossless WebP compression effort, 0-100
+    },
+    'orphaned_uploads': {'path': 'uploads', 'action': 'collect_orphans', 'min_age_hours': 1},
+    'orphaned_cold': {'path': 'cold', 'action': 'collect_orphans', 'min_age_hours': 1},
+    'orphaned_profile_pics': {'path': 'profile_pics', 'action': 'collect_orphans', 'min_age_hours': 1},
+}
+RETENTION_BATCH_SIZE = 500  # files examined per policy per run
+RETENTION_STATE_FILE = os.path.join(BASE_DIR, '.retention_state.json')
+
+# Re-captioning of analyses from an older model/prompt/params (`manage.py backfill_captions`)
+RECAPTION_BACKFILL = {
+    'QUEUE': 'low',
+    'WINDOW': 1000,     # stale rows planned at a time, sorted by image size
+    'BATCH_SIZE': 16,   # analyses per RQ job
+    'RATE': 2.0,        # analyses enqueued per second
+    'MAX_PENDING': 4,   # wait while this many jobs are already queued
+    'STATE_FILE': os.path.join(BASE_DIR, '.recaption_backfill.json'),
+}
+
+# Bulk captioning of a directory or archive (`manage.py caption_dir <path>`)
+CAPTION_DIR = {
+    'BATCH_SIZE': 8,      # images per batched generate
+    'CHUNK_SIZE': 64,     # rows per bulk_create, and per checkpoint
+    'DECODE_WORKERS': 4,  # threads reading and decoding ahead of the model
+    'PREFETCH': 32,       # decoded images kept ready
+    'STATE_FILE': os.path.join(BASE_DIR, '.caption_dir_state.json'),
+}
+
+# Vision embeddings of analysed images for "find similar" (`manage.py embedding_index`).
+# One append-only float16 store per model; past IVF_THRESHOLD rows searches go
+# through the store's IVF-PQ index once `embedding_index build` has made one.
+EMBEDDING_INDEX = {
+    'ENABLED': True,
+    'DIR': os.environ.get('EMBEDDING_INDEX_DIR', os.path.join(BASE_DIR, 'embeddings')),
+    'IVF_THRESHOLD': 200000,  # rows before the index is used
+    'NLIST': 0,               # k-means cells; 0: sqrt(rows)
+    'NPROBE': 16,             # cells scanned per query
+    'PQ_M': 48,               # one-byte sub-quantizers per vector; must divide the dimension (768)
+    'RERANK': 50,             # approximate candidates re-scored exactly per result
+    'TRAIN_SAMPLE': 65536,    # rows the index is trained on
+    'CHUNK_ROWS': 65536,      # rows scored at a time by exact scans
+}
+
 # For larger file uploads
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
@@ -181,6 +413,47 @@ RQ_QUEUES = {
 RQ_SHOW_ADMIN_LINK = True
 RQ_ASYNC = True  # Enable async processing
 
+# Autoscaling of model-resident workers (manage.py autoscale_workers)
+RQ_AUTOSCALER = {
+    'QUEUES': ['high', 'default', 'low'],
+    'MIN_WORKERS': int(os.environ.get('RQ_MIN_WORKERS', 1)),
+    'MAX_WORKERS': int(os.environ.get('RQ_MAX_WORKERS', 4)),
+    'MEMORY_BUDGET_MB': int(os.environ.get('RQ_MEMORY_BUDGET_MB', 8192)),  # total PSS all workers may use
+    'WORKER_MEMORY_MB': 1500,  # PSS estimate per worker until one has been measured
+    'TARGET_WAIT_S': 30,       # scale up when the oldest job waited longer than this
+    'JOBS_PER_WORKER': 2,      # ... or the backlog exceeds this many jobs per worker
+    'SCALE_DOWN_IDLE_S': 300,  # retire one worker after the queues were empty this long
+    'COOLDOWN_S': 120,         # no scale-down sooner than this after any change
+    'STARTUP_S': 30,           # a new worker's model load; long waits add no more workers meanwhile
+    'INTERVAL_S': 5,
+}
+
+# Cache configuration
+# Fragments live in Redis so invalidations from RQ workers reach the web processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+    },
+    'transcripts': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/2',
+    },
+}
+
+# Per-user fragment caching for home/profile/recent analyses listings
+FRAGMENT_CACHE_ALIAS = 'fragments'
+FRAGMENT_CACHE_TIMEOUT = 600  # 10 minutes
+
+# Speech-to-text results keyed by a hash of the decoded PCM and decoding profile:
+# a per-process LRU in front of the shared cache below
+TRANSCRIPT_CACHE_ALIAS = 'transcripts'
+TRANSCRIPT_CACHE_TIMEOUT = 86400  # 24 hours
+TRANSCRIPT_CACHE_LRU_SIZE = 256  # transcripts kept in each process
+
 # CSRF Settings
 CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 CSRF_COOKIE_HTTPONLY = False  # False allows JavaScript to access the cookie